@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""Measure how many tweet captions can be generated per second.
+
+Inmates come from a synthetic jail report, so the numbers are
+reproducible. Run from the repository root:
+
+    python -m benchmarks.caption_benchmark --inmates 5000
+"""
+import argparse
+import copy
+import time
+
+from dentonpolice import fakejail
+from dentonpolice import jail
+from dentonpolice import twitter
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--inmates', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+    inmates = jail.parse_inmates(
+        fakejail.make_synthetic_report(count=args.inmates),
+    )
+    # Captions shorten the charges in place, so start fresh every time.
+    charges = [copy.deepcopy(inmate.charges) for inmate in inmates]
+    timings = []
+    for _ in range(args.repeat):
+        for inmate, original in zip(inmates, charges):
+            inmate.charges = copy.deepcopy(original)
+        start = time.perf_counter()
+        for inmate in inmates:
+            twitter.get_twitter_message(inmate)
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    print(
+        '{count} captions in {best:.3f} s (best of {repeat}): '
+        '{rate:,.0f} captions/s'.format(
+            count=len(inmates),
+            best=best,
+            repeat=args.repeat,
+            rate=len(inmates) / best,
+        )
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Measure the memory used by a fully loaded inmate history.
+
+A synthetic log is written to a temporary file, with each inmate logged
+with a tweet like the ones the crawler records. It is then loaded the
+way the crawler and the query API load it, with and without sharing
+repeated values, and the memory held by the loaded records is reported.
+Run from the repository root:
+
+    python -m benchmarks.history_memory_benchmark --records 20000
+"""
+import argparse
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+
+from dentonpolice import fakejail
+from dentonpolice import jail
+from dentonpolice import serialization
+
+
+def _make_tweet(index, inmate):
+    # Roughly the shape of what Twython returns for a posted tweet.
+    return {
+        'created_at': 'Sun Apr 19 0{} :00:00 +0000 2015'.format(index % 10),
+        'id': 588000000000000000 + index,
+        'id_str': str(588000000000000000 + index),
+        'text': inmate.name,
+        'source': '<a href="https://github.com/bwbaugh">dentonpolice</a>',
+        'entities': {'hashtags': [], 'urls': [], 'user_mentions': []},
+        'user': {
+            'id': 1234567,
+            'id_str': '1234567',
+            'name': 'Denton Police Mugshots',
+            'screen_name': 'dentonpolice',
+            'description': 'Mug shots from the Denton City Jail.',
+            'followers_count': 1000 + index,
+        },
+    }
+
+
+def _write_log(path, records):
+    inmates = jail.parse_inmates(
+        fakejail.make_synthetic_report(count=records),
+    )
+    with open(path, mode='w', encoding='utf-8') as f:
+        for index, inmate in enumerate(inmates):
+            data = inmate._asdict()
+            data['tweet'] = _make_tweet(index, inmate)
+            f.write(serialization.dumps(data) + '\n')
+
+
+def _measure(path, **kwargs):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    read = serialization.make_reader(**kwargs)
+    with open(path, mode='rb') as f:
+        records = [read(line) for line in f]
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+    return held, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--records', type=int, default=20000)
+    args = parser.parse_args(argv)
+    fd, path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        _write_log(path, args.records)
+        print(
+            '{records:,d} records, {size:,d} bytes on disk ({backend})'.format(
+                records=args.records,
+                size=os.path.getsize(path),
+                backend=serialization.BACKEND,
+            )
+        )
+        cases = [
+            ('whole records', {}),
+            ('whole records, shared', {
+                'interner': serialization.Interner(),
+            }),
+            ('past records', {
+                'fields': serialization.PAST_RECORD_FIELDS,
+            }),
+            ('past records, shared', {
+                'fields': serialization.PAST_RECORD_FIELDS,
+                'interner': serialization.Interner(),
+                'tweet_fields': serialization.PAST_TWEET_FIELDS,
+            }),
+        ]
+        for name, kwargs in cases:
+            held, elapsed = _measure(path, **kwargs)
+            print(
+                '{name:>24}: {held:>12,d} bytes held '
+                '({per:,.0f} per record), loaded in {elapsed:.3f} s'.format(
+                    name=name,
+                    held=held,
+                    per=held / args.records,
+                    elapsed=elapsed,
+                )
+            )
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -13,60 +13,99 @@ http://dpdjailview.cityofdenton.com/
 
 Configuration is first required in order to post to TwitPic or Twitter.
 
-If run as __main__, will loop and continuously check the report page.
-To run only once, execute this module's main() function.
+If run as __main__, will loop and continuously check the report page,
+or each of the configured `sites` concurrently. To check each site only
+once, and then make any posts that are ready, pass `--once`. To profile
+the next few cycles, pass `--profile N`; see the `profiling` module.
+While looping, the crawler's health and metrics are served over HTTP if
+`status.port` is set; see the `monitor` module. To answer queries about
+the logged inmates over HTTP instead, run the `serve` command; see the
+`api` module.
+
+Importing this module does nothing. Slow imports and clients, such as
+boto and the S3 connection, or raven and Sentry, are only set up when
+first needed, so that restarts and one-shot runs start quickly.
 """
+import argparse
 import logging
 import signal
 import sys
-import time
 
-import boto.s3
-import raven
-import raven.conf
-import raven.handlers.logging
 import staticconf
 
 from . import config
-from . import crawler
+from . import coordination
+from . import outbox
+from . import profiling
+from . import s3
+from . import scheduler
+from . import sites
 
 
-# How often to check the City Jail Custody Report webpage
-SECONDS_BETWEEN_CHECKS = 60 * 5
-
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-)
-# Silence unneeded debug statements from boto.
-logging.getLogger('boto').setLevel(logging.INFO)
-# Don't write config values to the log. We don't use schemas yet.
-logging.getLogger('staticconf.config').setLevel(logging.WARNING)
-
 log = logging.getLogger(__name__)
 
-config.load_config()
 
-
-if staticconf.read('aws.s3.bucket', default=None):
-    conn = boto.s3.connect_to_region(
-        region_name=staticconf.read('aws.s3.region'),
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m dentonpolice',
+        description='Crawl jail rosters and post new inmates to Twitter.',
+    )
+    parser.add_argument(
+        'command',
+        nargs='?',
+        default='crawl',
+        choices=('crawl', 'serve'),
+        help='Crawl the rosters (the default), or serve the query API.',
     )
-    bucket = conn.get_bucket(bucket_name=staticconf.read('aws.s3.bucket'))
-    log.info('AWS configured to use bucket %r', bucket)
-else:
-    bucket = None
+    parser.add_argument(
+        '--once',
+        action='store_true',
+        help='Check each site once and make any posts that are ready.',
+    )
+    parser.add_argument(
+        '--profile',
+        type=int,
+        metavar='N',
+        help='Profile the next N crawl cycles; see the profiling module.',
+    )
+    parser.add_argument('--host', help='Address the API listens on.')
+    parser.add_argument(
+        '--port',
+        type=int,
+        help='Port the API listens on.',
+    )
+    return parser.parse_args(argv)
+
 
-if staticconf.read('sentry.dsn', default=None):
-    sentry_dsn = staticconf.read('sentry.dsn')
+def _configure_logging():
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    )
+    # Silence unneeded debug statements from boto.
+    logging.getLogger('boto').setLevel(logging.INFO)
+    # Don't write config values to the log. We don't use schemas yet.
+    logging.getLogger('staticconf.config').setLevel(logging.WARNING)
+
+
+def _get_sentry_client():
+    """Send ERROR level logs to Sentry, if configured.
+
+    Returns:
+        The raven client, or None if Sentry isn't configured.
+    """
+    sentry_dsn = staticconf.read('sentry.dsn', default=None)
+    if not sentry_dsn:
+        return None
+    import raven
+    import raven.conf
+    import raven.handlers.logging
+    sentry_client = raven.Client(dsn=sentry_dsn)
+    sentry_handler = raven.handlers.logging.SentryHandler(sentry_client)
+    sentry_handler.setLevel(logging.ERROR)
+    raven.conf.setup_logging(sentry_handler)
     log.info('Sentry logging configured.')
-else:
-    sentry_dsn = None
-sentry_client = raven.Client(dsn=sentry_dsn)
-# Send any ERROR level logs to Sentry.
-sentry_handler = raven.handlers.logging.SentryHandler(sentry_client)
-sentry_handler.setLevel(logging.ERROR)
-raven.conf.setup_logging(sentry_handler)
+    return sentry_client
 
 
 def handler(signum, frame):
@@ -74,22 +113,81 @@ def handler(signum, frame):
     sys.exit(0)
 
 
-# Continuously checks the custody report page every SECONDS_BETWEEN_CHECKS.
-log.info('Starting main loop.')
-signal.signal(signal.SIGINT, handler)
-signal.signal(signal.SIGTERM, handler)
-while True:
+def _run_once(bucket, coordinator, profiler):
+    crawl = scheduler.Scheduler(
+        sites=sites.load_sites(),
+        bucket=bucket,
+        coordinator=coordinator,
+        profiler=profiler,
+    )
+    try:
+        crawl.run_once()
+    finally:
+        crawl.shutdown()
+    posted = outbox.Poster(coordinator=coordinator).drain()
+    log.info(
+        'Made %d posts, and %d are still pending.',
+        posted,
+        outbox.pending_count(),
+    )
+
+
+def _run_forever(bucket, coordinator, profiler):
+    from . import monitor
+    # Serves the crawler's status over HTTP, if `status.port` is set.
+    monitor.start_from_config()
+    # Tweets are queued by the crawler and posted in the background.
+    outbox.Poster(coordinator=coordinator).start()
+    # Continuously checks each custody report page, by default every
+    #   `sites.SECONDS_BETWEEN_CHECKS`.
+    log.info('Starting main loop.')
+    scheduler.Scheduler(
+        sites=sites.load_sites(),
+        bucket=bucket,
+        coordinator=coordinator,
+        profiler=profiler,
+    ).run_forever()
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    _configure_logging()
+    config.load_config()
+    sentry_client = _get_sentry_client()
+    signal.signal(signal.SIGINT, handler)
+    signal.signal(signal.SIGTERM, handler)
+    if args.command == 'serve':
+        from . import api
+        api.serve(host=args.host, port=args.port)
+        return
+    # Only connects to S3 when a report is first archived.
+    bucket = s3.get_bucket()
+    # Shares the sites and posts with other nodes, if configured.
+    coordinator = coordination.Coordinator.from_config()
+    # None unless profiling is enabled.
+    profiler = profiling.CycleProfiler.from_config(cycles=args.profile)
     try:
-        crawler.main(bucket=bucket)
-        log.info(
-            'Sleeping for %s seconds.',
-            SECONDS_BETWEEN_CHECKS,
-        )
-        time.sleep(SECONDS_BETWEEN_CHECKS)
+        if args.once:
+            _run_once(
+                bucket=bucket,
+                coordinator=coordinator,
+                profiler=profiler,
+            )
+        else:
+            _run_forever(
+                bucket=bucket,
+                coordinator=coordinator,
+                profiler=profiler,
+            )
     except SystemExit:
         raise
-    except:
-        log.warning('Sending uncaught exception to Sentry.')
-        ident = sentry_client.get_ident(sentry_client.captureException())
-        log.warning('Uncaught exception ident: %s', ident)
+    except Exception:
+        if sentry_client is not None:
+            log.warning('Sending uncaught exception to Sentry.')
+            ident = sentry_client.get_ident(sentry_client.captureException())
+            log.warning('Uncaught exception ident: %s', ident)
         raise
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""Read-only HTTP API over the inmate history.
+
+Started by `python -m dentonpolice serve`. Every response is JSON. The
+history is indexed in memory by `history.History`, and any records the
+crawler has logged since are indexed before answering each request.
+
+Endpoints:
+
+    GET /inmates/current
+        The inmates seen on the most recent report.
+    GET /inmates/<id>
+        Every logged record of an inmate ID.
+    GET /inmates?name=<words>&charge=<words>&arrested=<YYYY-MM-DD>
+        Records matching every given filter.
+    GET /charges?q=<words>
+        How many records were charged with each offense, optionally
+        only those containing the words, most common first.
+
+Lists are paginated by the `offset` and `limit` query parameters, and
+are returned as `{"total": ..., "offset": ..., "limit": ..., "results":
+[...]}`. Records are listed newest first.
+"""
+import logging
+import urllib.parse
+
+import staticconf
+
+from . import history
+from . import httpserver
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+class BadRequest(Exception):
+
+    """The query parameters of a request are invalid."""
+
+
+def _get_int(query, name, default, maximum=None):
+    try:
+        value = int(query.get(name, [default])[0])
+    except ValueError:
+        raise BadRequest('{} must be an integer.'.format(name))
+    if value < 0:
+        raise BadRequest('{} must not be negative.'.format(name))
+    if maximum is not None:
+        value = min(value, maximum)
+    return value
+
+
+class _Handler(httpserver.RequestHandler):
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        parts = [part for part in url.path.split('/') if part]
+        try:
+            offset = _get_int(query, 'offset', 0)
+            limit = _get_int(query, 'limit', DEFAULT_LIMIT, MAX_LIMIT)
+            self.server.history.refresh()
+            if parts == ['inmates', 'current']:
+                total, results = self.server.history.current_inmates(
+                    offset=offset,
+                    limit=limit,
+                )
+            elif parts == ['inmates']:
+                total, results = self.server.history.search(
+                    name=query.get('name', [None])[0],
+                    charge=query.get('charge', [None])[0],
+                    arrested=query.get('arrested', [None])[0],
+                    offset=offset,
+                    limit=limit,
+                )
+            elif parts == ['charges']:
+                total, counts = self.server.history.charge_frequencies(
+                    query=query.get('q', [None])[0],
+                    offset=offset,
+                    limit=limit,
+                )
+                results = [
+                    {'offense': offense, 'count': count}
+                    for offense, count in counts
+                ]
+            elif len(parts) == 2 and parts[0] == 'inmates':
+                total, results = self.server.history.search(
+                    id=parts[1],
+                    offset=offset,
+                    limit=limit,
+                )
+                if not total:
+                    self.send_json(404, {'error': 'No such inmate.'})
+                    return
+            else:
+                self.send_json(404, {'error': 'Not found.'})
+                return
+        except BadRequest as error:
+            self.send_json(400, {'error': str(error)})
+            return
+        self.send_json(200, {
+            'total': total,
+            'offset': offset,
+            'limit': limit,
+            'results': results,
+        })
+
+
+class APIServer(httpserver.ThreadedHTTPServer):
+
+    """Threaded HTTP server answering queries from a `history.History`.
+
+    Args:
+        address: Tuple of (host, port). Use port 0 to pick a free port.
+        history: The `history.History` to query.
+    """
+
+    def __init__(self, address, history):
+        super().__init__(address, _Handler)
+        self.history = history
+
+
+def serve(host=None, port=None):
+    """Index the history and answer queries until interrupted."""
+    inmate_history = history.History.from_config()
+    log.info('Indexed %d records.', inmate_history.refresh())
+    server = APIServer(
+        address=(
+            host or staticconf.read('api.host', default='127.0.0.1'),
+            port or staticconf.read_int('api.port', default=8000),
+        ),
+        history=inmate_history,
+    )
+    log.info('Serving the inmate history at %s', server.url)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
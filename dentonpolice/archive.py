@@ -0,0 +1,446 @@
+# -*- coding: utf-8 -*-
+"""Reconciling the local store with the S3 archive.
+
+Mug shots and jail reports are uploaded to S3 as they are retrieved,
+but only while S3 is configured and working. Reconciling lists both
+sides, compares them by hash, and transfers only what is missing from
+either side, in parallel:
+
+    Mug shots
+        Local mug shots (see `storage.save_mug_shots`) and the keys
+        under `mugshots/`, which are named by the SHA1 of the image.
+        Mug shots missing locally are downloaded into the pack if they
+        are recorded in the inmate logs, which tell whose they are, and
+        that inmate has no mug shot saved yet.
+    Jail reports
+        Reports under `path.report_archive_dir`, if it is set, and the
+        keys under `jail_report/<site>/`, compared by MD5. A report
+        that differs between the two is logged and left alone.
+
+Both sides of each site in `sites` are reconciled. A directory can stand
+in for the bucket, for testing or to carry an archive between machines:
+
+    python -m dentonpolice.archive reconcile [--dry-run] [--local DIR]
+"""
+import argparse
+import collections
+import concurrent.futures
+import hashlib
+import logging
+import os
+
+import staticconf
+
+from . import config
+from . import images
+from . import jail
+from . import mugpack
+from . import s3
+from . import sites
+from . import storage
+from . import util
+
+
+log = logging.getLogger(__name__)
+
+MUG_SHOT_PREFIX = 'mugshots/'
+REPORT_PREFIX = 'jail_report/'
+
+
+def _md5(data):
+    return hashlib.md5(data).hexdigest()
+
+
+class LocalArchive(object):
+
+    """A directory laid out like the S3 bucket, with keys as paths.
+
+    Used to keep jail reports locally, and to stand in for the bucket.
+
+    Args:
+        root: Directory the keys are relative to.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def __repr__(self):
+        return 'LocalArchive(root={!r})'.format(self.root)
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def keys(self, prefix):
+        """Return the keys under `prefix`, sorted."""
+        keys = []
+        top = self._path(prefix.rstrip('/'))
+        for directory, _, filenames in os.walk(top):
+            for filename in filenames:
+                if filename.startswith('.'):
+                    # Such as a file that atomic_write didn't finish.
+                    continue
+                path = os.path.join(directory, filename)
+                keys.append('/'.join(
+                    os.path.relpath(path, self.root).split(os.sep),
+                ))
+        return sorted(keys)
+
+    def manifest(self, prefix):
+        """Return a dict of each key under `prefix` to its MD5."""
+        manifest = {}
+        for key in self.keys(prefix):
+            with open(self._path(key), mode='rb') as f:
+                manifest[key] = _md5(f.read())
+        return manifest
+
+    def get(self, key):
+        with open(self._path(key), mode='rb') as f:
+            return f.read()
+
+    def put(self, key, data, headers=None, metadata=None, policy=None):
+        """Store data under a key. Headers, metadata, and policy are
+        ignored.
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        util.atomic_write(path, data)
+
+
+class S3Archive(object):
+
+    """The S3 bucket, with the same methods as `LocalArchive`.
+
+    Args:
+        bucket: A boto bucket, or an `s3.LazyBucket`.
+    """
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def __repr__(self):
+        return 'S3Archive(bucket={!r})'.format(self.bucket)
+
+    def keys(self, prefix):
+        """Return the keys under `prefix`, sorted."""
+        return sorted(key.name for key in self.bucket.list(prefix=prefix))
+
+    def manifest(self, prefix):
+        """Return a dict of each key under `prefix` to its MD5.
+
+        The ETag of a key uploaded in parts isn't its MD5, so those map
+        to None.
+        """
+        manifest = {}
+        for key in self.bucket.list(prefix=prefix):
+            etag = key.etag.strip('"')
+            manifest[key.name] = None if '-' in etag else etag
+        return manifest
+
+    def get(self, key):
+        return self.bucket.get_key(key).get_contents_as_string()
+
+    def put(self, key, data, headers=None, metadata=None, policy=None):
+        """Store data under a key, with an optional canned ACL policy."""
+        import boto.s3.key
+        s3_key = boto.s3.key.Key(bucket=self.bucket, name=key)
+        for name, value in (metadata or {}).items():
+            s3_key.set_metadata(name, value)
+        s3_key.set_contents_from_string(
+            string_data=data,
+            headers=headers,
+            # Keep the original timestamp of anything already uploaded.
+            replace=False,
+            policy=policy,
+        )
+
+
+def get_report_archive():
+    """The `LocalArchive` of the current site's reports, if enabled."""
+    directory = config.get_path('report_archive_dir', default=None)
+    if not directory:
+        return None
+    return LocalArchive(directory)
+
+
+def _sha1_of_key(key):
+    return key.rsplit('/', 1)[-1][:-len('.jpg')]
+
+
+def _local_mug_shots():
+    """Return a dict of the SHA1 of each local mug shot to its name."""
+    pack = mugpack.get_pack()
+    if pack is not None:
+        return {sha1: name for name, sha1 in pack.items()}
+    directory = config.get_path('mug_shot_dir')
+    try:
+        filenames = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return {}
+    mug_shots = {}
+    for filename in filenames:
+        if filename.endswith('.jpg'):
+            with open(os.path.join(directory, filename), mode='rb') as f:
+                mug_shots[hashlib.sha1(f.read()).hexdigest()] = filename
+    return mug_shots
+
+
+def _logged_mug_shots():
+    """Return an ordered dict of each logged mug shot's SHA1 to inmate ID.
+
+    Ordered by when each was first logged.
+    """
+    logged = collections.OrderedDict()
+    for recent in (False, True):
+        for record in storage.read_log(recent=recent, fields=('id', 'sha1')):
+            if record.get('sha1'):
+                logged.setdefault(record['sha1'], record['id'])
+    return logged
+
+
+class Plan(object):
+
+    """What reconciling one site would transfer.
+
+    Attributes:
+        mug_uploads: List of (SHA1, local name) of mug shots to upload.
+        mug_downloads: List of (SHA1, inmate ID) of mug shots to
+            download.
+        mug_skipped: Number of mug shots only in the archive that won't
+            be downloaded, since it isn't known whose they are, or the
+            inmate already has mug shots saved.
+        report_uploads: List of report keys to upload.
+        report_downloads: List of report keys to download.
+        report_conflicts: List of report keys that differ between sides.
+    """
+
+    def __init__(self):
+        self.mug_uploads = []
+        self.mug_downloads = []
+        self.mug_skipped = 0
+        self.report_uploads = []
+        self.report_downloads = []
+        self.report_conflicts = []
+
+    def __repr__(self):
+        return (
+            'Plan(mug_uploads={}, mug_downloads={}, mug_skipped={}, '
+            'report_uploads={}, report_downloads={}, report_conflicts={})'
+        ).format(
+            len(self.mug_uploads),
+            len(self.mug_downloads),
+            self.mug_skipped,
+            len(self.report_uploads),
+            len(self.report_downloads),
+            len(self.report_conflicts),
+        )
+
+    def __bool__(self):
+        return bool(
+            self.mug_uploads or self.mug_downloads or
+            self.report_uploads or self.report_downloads
+        )
+
+
+def make_plan(remote, site_name, remote_mug_shots=None):
+    """Compare the current site's local store with an archive.
+
+    Args:
+        remote: The `S3Archive` or `LocalArchive` to compare with.
+        site_name: Name of the site, which prefixes its report keys.
+        remote_mug_shots: The archive's `mugshots/` manifest, if it has
+            already been listed. Mug shots of every site share it.
+
+    Returns:
+        A `Plan`.
+    """
+    plan = Plan()
+    if remote_mug_shots is None:
+        remote_mug_shots = remote.manifest(MUG_SHOT_PREFIX)
+    remote_hashes = {_sha1_of_key(key) for key in remote_mug_shots}
+    local_mug_shots = _local_mug_shots()
+    plan.mug_uploads = sorted(
+        (sha1, name)
+        for sha1, name in local_mug_shots.items()
+        if sha1 not in remote_hashes
+    )
+    pack = mugpack.get_pack()
+    for sha1, inmate_id in _logged_mug_shots().items():
+        if sha1 in local_mug_shots or sha1 not in remote_hashes:
+            continue
+        # Only restore mug shots of inmates without any, so that an
+        #   older mug shot never becomes an inmate's most recent one.
+        if pack is not None and not pack.latest(inmate_id):
+            plan.mug_downloads.append((sha1, inmate_id))
+    plan.mug_skipped = (
+        len(remote_hashes - set(local_mug_shots)) - len(plan.mug_downloads)
+    )
+    report_archive = get_report_archive()
+    if report_archive is not None:
+        prefix = '{}{}/'.format(REPORT_PREFIX, site_name)
+        local_reports = report_archive.manifest(prefix)
+        remote_reports = remote.manifest(prefix)
+        for key, md5 in sorted(local_reports.items()):
+            if key not in remote_reports:
+                plan.report_uploads.append(key)
+            elif remote_reports[key] not in (None, md5):
+                plan.report_conflicts.append(key)
+        plan.report_downloads = sorted(
+            key for key in remote_reports if key not in local_reports
+        )
+    return plan
+
+
+def _upload_mug_shot(remote, sha1, name):
+    data = bytes(storage.read_mug(name))
+    if hashlib.sha1(data).hexdigest() != sha1:
+        raise ValueError('Mug shot {} has changed.'.format(name))
+    phash = images.perceptual_hash(data)
+    remote.put(
+        jail.make_mug_shot_key_name(sha1),
+        data,
+        headers=jail.MUG_SHOT_HEADERS,
+        metadata={'phash': phash} if phash else None,
+        policy=jail.MUG_SHOT_POLICY,
+    )
+
+
+def _download_mug_shots(remote, inmate_id, hashes):
+    # In order, so the last one logged is the inmate's most recent.
+    for sha1 in hashes:
+        data = remote.get(jail.make_mug_shot_key_name(sha1))
+        if hashlib.sha1(data).hexdigest() != sha1:
+            raise ValueError('Archived mug shot {} is corrupt.'.format(sha1))
+        mugpack.get_pack().add(inmate_id, data, sha1=sha1)
+
+
+def _copy_report(source, destination, key):
+    destination.put(
+        key,
+        source.get(key),
+        headers={'Content-Type': 'text/html'},
+    )
+
+
+def apply_plan(plan, remote, workers=None):
+    """Make the transfers of a plan, in parallel.
+
+    A transfer that fails is logged and counted, and the rest continue.
+
+    Returns:
+        Tuple of the number of transfers made, and the number that
+        failed.
+    """
+    if workers is None:
+        workers = staticconf.read_int('archive.reconcile_workers', default=8)
+    report_archive = get_report_archive()
+    # Each task is (what it transfers, function, arguments).
+    tasks = []
+    for sha1, name in plan.mug_uploads:
+        tasks.append((name, _upload_mug_shot, (remote, sha1, name)))
+    downloads = collections.OrderedDict()
+    for sha1, inmate_id in plan.mug_downloads:
+        downloads.setdefault(inmate_id, []).append(sha1)
+    for inmate_id, hashes in downloads.items():
+        tasks.append((
+            'mug shots of inmate-ID {}'.format(inmate_id),
+            _download_mug_shots,
+            (remote, inmate_id, hashes),
+        ))
+    for key in plan.report_uploads:
+        tasks.append((key, _copy_report, (report_archive, remote, key)))
+    for key in plan.report_downloads:
+        tasks.append((key, _copy_report, (remote, report_archive, key)))
+    if not tasks:
+        return 0, 0
+    site_root = config.get_site_root()
+
+    def run(function, args):
+        # Each worker thread needs the site's paths too.
+        with config.site_root(site_root):
+            function(*args)
+    done = failed = 0
+    with concurrent.futures.ThreadPoolExecutor(max(1, workers)) as executor:
+        futures = [
+            executor.submit(run, function, args)
+            for _, function, args in tasks
+        ]
+        for (description, _, _), future in zip(tasks, futures):
+            try:
+                future.result()
+            except Exception as error:
+                log.warning('Failed to transfer %s: %r', description, error)
+                failed += 1
+            else:
+                done += 1
+    return done, failed
+
+
+def reconcile(remote, site_list=None, dry_run=False, workers=None):
+    """Reconcile the local store of each site with an archive.
+
+    Returns:
+        Dict of each site's name to its `Plan`.
+    """
+    if site_list is None:
+        site_list = sites.load_sites()
+    remote_mug_shots = remote.manifest(MUG_SHOT_PREFIX)
+    plans = {}
+    for site in site_list:
+        with config.site_root(site.storage_dir):
+            plan = make_plan(
+                remote=remote,
+                site_name=site.name,
+                remote_mug_shots=remote_mug_shots,
+            )
+            log.info('Reconciling site %s with %r: %r', site.name, remote,
+                     plan)
+            for key in plan.report_conflicts:
+                log.warning('Report %s differs from the archived one.', key)
+            if not dry_run:
+                done, failed = apply_plan(plan, remote, workers=workers)
+                log.info('Made %d transfers, and %d failed.', done, failed)
+        plans[site.name] = plan
+    return plans
+
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    subparsers = parser.add_subparsers(dest='command')
+    command = subparsers.add_parser(
+        'reconcile',
+        help='Transfer what is missing between local storage and S3.',
+    )
+    command.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Only report what would be transferred.',
+    )
+    command.add_argument(
+        '--local',
+        metavar='DIR',
+        help='Reconcile with this directory instead of the S3 bucket.',
+    )
+    command.add_argument('--workers', type=int, default=None)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    config.load_config()
+    args = _parse_args(argv)
+    if args.command != 'reconcile':
+        raise SystemExit('Specify a command: reconcile.')
+    if args.local:
+        remote = LocalArchive(args.local)
+    else:
+        bucket = s3.get_bucket()
+        if bucket is None:
+            raise SystemExit('Configure aws.s3, or pass --local.')
+        remote = S3Archive(bucket)
+    plans = reconcile(remote, dry_run=args.dry_run, workers=args.workers)
+    for name, plan in sorted(plans.items()):
+        print('{}: {!r}'.format(name, plan))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
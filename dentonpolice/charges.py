@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""Normalizing charges, and indexing records by them.
+
+Charges are free text like 'DPD / FAIL TO MAINTIAN FINANCIAL
+RESPONSIBILITY', where the part before the slash is the agency that
+made the arrest. When the report is parsed, each charge is split once
+into its `agency` and `offense`, and the raw text is kept as is. Each
+distinct offense is interned in a `Vocabulary`, so repeated charges
+share one string, and can be referred to by a small integer ID.
+
+A `ChargeIndex` maps the words of each offense to the records with it,
+for searching and counting charges over the whole history without
+rescanning the log.
+"""
+import collections
+import functools
+import re
+import threading
+
+
+# Agencies that prefix charges e.g., 'DPD / PUBLIC INTOXICATION'.
+_CITY_LIST = [
+    'ARLINGTON',
+    'CORINTH',
+    'DALLAS',
+    'DC',
+    'DECATUR',
+    'DENTON',
+    'DPD',
+    'EULESS',
+    'FLOWER MOUND',
+    'FRISCO',
+    'LAKE DALLAS',
+    'LEWISVILLE',
+    'RICHARDSON',
+    'TARRANT',
+    'TDCJ',
+]
+_AGENCY_PREFIX_PATTERN = re.compile(
+    r'\A(?P<agency>(?:{cities})*'.format(cities='|'.join(_CITY_LIST)) +
+    r'\s*(?:CO)?\s*(?:SO)?\s*(?:PD)?\s*(?:WARRANT)?(?:S)?)\s*/\s*'
+)
+_MULTIPLE_SPACES_PATTERN = re.compile(r'\s{2,}')
+_TOKEN_PATTERN = re.compile(r'[A-Z0-9]+')
+
+
+def tokenize(text):
+    """Split text into upper case words, ignoring punctuation."""
+    return _TOKEN_PATTERN.findall(text.upper())
+
+
+class Vocabulary(object):
+
+    """Table of distinct offenses, each stored once with an integer ID.
+
+    Safe to share between threads.
+    """
+
+    def __init__(self):
+        self.offenses = []
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.offenses)
+
+    def __getitem__(self, offense_id):
+        return self.offenses[offense_id]
+
+    def intern(self, offense):
+        """Return the ID of an offense, adding it if it is new."""
+        try:
+            return self._ids[offense]
+        except KeyError:
+            pass
+        with self._lock:
+            if offense not in self._ids:
+                self._ids[offense] = len(self.offenses)
+                self.offenses.append(offense)
+            return self._ids[offense]
+
+
+# Every offense seen by this process.
+VOCABULARY = Vocabulary()
+
+
+@functools.lru_cache(maxsize=4096)
+def split_charge(text):
+    """Split raw charge text into its agency and offense.
+
+    Returns:
+        Tuple of the agency, or '' if there is none, and the offense. The
+        offense is the interned string from `VOCABULARY`.
+    """
+    text = _MULTIPLE_SPACES_PATTERN.sub(' ', text.strip().upper())
+    match = _AGENCY_PREFIX_PATTERN.match(text)
+    if match is None:
+        agency, offense = '', text
+    else:
+        agency, offense = match.group('agency').strip(), text[match.end():]
+    return agency, VOCABULARY[VOCABULARY.intern(offense)]
+
+
+def normalize(charge):
+    """Return a copy of a charge dict with its `agency` and `offense`.
+
+    The raw `charge` text is left unchanged.
+    """
+    agency, offense = split_charge(charge.get('charge') or '')
+    normalized = dict(charge)
+    normalized['agency'] = agency
+    normalized['offense'] = offense
+    return normalized
+
+
+def offense_of(charge):
+    """The offense of a charge dict, even one that wasn't normalized."""
+    offense = charge.get('offense')
+    if offense is None:
+        offense = split_charge(charge.get('charge') or '')[1]
+    return offense
+
+
+class ChargeIndex(object):
+
+    """Inverted index from the words of each offense to records.
+
+    Words map to offense IDs, and offense IDs map to the positions of
+    the records charged with that offense, so a search only visits the
+    offenses containing its rarest word. Not thread safe by itself.
+
+    Args:
+        vocabulary: The `Vocabulary` that offense IDs refer to.
+    """
+
+    def __init__(self, vocabulary=VOCABULARY):
+        self.vocabulary = vocabulary
+        self.offenses_by_token = collections.defaultdict(set)
+        self.records_by_offense = collections.defaultdict(list)
+
+    def clear(self):
+        self.offenses_by_token.clear()
+        self.records_by_offense.clear()
+
+    def add(self, position, charges):
+        """Index the record at `position` by each of its charges."""
+        offense_ids = set()
+        for charge in charges:
+            offense = offense_of(charge)
+            if offense:
+                offense_ids.add(self.vocabulary.intern(offense))
+        for offense_id in offense_ids:
+            postings = self.records_by_offense[offense_id]
+            if not postings:
+                for token in tokenize(self.vocabulary[offense_id]):
+                    self.offenses_by_token[token].add(offense_id)
+            postings.append(position)
+
+    def matching_offenses(self, query):
+        """Return the IDs of offenses containing every word of `query`."""
+        tokens = tokenize(query)
+        if not tokens:
+            return set()
+        candidates = sorted(
+            (self.offenses_by_token.get(token, set()) for token in tokens),
+            key=len,
+        )
+        return set(candidates[0]).intersection(*candidates[1:])
+
+    def search(self, query):
+        """Return the positions of records with a matching offense."""
+        positions = set()
+        for offense_id in self.matching_offenses(query):
+            positions.update(self.records_by_offense[offense_id])
+        return positions
+
+    def frequencies(self, query=None, limit=None):
+        """Count the records charged with each offense, most common first.
+
+        Args:
+            query: Only count offenses containing all of these words.
+            limit: Most offenses to return.
+
+        Returns:
+            List of (offense, count) tuples.
+        """
+        if query:
+            offense_ids = self.matching_offenses(query)
+        else:
+            offense_ids = self.records_by_offense.keys()
+        counts = sorted(
+            (
+                (self.vocabulary[offense_id],
+                 len(self.records_by_offense[offense_id]))
+                for offense_id in offense_ids
+            ),
+            key=lambda item: (-item[1], item[0]),
+        )
+        return counts[:limit]
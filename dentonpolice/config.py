@@ -1,13 +1,52 @@
 # -*- coding: utf-8 -*-
 """Configuration management."""
+import contextlib
 import logging
+import os
+import threading
 
 import staticconf
 
 
 log = logging.getLogger(__name__)
 
+# Storage directory of the site being crawled by the current thread.
+_site = threading.local()
+
 
 def load_config():
     staticconf.YamlConfiguration('config.yaml')
     staticconf.YamlConfiguration('config-env.yaml', optional=True)
+
+
+def get_path(name, **kwargs):
+    """Read `path.<name>`, relative to the current site's storage directory.
+
+    Keyword arguments, such as `default`, are passed to `staticconf.read`.
+    """
+    path = staticconf.read('path.' + name, **kwargs)
+    root = getattr(_site, 'root', '')
+    if not root or path is None:
+        return path
+    return os.path.join(root, path)
+
+
+@contextlib.contextmanager
+def site_root(directory):
+    """Resolve `get_path` relative to `directory` for the current thread.
+
+    Keeps the files of each site separate when crawling several sites.
+    An empty directory means paths are used as configured.
+    """
+    previous = getattr(_site, 'root', '')
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    _site.root = directory or ''
+    try:
+        yield
+    finally:
+        _site.root = previous
+
+
+def get_site_root():
+    return getattr(_site, 'root', '')
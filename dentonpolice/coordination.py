@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""Coordinating several crawler nodes through a shared database.
+
+Each node leases a site before checking it, so a site is only checked
+by one node at a time and no more often than its interval, no matter
+how many nodes there are. Likewise a node claims each post before
+making it, so the same post is never made by two nodes.
+
+The database is SQLite, which works for nodes sharing a filesystem
+(and for testing). The storage directories of the sites should be on
+that shared filesystem too, since any node may check any site.
+"""
+import contextlib
+import logging
+import os
+import socket
+import sqlite3
+import time
+
+import staticconf
+
+
+log = logging.getLogger(__name__)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS site_leases (
+    site TEXT PRIMARY KEY,
+    owner TEXT,
+    expires_at REAL NOT NULL DEFAULT 0,
+    next_check_at REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS post_claims (
+    key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0
+);
+'''
+
+
+class LeaseLost(Exception):
+
+    """Raised when a node no longer holds the lease of a site."""
+
+
+def get_default_owner():
+    return '{host}-{pid}'.format(host=socket.gethostname(), pid=os.getpid())
+
+
+class Coordinator(object):
+
+    """Leases of sites and claims of posts, shared between nodes.
+
+    Args:
+        path: Filename of the SQLite database.
+        owner: Unique name of this node. Defaults to the hostname and
+            process ID.
+        lease_seconds: How long a lease or claim lasts before another
+            node may take it over, in case its owner died.
+    """
+
+    def __init__(self, path, owner=None, lease_seconds=15 * 60):
+        self.path = path
+        self.owner = owner or get_default_owner()
+        self.lease_seconds = lease_seconds
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            connection.executescript(_SCHEMA)
+        finally:
+            connection.close()
+
+    @classmethod
+    def from_config(cls):
+        """Return a Coordinator if configured, otherwise None."""
+        path = staticconf.read('coordination.database', default=None)
+        if not path:
+            return None
+        return cls(
+            path=path,
+            owner=staticconf.read('coordination.owner', default=None),
+            lease_seconds=staticconf.read_float(
+                'coordination.lease_seconds',
+                default=15 * 60,
+            ),
+        )
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # Connections are cheap, and not sharing them keeps this thread
+        #   safe. IMMEDIATE takes the write lock up front, so concurrent
+        #   read-then-update transactions can't interleave.
+        connection = sqlite3.connect(
+            self.path,
+            timeout=30,
+            isolation_level=None,
+        )
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield connection
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+        finally:
+            connection.close()
+
+    def acquire_site(self, site):
+        """Lease a site if it is due and no other node holds it.
+
+        Returns:
+            True if this node now holds the lease.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute(
+                'INSERT OR IGNORE INTO site_leases (site) VALUES (?)',
+                (site,),
+            )
+            cursor = connection.execute(
+                'UPDATE site_leases SET owner = ?, expires_at = ? '
+                'WHERE site = ? AND next_check_at <= ? '
+                'AND (owner IS NULL OR owner = ? OR expires_at < ?)',
+                (self.owner, now + self.lease_seconds, site, now,
+                 self.owner, now),
+            )
+            acquired = cursor.rowcount == 1
+        log.debug(
+            'Lease of site %r %s by %s.',
+            site,
+            'acquired' if acquired else 'not acquired',
+            self.owner,
+        )
+        return acquired
+
+    def renew_site(self, site):
+        """Extend the lease of a site this node holds, while checking it.
+
+        Returns:
+            False if the lease expired, and may have been taken over by
+            another node.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                'UPDATE site_leases SET expires_at = ? '
+                'WHERE site = ? AND owner = ? AND expires_at >= ?',
+                (now + self.lease_seconds, site, self.owner, now),
+            )
+            renewed = cursor.rowcount == 1
+        if not renewed:
+            log.warning('Lease of site %r lost by %s.', site, self.owner)
+        return renewed
+
+    def release_site(self, site, next_check_in_s):
+        """Give up the lease, and schedule the site's next check."""
+        with self._transaction() as connection:
+            connection.execute(
+                'UPDATE site_leases SET owner = NULL, expires_at = 0, '
+                'next_check_at = ? WHERE site = ? AND owner = ?',
+                (time.time() + next_check_in_s, site, self.owner),
+            )
+
+    def claim_post(self, key):
+        """Claim a post so that no other node makes it.
+
+        Returns:
+            True if this node should make the post. False if it has
+            already been made, or another node is making it.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute(
+                'INSERT OR IGNORE INTO post_claims (key, owner, expires_at) '
+                'VALUES (?, ?, ?)',
+                (key, self.owner, now + self.lease_seconds),
+            )
+            cursor = connection.execute(
+                'UPDATE post_claims SET owner = ?, expires_at = ? '
+                'WHERE key = ? AND NOT done '
+                'AND (owner = ? OR expires_at < ?)',
+                (self.owner, now + self.lease_seconds, key, self.owner, now),
+            )
+            return cursor.rowcount == 1
+
+    def finish_post(self, key):
+        """Record that a claimed post has been made."""
+        with self._transaction() as connection:
+            connection.execute(
+                'UPDATE post_claims SET done = 1 WHERE key = ? AND owner = ?',
+                (key, self.owner),
+            )
+
+    def release_post(self, key):
+        """Give up a claimed post that failed, so it can be retried."""
+        with self._transaction() as connection:
+            connection.execute(
+                'DELETE FROM post_claims '
+                'WHERE key = ? AND owner = ? AND NOT done',
+                (key, self.owner),
+            )
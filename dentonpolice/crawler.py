@@ -6,19 +6,23 @@
 # http://creativecommons.org/licenses/by-nc-sa/3.0/
 """Responsible for retrieving, parsing, logging, and posting inmates."""
 import datetime
-import io
+import hashlib
 import logging
 import os
 import time
-import urllib
-import urllib.error
-import urllib.request
 
-import http.client
 import staticconf
 
+from . import archive
+from . import config
+from . import coordination
 from . import inmate as inmate_module
 from . import jail
+from . import journal
+from . import outbox
+from . import profiling
+from . import sites
+from . import status
 from . import storage
 from . import twitter
 
@@ -26,7 +30,7 @@ from . import twitter
 log = logging.getLogger(__name__)
 
 
-def main(bucket):
+def main(bucket, site=None, renew_lease=None):
     """Main function
 
     Performs the following steps:
@@ -35,45 +39,213 @@ def main(bucket):
     2.  Process to find new inmates that need to be posted.
     3.  Download mug shots.
     4.  Save a log.
-    5.  Upload to Twitter.
+    5.  Queue posts to Twitter, which are made by an `outbox.Poster`.
+
+    Each step is journaled, so if a previous cycle was interrupted, it
+    is resumed after the last step it finished. See `journal`. Each
+    step is timed too, see `status`.
+
+    :param site: The jail roster to crawl, by default the Denton report.
+        Files are stored relative to the site's storage directory.
+    :type site: dentonpolice.sites.Site
+    :param renew_lease: Optional callable renewing the lease of the site,
+        called as each step finishes. If it returns False, the cycle
+        stops, since another node may have taken over the site. The
+        next owner resumes the cycle from the journal.
     """
-    throttle_seconds = _should_throttle(at_time=time.time())
-    if throttle_seconds:
-        log.info('Throttling for %s seconds.', throttle_seconds)
-        time.sleep(throttle_seconds)
-    html = _get_jail_report(bucket=bucket)
+    if site is None:
+        site = sites.get_default_site()
+    with config.site_root(site.storage_dir), status.cycle(site.name) as timer:
+        try:
+            _crawl(
+                bucket=bucket,
+                site=site,
+                timer=_LeasedTimer(timer, renew_lease),
+            )
+        except coordination.LeaseLost:
+            log.warning('Lost the lease of site %r, stopping.', site.name)
+            timer.fail('Lost the lease of the site.')
+
+
+class _LeasedTimer(object):
+
+    """Renews the lease of the site as each stage is timed."""
+
+    def __init__(self, timer, renew_lease):
+        self.timer = timer
+        self.renew_lease = renew_lease
+
+    def lap(self, stage):
+        self.timer.lap(stage)
+        if self.renew_lease is not None and not self.renew_lease():
+            raise coordination.LeaseLost(stage)
+
+    def fail(self, error):
+        self.timer.fail(error)
+
+
+def _crawl(bucket, site, timer):
+    cycle = journal.CycleJournal.from_config()
+    if cycle.resume():
+        html = _read_journaled_report(cycle)
+    else:
+        html = None
     if html is None:
-        # Without a report, there is nothing to do.
-        return
+        throttle_seconds = _should_throttle(at_time=time.time())
+        if throttle_seconds:
+            log.info('Throttling for %s seconds.', throttle_seconds)
+            time.sleep(throttle_seconds)
+        html = _get_jail_report(bucket=bucket, site=site)
+        if html is None:
+            # Without a report, there is nothing to do.
+            timer.fail('Unable to retrieve the jail report.')
+            return
+        cycle.begin(html)
+    timer.lap('report')
     # Parse list of inmates from webpage
-    inmates = jail.parse_inmates(html)
+    inmates = site.parse_inmates(html)
     log.info(
         'Jail report contains %s inmates: %s',
         len(inmates),
         [inmate.id for inmate in inmates],
     )
-    # Get mug shots for every current inmate. (GH-12)
-    try:
-        jail.get_mug_shots(inmates=inmates, bucket=bucket)
-    except (http.client.HTTPException, urllib.error.URLError) as error:
-        log.warning('Other error while getting mug shots: %r', error)
-        return
-    storage.save_mug_shots(inmates)
+    if cycle.reached('mug_shots'):
+        missing = _load_saved_mug_shots(
+            inmates=inmates,
+            saved=cycle.get('mug_shots')['saved'],
+        )
+    else:
+        # Get mug shots for every current inmate. (GH-12)
+        # Carry on with those that were retrieved, even if some failed.
+        missing = jail.get_mug_shots(
+            inmates=inmates,
+            bucket=bucket,
+            site=site,
+        )
+    if missing:
+        log.warning(
+            'Missing mug shots for %d of %d inmates: %s',
+            len(missing),
+            len(inmates),
+            [inmate.id for inmate in missing],
+        )
+    profiling.checkpoint('inmates')
+    if not cycle.reached('mug_shots'):
+        storage.save_mug_shots(inmates)
+        cycle.record(
+            'mug_shots',
+            saved={inmate.id: inmate.sha1 for inmate in inmates if inmate.mug},
+        )
+    timer.lap('mug_shots')
     # Make a copy of the current parsed inmates to use later
     inmates_original = inmates[:]
-    inmates = inmate_module.extract_inmates_to_process(
-        inmates=inmates,
-        recent_inmates=[
-            inmate_module.Inmate.from_dict(data)
-            for data in storage.read_log(recent=True)
-        ],
-    )
-    _publish_new_inmates(inmates=inmates, inmates_original=inmates_original)
-    _publish_record_count(inmates=inmates_original)
+    if cycle.reached('selected'):
+        inmates = _load_selected_inmates(
+            inmates_original=inmates_original,
+            selected=cycle.get('selected')['inmates'],
+        )
+    else:
+        inmates = inmate_module.extract_inmates_to_process(
+            inmates=inmates,
+            recent_inmates=[
+                inmate_module.Inmate.from_dict(data)
+                for data in storage.read_log(recent=True)
+            ],
+        )
+        cycle.record(
+            'selected',
+            inmates=[_journal_fields(inmate) for inmate in inmates],
+        )
+    timer.lap('selected')
+    if not cycle.reached('new_inmates'):
+        _publish_new_inmates(
+            inmates=inmates,
+            inmates_original=inmates_original,
+            tweet_params=site.tweet_params,
+            cycle=cycle,
+        )
+        cycle.record('new_inmates')
+    timer.lap('new_inmates')
+    _publish_record_count(inmates=inmates_original, site_name=site.name)
+    timer.lap('record_count')
     _publish_updated_inmates(
         inmates=inmates,
         inmates_original=inmates_original,
+        tweet_params=site.tweet_params,
+        cycle=cycle,
     )
+    cycle.record('done')
+    timer.lap('updated_inmates')
+
+
+def _read_journaled_report(cycle):
+    """Return the report of the cycle being resumed, if it is intact."""
+    try:
+        with open(
+            config.get_path('recent_report_html'),
+            mode='r',
+            encoding='utf-8',
+        ) as f:
+            html = f.read()
+    except FileNotFoundError:
+        html = None
+    if (html is None or
+            journal.report_hash(html) != cycle.get('report')['sha1']):
+        log.warning('Report of the unfinished cycle is gone, so restarting.')
+        return None
+    return html
+
+
+def _load_saved_mug_shots(inmates, saved):
+    """Read back the mug shots saved before resuming.
+
+    Args:
+        inmates: The Inmates of the report being resumed.
+        saved: Dict of the inmate ID to the SHA1 of each mug shot saved.
+
+    Returns:
+        The Inmates that are missing a mug shot.
+    """
+    missing = []
+    for inmate in inmates:
+        sha1 = saved.get(inmate.id)
+        name = storage.most_recent_mug(inmate) if sha1 else None
+        if name:
+            mug = bytes(storage.read_mug(name))
+            if hashlib.sha1(mug).hexdigest() == sha1:
+                inmate.mug = mug
+                storage.load_phash(inmate)
+                continue
+        missing.append(inmate)
+    log.info(
+        'Read back %d saved mug shots.',
+        len(inmates) - len(missing),
+    )
+    return missing
+
+
+def _journal_fields(inmate):
+    return {
+        'arrest': inmate.arrest,
+        'charges': inmate.charges,
+        'DOB': inmate.DOB,
+        'id': inmate.id,
+        'name': inmate.name,
+        'seen': inmate.seen,
+    }
+
+
+def _load_selected_inmates(inmates_original, selected):
+    """Return the Inmates chosen to process before resuming.
+
+    The same objects as in `inmates_original` are used when possible,
+    since they have the mug shots.
+    """
+    by_id = {inmate.id: inmate for inmate in inmates_original}
+    return [
+        by_id.get(data['id']) or inmate_module.Inmate.from_dict(data)
+        for data in selected
+    ]
 
 
 def _should_throttle(at_time):
@@ -81,7 +253,7 @@ def _should_throttle(at_time):
     minimum_report_time = at_time - minimum_report_age_s
     try:
         last_report_time = os.path.getmtime(
-            staticconf.read('path.recent_report_html'),
+            config.get_path('recent_report_html'),
         )
     except OSError:
         log.warning('No recent report, so not throttling.')
@@ -100,60 +272,71 @@ def _should_throttle(at_time):
     return 0
 
 
-def _get_jail_report(bucket):
-    html = jail.get_jail_report()
+def _get_jail_report(bucket, site):
+    html = jail.get_jail_report(site=site)
     if html is None:
         # Without a report, there is nothing to do.
         return None
     with open(
-        staticconf.read('path.recent_report_html'),
+        config.get_path('recent_report_html'),
         mode='w',
         encoding='utf-8',
     ) as f:
         # Useful for debugging to have a copy of the last seen page.
         # Also used to throttle automatic restarts.
         f.write(html)
+    timestamp = datetime.datetime.utcnow()
+    report_archive = archive.get_report_archive()
+    if report_archive is not None:
+        # Kept locally too, so reports can be uploaded later if S3 isn't
+        #   configured or is down. See `archive.reconcile`.
+        report_archive.put(
+            jail.make_jail_report_key_name(
+                timestamp=timestamp,
+                provenance=site.name,
+            ),
+            html,
+        )
     if bucket is not None:
         # Archive the report so it can be processed or analyzed later.
         jail.save_jail_report_to_s3(
             bucket=bucket,
             html=html,
-            timestamp=datetime.datetime.utcnow(),
+            timestamp=timestamp,
+            provenance=site.name,
         )
     return html
 
 
-def _publish_new_inmates(inmates, inmates_original):
-    """Log and post to Twitter."""
+def _publish_new_inmates(inmates, inmates_original, tweet_params, cycle):
+    """Log and queue the posts to Twitter."""
     # Discard inmates that we couldn't save a mug shot for.
-    inmates = [inmate for inmate in inmates if inmate.mug]
-    log.info('Publishing %s new inmates.', len(inmates))
+    with_mugs = [inmate for inmate in inmates if inmate.mug]
+    log.info('Publishing %s new inmates.', len(with_mugs))
     if not inmates:
         return
     sorted_by_arrest = sorted(
-        inmates,
+        with_mugs,
         key=inmate_module.Inmate.sort_key_for_arrest,
     )
-    twitter_client = twitter.get_twitter_client()
-    if twitter_client is not None:
-        try:
-            for inmate in sorted_by_arrest:
-                mug_shot_fname = 'mugs/{}'.format(
-                    storage.most_recent_mug(inmate),
-                )
+    if sorted_by_arrest and twitter.get_twitter_client() is not None:
+        # Enqueued in order of arrest, which is the order they are posted.
+        # The poster records each inmate to the main log once posted.
+        for inmate in sorted_by_arrest:
+            key = 'new-{}'.format(inmate.id)
+            if key not in cycle.enqueued:
+                mug_shot_fname = storage.most_recent_mug(inmate)
                 log.debug('Media fname: %s', mug_shot_fname)
-                with open(mug_shot_fname, mode='rb') as mug_shot_file:
-                    twitter.tweet_mug_shots(
-                        twitter_client=twitter_client,
-                        inmate=inmate,
-                        caption=twitter.get_twitter_message(inmate),
-                        mug_shot_file=mug_shot_file,
-                    )
-        finally:
-            # Still want to log even if there was an uncaught error
-            # while posting to Twitter.
-            storage.log_inmates(inmates)
-    # Remove any inmates that failed to post so they're retried.
+                outbox.enqueue_mug_shot(
+                    inmate=inmate,
+                    caption=twitter.get_twitter_message(inmate),
+                    mug=storage.read_mug(mug_shot_fname),
+                    **tweet_params
+                )
+                cycle.record_enqueued(key)
+            inmate.posted = True
+    # Remove any inmates that failed to post so they're retried, which
+    #   includes those whose mug shot couldn't be retrieved this time.
     posted = inmates_original[:]
     for inmate in inmates:
         if not inmate.posted:
@@ -162,10 +345,11 @@ def _publish_new_inmates(inmates, inmates_original):
     storage.log_inmates(posted, recent=True)
 
 
-def _publish_record_count(inmates):
+def _publish_record_count(inmates, site_name):
     # Check if there is a new record number of inmates seen on the jail report.
     (most_count, on_date) = storage.get_most_inmates_count()
     count = len(inmates)
+    status.set_inmate_count(site_name, count)
     log.debug(
         'Current count is %d. Most count was %d on %s',
         count,
@@ -174,20 +358,22 @@ def _publish_record_count(inmates):
     )
     if most_count and count <= most_count:
         return
-    twitter_client = twitter.get_twitter_client()
-    if twitter_client is None:
+    if twitter.get_twitter_client() is None:
         return
-    twitter.tweet_most_count(
-        twitter_client=twitter_client,
-        count=count,
-        most_count=most_count,
-        on_date=on_date,
+    outbox.enqueue_status(
+        key='most-count-{site}-{count}'.format(site=site_name, count=count),
+        status=twitter.get_most_count_message(
+            count=count,
+            most_count=most_count,
+            on_date=on_date,
+        ),
     )
     # Only log if we published the record.
     storage.log_most_inmates_count(count)
 
 
-def _publish_updated_inmates(inmates, inmates_original):
+def _publish_updated_inmates(
+        inmates, inmates_original, tweet_params, cycle):
     updated_records = inmate_module.extract_updated_inmates(
         inmates=[
             inmate
@@ -200,26 +386,23 @@ def _publish_updated_inmates(inmates, inmates_original):
     log.info('Publishing %s updated inmates.', len(updated_records))
     if not updated_records:
         return
-    twitter_client = twitter.get_twitter_client()
-    if twitter_client is None:
+    if twitter.get_twitter_client() is None:
         return
-    try:
-        for record in updated_records:
-            twitter.tweet_mug_shots(
-                twitter_client=twitter_client,
-                inmate=record['inmate'],
-                caption=(
-                    'Found a newer mug shot for {name}. ({arrest})'
-                ).format(
-                    name=record['inmate'].first_name,
-                    arrest=record['inmate'].arrest,
-                ),
-                mug_shot_file=io.BytesIO(record['inmate'].mug),
-                in_reply_to_status_id=record['last_tweet_id'],
-            )
-    finally:
-        # Still want to log even if there was an uncaught error
-        # while posting to Twitter.
-        storage.log_inmates(
-            inmates=[record['inmate'] for record in updated_records],
+    # The poster records each inmate to the main log once posted.
+    for record in updated_records:
+        key = 'updated-{}'.format(record['inmate'].id)
+        if key in cycle.enqueued:
+            continue
+        outbox.enqueue_mug_shot(
+            inmate=record['inmate'],
+            caption=(
+                'Found a newer mug shot for {name}. ({arrest})'
+            ).format(
+                name=record['inmate'].first_name,
+                arrest=record['inmate'].arrest,
+            ),
+            mug=record['inmate'].mug,
+            in_reply_to_status_id=record['last_tweet_id'],
+            **tweet_params
         )
+        cycle.record_enqueued(key)
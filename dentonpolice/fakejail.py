@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""A local stand-in for the City Jail Custody Report site.
+
+Serves recorded or synthetic jail reports along with mug shot images,
+while optionally misbehaving like a slow Tor circuit would. Point the
+crawler at it by setting `jail.url` to the server address and
+`proxy.host` to null, which makes it possible to measure throughput and
+concurrency settings reproducibly without touching the real site.
+
+Example:
+
+    python -m dentonpolice.fakejail --port 8080 --inmates 200 \\
+        --latency 0.5 --bandwidth 20000 --error-rate 0.05
+"""
+import argparse
+import base64
+import datetime
+import glob
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+import urllib.parse
+
+from . import httpserver
+
+
+log = logging.getLogger(__name__)
+
+# A tiny, valid, 16x16 grayscale JPEG used when no recorded mug exists.
+_SYNTHETIC_JPEG = base64.b64decode(
+    '/9j/4AAQSkZJRgABAQAAAQABAAD/2wBDABALDA4MChAODQ4SERATGCgaGBYWGDEjJR0o'
+    'OjM9PDkzODdASFxOQERXRTc4UG1RV19iZ2hnPk1xeXBkeFxlZ2P/wAALCAAQABABAREA'
+    '/8QAHwAAAQUBAQEBAQEAAAAAAAAAAAECAwQFBgcICQoL/8QAtRAAAgEDAwIEAwUFBAQA'
+    'AAF9AQIDAAQRBRIhMUEGE1FhByJxFDKBkaEII0KxwRVS0fAkM2JyggkKFhcYGRolJico'
+    'KSo0NTY3ODk6Q0RFRkdISUpTVFVWV1hZWmNkZWZnaGlqc3R1dnd4eXqDhIWGh4iJipKT'
+    'lJWWl5iZmqKjpKWmp6ipqrKztLW2t7i5usLDxMXGx8jJytLT1NXW19jZ2uHi4+Tl5ufo'
+    '6erx8vP09fb3+Pn6/9oACAEBAAA/ACiiiv/Z'
+)
+
+_FIRST_NAMES = ['JANE', 'JOHN', 'MARIA', 'JAMES', 'LINDA', 'ROBERT']
+_LAST_NAMES = ['DOE', 'SMITH', 'GARCIA', 'JOHNSON', 'BROWN', 'MILLER']
+_CHARGES = [
+    ('DPD / FAIL TO MAINTIAN FINANCIAL RESPONSIBILITY', 'BOND', '$569.00'),
+    ('DPD / PUBLIC INTOXICATION', 'FINE', '$369.00'),
+    ('DENTON CO SO WARRANT / THEFT PROP >=$50<$500', 'BOND', '$1000.00'),
+    ('DPD / DRIVING WHILE INTOXICATED', 'BOND', '$1500.00'),
+    ('LOCAL MUNICIPAL WARRANT', 'NO BOND', ''),
+]
+
+
+def make_synthetic_mug(inmate_id):
+    """Return a JPEG whose bytes (but not pixels) are unique per inmate.
+
+    A JPEG comment segment is inserted after the start-of-image marker,
+    so the images decode identically while their hashes differ.
+    """
+    comment = 'inmate-{}'.format(inmate_id).encode('ascii')
+    segment = b'\xff\xfe' + (len(comment) + 2).to_bytes(2, 'big') + comment
+    return _SYNTHETIC_JPEG[:2] + segment + _SYNTHETIC_JPEG[2:]
+
+
+def make_synthetic_report(count, seed=0, first_id=300000):
+    """Return report HTML with `count` inmates in the real page's markup.
+
+    Only the parts of the markup that `jail.parse_inmates` relies on are
+    reproduced. The same `seed` always produces the same report.
+    """
+    rng = random.Random(seed)
+    base_time = datetime.datetime(2015, 4, 19, 0, 0, 0)
+    rows = []
+    for index in range(count):
+        arrest = base_time + datetime.timedelta(
+            seconds=rng.randint(0, 3 * 24 * 60 * 60),
+        )
+        dob = datetime.date(rng.randint(1950, 1997), rng.randint(1, 12), 1)
+        row = [
+            '<span id="ctl00_dlInmates_lblName_{i}">{last}, {first}</span>'
+            '<span id="ctl00_dlInmates_lblDOB_{i}">{dob}</span>'
+            '<span id="ctl00_dlInmates_Label2_{i}">{arrest}</span>'
+            '<img src="ImageHandler.ashx?imageId={id}&amp;type=thumb" />'
+            .format(
+                i=index,
+                last=rng.choice(_LAST_NAMES),
+                first=rng.choice(_FIRST_NAMES),
+                dob=dob.strftime('%m/%d/%Y'),
+                arrest=arrest.strftime('%m/%d/%Y %H:%M:%S'),
+                id=first_id + index,
+            )
+        ]
+        for charge_index in range(rng.randint(0, 3)):
+            charge, charge_type, amount = rng.choice(_CHARGES)
+            row.append(
+                '<span id="ctl00_dlInmates_Charges_{i}_lblCharge_{j}">'
+                '{charge}</span>'
+                '<span id="ctl00_dlInmates_Charges_{i}_lblBondOrFine_{j}">'
+                '{type}</span>'
+                '<span id="ctl00_dlInmates_Charges_{i}_lblAmount_{j}">'
+                '{amount}</span>'
+                .format(
+                    i=index,
+                    j=charge_index,
+                    charge=charge,
+                    type=charge_type,
+                    amount=amount,
+                )
+            )
+        rows.append('<tr><td>{}</td></tr>'.format(''.join(row)))
+    return (
+        '<html><body><table id="ctl00_dlInmates">{rows}</table>'
+        '</body></html>'
+    ).format(rows='\n'.join(rows))
+
+
+class Behavior(object):
+
+    """How badly the fake server should behave, to mimic Tor.
+
+    Attributes:
+        latency_s: Mean number of seconds to wait before responding.
+        jitter_s: Maximum additional random delay, in seconds.
+        bandwidth_bps: Maximum bytes per second for each response body,
+            otherwise None for no cap.
+        error_rate: Probability of responding with an HTTP 503.
+        timeout_rate: Probability of stalling for `stall_s` seconds and
+            then closing the connection without responding.
+        stall_s: How long a stalled request is held open.
+        seed: Seed for the random number generator, for reproducibility.
+    """
+
+    def __init__(
+            self, latency_s=0, jitter_s=0, bandwidth_bps=None, error_rate=0,
+            timeout_rate=0, stall_s=30, seed=None):
+        self.latency_s = latency_s
+        self.jitter_s = jitter_s
+        self.bandwidth_bps = bandwidth_bps
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.stall_s = stall_s
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def roll(self):
+        """Decide the fate of a request: 'ok', 'error', or 'timeout'."""
+        with self._lock:
+            value = self._random.random()
+        if value < self.timeout_rate:
+            return 'timeout'
+        if value < self.timeout_rate + self.error_rate:
+            return 'error'
+        return 'ok'
+
+    def delay(self):
+        with self._lock:
+            jitter = self._random.uniform(0, self.jitter_s)
+        return self.latency_s + jitter
+
+
+class ReportSource(object):
+
+    """Supplies report HTML, cycling through recorded reports if given.
+
+    Args:
+        paths: List of recorded report HTML files served in order, one
+            per request, wrapping around at the end. If empty, a
+            synthetic report is served instead.
+        inmate_count: Number of inmates in the synthetic report.
+        seed: Seed for the synthetic report.
+    """
+
+    def __init__(self, paths=None, inmate_count=50, seed=0):
+        self.paths = sorted(paths or [])
+        self._cycle = itertools.cycle(self.paths) if self.paths else None
+        self._lock = threading.Lock()
+        self._synthetic = None
+        if not self.paths:
+            self._synthetic = make_synthetic_report(
+                count=inmate_count,
+                seed=seed,
+            ).encode('utf-8')
+
+    def next_report(self):
+        if self._cycle is None:
+            return self._synthetic
+        with self._lock:
+            path = next(self._cycle)
+        with open(path, mode='rb') as f:
+            return f.read()
+
+
+class _Handler(httpserver.RequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        fate = server.behavior.roll()
+        server.count('requests')
+        if fate == 'timeout':
+            server.count('timeouts')
+            time.sleep(server.behavior.stall_s)
+            self.close_connection = True
+            return
+        time.sleep(server.behavior.delay())
+        if fate == 'error':
+            server.count('errors')
+            self.send_error(503, 'Simulated failure')
+            return
+        if url.path in ('', '/'):
+            body = server.reports.next_report()
+            content_type = 'text/html; charset=utf-8'
+        elif url.path.lower() == '/imagehandler.ashx' and 'imageID' in query:
+            body = server.get_mug(query['imageID'][0])
+            content_type = 'image/jpeg'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self._write_throttled(body)
+        server.count('bytes', len(body))
+
+    def _write_throttled(self, body):
+        bandwidth = self.server.behavior.bandwidth_bps
+        if not bandwidth:
+            self.wfile.write(body)
+            return
+        # Send in roughly tenth-of-a-second chunks.
+        chunk_size = max(1, int(bandwidth / 10))
+        for start in range(0, len(body), chunk_size):
+            chunk = body[start:start + chunk_size]
+            self.wfile.write(chunk)
+            time.sleep(len(chunk) / bandwidth)
+
+
+class FakeJailServer(httpserver.ThreadedHTTPServer):
+
+    """Threaded HTTP server impersonating the jail report site.
+
+    Args:
+        address: Tuple of (host, port). Use port 0 to pick a free port.
+        reports: A `ReportSource`.
+        behavior: A `Behavior`, defaults to a well behaved server.
+        mug_dir: Optional directory of recorded `{id}.jpg` mug shots.
+            Synthetic images are served for any that are missing.
+    """
+
+    def __init__(self, address, reports, behavior=None, mug_dir=None):
+        super().__init__(address, _Handler)
+        self.reports = reports
+        self.behavior = behavior or Behavior()
+        self.mug_dir = mug_dir
+        self.stats = {'requests': 0, 'errors': 0, 'timeouts': 0, 'bytes': 0}
+        self._stats_lock = threading.Lock()
+
+    def count(self, name, amount=1):
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    def get_mug(self, inmate_id):
+        if self.mug_dir:
+            path = os.path.join(self.mug_dir, '{}.jpg'.format(inmate_id))
+            try:
+                with open(path, mode='rb') as f:
+                    return f.read()
+            except FileNotFoundError:
+                pass
+        return make_synthetic_mug(inmate_id)
+
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument(
+        '--reports',
+        help='Glob of recorded report HTML files to serve in order.',
+    )
+    parser.add_argument('--mug-dir', help='Directory of `{id}.jpg` files.')
+    parser.add_argument('--inmates', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--jitter', type=float, default=0)
+    parser.add_argument(
+        '--bandwidth',
+        type=int,
+        help='Bytes per second cap for each response.',
+    )
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--timeout-rate', type=float, default=0)
+    parser.add_argument('--stall', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    server = FakeJailServer(
+        address=(args.host, args.port),
+        reports=ReportSource(
+            paths=glob.glob(args.reports) if args.reports else None,
+            inmate_count=args.inmates,
+            seed=args.seed,
+        ),
+        behavior=Behavior(
+            latency_s=args.latency,
+            jitter_s=args.jitter,
+            bandwidth_bps=args.bandwidth,
+            error_rate=args.error_rate,
+            timeout_rate=args.timeout_rate,
+            stall_s=args.stall,
+            seed=args.seed,
+        ),
+        mug_dir=args.mug_dir,
+    )
+    log.info('Serving fake jail report at %s', server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        log.info('Served: %r', server.stats)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    )
+    main()
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""In-memory indexes over the inmate log, for answering queries quickly.
+
+The log at `path.inmate_log` is read once, and afterwards only the lines
+appended since the last read are parsed. Each record is indexed by its
+inmate ID, the words of the name, each offense it was charged with (see
+`charges.ChargeIndex`), and the date of arrest, so that a query only
+visits the records that match.
+
+The inmates currently in jail are those in `path.recent_inmate_log`,
+which is reloaded whenever the crawler replaces it.
+"""
+import collections
+import logging
+import os
+import threading
+
+from . import charges
+from . import config
+from . import serialization
+
+
+log = logging.getLogger(__name__)
+
+
+def arrest_date(arrest):
+    """Return 'YYYY-MM-DD' of an arrest time like '09/07/2012 15:30:57'."""
+    try:
+        month, day, year = arrest.split(' ', 1)[0].split('/')
+    except (AttributeError, ValueError):
+        return None
+    return '{}-{}-{}'.format(year, month, day)
+
+
+class History(object):
+
+    """Every logged record, with indexes for looking them up.
+
+    Records are numbered in the order they were logged, and query results
+    are returned newest first. Safe to share between threads.
+
+    Args:
+        log_location: Filename of the main inmate log.
+        recent_location: Filename of the recent inmate log.
+    """
+
+    def __init__(self, log_location, recent_location):
+        self.log_location = log_location
+        self.recent_location = recent_location
+        self.records = []
+        self.current = []
+        self.by_id = collections.defaultdict(list)
+        self.by_name = collections.defaultdict(list)
+        self.by_charge = charges.ChargeIndex()
+        self.by_arrest_date = collections.defaultdict(list)
+        # Records are kept for as long as the process runs, so share
+        #   their repeated values.
+        self._interner = serialization.Interner()
+        self._lock = threading.Lock()
+        # Where the next read of the log starts, and which file it was.
+        self._offset = 0
+        self._log_identity = None
+        self._recent_identity = None
+
+    @classmethod
+    def from_config(cls):
+        return cls(
+            log_location=config.get_path('inmate_log'),
+            recent_location=config.get_path('recent_inmate_log'),
+        )
+
+    def refresh(self):
+        """Index anything logged since the last refresh.
+
+        Returns:
+            The number of new records.
+        """
+        with self._lock:
+            added = self._refresh_log()
+            self._refresh_recent()
+        if added:
+            log.debug('Indexed %d new records.', added)
+        return added
+
+    def _refresh_log(self):
+        try:
+            stat = os.stat(self.log_location)
+        except FileNotFoundError:
+            return 0
+        identity = (stat.st_dev, stat.st_ino)
+        if identity != self._log_identity or stat.st_size < self._offset:
+            # Replaced or truncated, so start over.
+            if self._log_identity is not None:
+                log.info('Inmate log was replaced, so reindexing it.')
+            self._clear()
+            self._log_identity = identity
+        if stat.st_size == self._offset:
+            return 0
+        with open(self.log_location, mode='rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        # A line still being written is left for the next refresh.
+        end = data.rfind(b'\n') + 1
+        self._offset += end
+        count = 0
+        for line in data[:end].splitlines():
+            if line.strip():
+                self._add(self._interner.record(serialization.loads(line)))
+                count += 1
+        return count
+
+    def _refresh_recent(self):
+        try:
+            stat = os.stat(self.recent_location)
+        except FileNotFoundError:
+            self.current = []
+            self._recent_identity = None
+            return
+        # The recent log is replaced atomically, so a new inode (or
+        #   mtime) means it has changed.
+        identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if identity == self._recent_identity:
+            return
+        with open(self.recent_location, mode='rb') as f:
+            self.current = [
+                serialization.loads(line)
+                for line in f
+                if line.strip()
+            ]
+        self._recent_identity = identity
+
+    def _clear(self):
+        self.records = []
+        self._interner = serialization.Interner()
+        for index in (
+                self.by_id, self.by_name, self.by_charge,
+                self.by_arrest_date):
+            index.clear()
+        self._offset = 0
+
+    def _add(self, record):
+        position = len(self.records)
+        self.records.append(record)
+        self.by_id[record.get('id')].append(position)
+        for token in set(charges.tokenize(record.get('name') or '')):
+            self.by_name[token].append(position)
+        self.by_charge.add(position, record.get('charges') or ())
+        date = arrest_date(record.get('arrest'))
+        if date is not None:
+            self.by_arrest_date[date].append(position)
+
+    def search(self, id=None, name=None, charge=None, arrested=None,
+               offset=0, limit=50):
+        """Find records matching every given criterion, newest first.
+
+        Args:
+            id: Inmate ID.
+            name: Words that must all appear in the name, in any order.
+            charge: Words that must all appear in one offense.
+            arrested: Date of arrest as 'YYYY-MM-DD'.
+            offset: Number of matching records to skip.
+            limit: Most records to return.
+
+        Returns:
+            Tuple of the total number of matches, and the list of
+            records on the requested page.
+        """
+        with self._lock:
+            postings = []
+            if id is not None:
+                postings.append(self.by_id.get(id, ()))
+            if name:
+                postings.extend(
+                    self.by_name.get(token, ())
+                    for token in charges.tokenize(name)
+                )
+            if charge:
+                postings.append(self.by_charge.search(charge))
+            if arrested is not None:
+                postings.append(self.by_arrest_date.get(arrested, ()))
+            if postings:
+                # Start from the rarest criterion and narrow it down.
+                postings.sort(key=len)
+                matches = set(postings[0])
+                for positions in postings[1:]:
+                    if not matches:
+                        break
+                    matches.intersection_update(positions)
+                matches = sorted(matches, reverse=True)
+            else:
+                matches = range(len(self.records) - 1, -1, -1)
+            page = [
+                self.records[position]
+                for position in matches[offset:offset + limit]
+            ]
+            return len(matches), page
+
+    def charge_frequencies(self, query=None, offset=0, limit=50):
+        """Return the total, and a page of (offense, count) tuples.
+
+        Offenses are counted by the number of records charged with them,
+        most common first.
+        """
+        with self._lock:
+            counts = self.by_charge.frequencies(query=query)
+            return len(counts), counts[offset:offset + limit]
+
+    def current_inmates(self, offset=0, limit=50):
+        """Return the total, and a page of the inmates in jail now."""
+        with self._lock:
+            return len(self.current), self.current[offset:offset + limit]
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""Threaded HTTP servers, as used by `api`, `monitor`, and `fakejail`."""
+import http.server
+import logging
+import socketserver
+import threading
+
+from . import serialization
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+
+    """Handles a request, logging to the module that defines the handler."""
+
+    def send_body(self, code, content_type, data):
+        """Answer with a complete response."""
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_json(self, code, body):
+        """Answer with a JSON document."""
+        self.send_body(
+            code,
+            'application/json; charset=utf-8',
+            serialization.dumps(body).encode('utf-8'),
+        )
+
+    def log_message(self, format, *args):
+        logging.getLogger(self.__module__).debug(
+            '%s - %s',
+            self.address_string(),
+            format % args,
+        )
+
+
+class ThreadedHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+
+    """HTTP server answering each request in its own daemon thread.
+
+    Args:
+        address: Tuple of (host, port). Use port 0 to pick a free port.
+        handler: A `RequestHandler` subclass.
+    """
+
+    daemon_threads = True
+    # Name of the thread started by `start_in_thread`.
+    thread_name = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://{host}:{port}/'.format(host=host, port=port)
+
+    def start_in_thread(self):
+        """Serve in a daemon thread, returning the thread."""
+        thread = threading.Thread(
+            target=self.serve_forever,
+            name=self.thread_name,
+            daemon=True,
+        )
+        thread.start()
+        return thread
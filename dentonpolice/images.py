@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""Preparing and comparing mug shot images.
+
+Before upload, images are decoded once, shrunk to fit
+`images.max_dimension`, and re-encoded as JPEG at `images.jpeg_quality`.
+The result is cached on disk by the SHA1 hash of the original image, so
+later posts and replies using the same mug shot reuse it. Each
+combination of those settings has its own cache, so changing them
+takes effect at once.
+
+Perceptual hashes summarize what an image looks like rather than its
+exact bytes, so a photo that has merely been re-encoded has the same or
+a very similar hash. Compare them using `hamming_distance`.
+
+Requires Pillow, and NumPy for perceptual hashes. Without them, images
+are uploaded unchanged and perceptual hashes are None. Both are slow to
+import, so they are imported when first needed.
+"""
+import collections
+import functools
+import hashlib
+import io
+import logging
+import os
+
+import staticconf
+
+from . import util
+
+
+log = logging.getLogger(__name__)
+
+# Hits and misses of the cache of prepared images, see `status`.
+upload_cache_counts = collections.Counter()
+
+
+@functools.lru_cache(maxsize=None)
+def _get_image_module():
+    """Return Pillow's `Image` module, or None if not installed."""
+    try:
+        from PIL import Image
+    except ImportError:  # pragma: no cover
+        return None
+    return Image
+
+
+@functools.lru_cache(maxsize=None)
+def _get_numpy():
+    """Return the `numpy` module, or None if not installed."""
+    try:
+        import numpy
+    except ImportError:  # pragma: no cover
+        return None
+    return numpy
+
+
+def prepare_for_upload(mug, sha1=None):
+    """Return the bytes of the mug shot to upload in place of `mug`.
+
+    The re-encoded image is only used if it is smaller than the original,
+    unless the original is over `images.max_bytes`.
+
+    Args:
+        mug: Byte string of the original image.
+        sha1: Optional precomputed SHA1 hex digest of `mug`.
+
+    Returns:
+        Byte string of a JPEG image.
+    """
+    if _get_image_module() is None:
+        log.debug('Pillow is not installed, so uploading the original.')
+        return mug
+    if sha1 is None:
+        sha1 = hashlib.sha1(mug).hexdigest()
+    cache_path = _get_cache_path(sha1)
+    try:
+        with open(cache_path, mode='rb') as f:
+            log.debug('Using cached upload image for %s', sha1)
+            upload_cache_counts['hits'] += 1
+            return f.read()
+    except FileNotFoundError:
+        upload_cache_counts['misses'] += 1
+    try:
+        prepared = _reencode(mug)
+    except (IOError, ValueError) as error:
+        # Pillow raises IOError (OSError) for data it can't decode.
+        log.warning('Unable to prepare image %s: %r', sha1, error)
+        return mug
+    if len(prepared) >= len(mug) and len(mug) <= _get_max_bytes():
+        prepared = mug
+    log.debug(
+        'Prepared image %s for upload: %d bytes, originally %d bytes.',
+        sha1,
+        len(prepared),
+        len(mug),
+    )
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    util.atomic_write(cache_path, prepared)
+    return prepared
+
+
+def _get_cache_path(sha1):
+    return os.path.join(
+        staticconf.read('path.upload_cache_dir'),
+        _get_settings_key(),
+        sha1[0:2],
+        '{}.jpg'.format(sha1),
+    )
+
+
+def _get_settings_key():
+    """Short hash of the settings that change how images are prepared."""
+    settings = '{}-{}-{}'.format(
+        _get_max_dimension(),
+        _get_jpeg_quality(),
+        _get_max_bytes(),
+    )
+    return hashlib.sha1(settings.encode('ascii')).hexdigest()[:8]
+
+
+def _get_max_dimension():
+    return staticconf.read_int('images.max_dimension', default=1024)
+
+
+def _get_jpeg_quality():
+    return staticconf.read_int('images.jpeg_quality', default=85)
+
+
+def _get_max_bytes():
+    return staticconf.read_int('images.max_bytes', default=3 * 1024 * 1024)
+
+
+def _reencode(mug):
+    Image = _get_image_module()
+    image = Image.open(io.BytesIO(mug))
+    if image.mode not in ('L', 'RGB'):
+        image = image.convert('RGB')
+    max_dimension = _get_max_dimension()
+    # Shrinks in place, keeping the aspect ratio. Never enlarges.
+    image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    quality = _get_jpeg_quality()
+    max_bytes = _get_max_bytes()
+    while True:
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=quality, optimize=True)
+        data = output.getvalue()
+        if len(data) <= max_bytes or quality <= 20:
+            return data
+        quality -= 10
+
+
+def perceptual_hash(mug, method='dhash'):
+    """Return the 64-bit perceptual hash of an image as a hex string.
+
+    Args:
+        mug: Byte string of the image.
+        method: Either 'dhash' (difference hash), which compares each
+            pixel to its neighbor in a 9x8 thumbnail, or 'ahash'
+            (average hash), which compares each pixel of an 8x8
+            thumbnail to the mean.
+
+    Returns:
+        String of 16 hex digits, or None if the image can't be decoded
+        or Pillow or NumPy are not installed.
+    """
+    Image = _get_image_module()
+    numpy = _get_numpy()
+    if Image is None or numpy is None:
+        return None
+    try:
+        image = Image.open(io.BytesIO(mug)).convert('L')
+        if method == 'dhash':
+            pixels = _to_array(image, size=(9, 8))
+            bits = pixels[:, 1:] > pixels[:, :-1]
+        elif method == 'ahash':
+            pixels = _to_array(image, size=(8, 8))
+            bits = pixels > pixels.mean()
+        else:
+            raise ValueError('Unknown perceptual hash method: ' + method)
+    except IOError as error:
+        log.debug('Unable to compute perceptual hash: %r', error)
+        return None
+    return numpy.packbits(bits.ravel()).tobytes().hex()
+
+
+def _to_array(image, size):
+    numpy = _get_numpy()
+    return numpy.asarray(
+        image.resize(size, _get_image_module().LANCZOS),
+        dtype=numpy.int16,
+    )
+
+
+def hamming_distance(first, second):
+    """Return the number of bits that differ between two hex hashes."""
+    return bin(int(first, 16) ^ int(second, 16)).count('1')
+
+
+def is_same_image(first, second):
+    """Whether two perceptual hashes are within the configured distance.
+
+    Returns False if either hash is missing.
+    """
+    if not first or not second:
+        return False
+    max_distance = staticconf.read_int('images.phash_max_distance', default=6)
+    return hamming_distance(first, second) <= max_distance
@@ -5,13 +5,16 @@
 # To view a copy of this license, visit:
 # http://creativecommons.org/licenses/by-nc-sa/3.0/
 """Code related to the representation of inmates."""
-import datetime
 import hashlib
 import json
 import logging
 import re
 
+from . import images
+from . import profiling
+from . import serialization
 from . import storage
+from . import timestamps
 from .util import git_hash
 
 
@@ -49,8 +52,15 @@ class Inmate(object):
             the instance.
 
     Properties:
+        arrest_time: The `arrest` attribute as a datetime, parsed only
+            once.
+        birth_date: The `DOB` attribute as a datetime, parsed only
+            once.
         git_hash: String of the SHA1 git-hash of the `mug` attribute,
             otherwise None if the `mug` attribute is None.
+        phash: String of the perceptual hash of the `mug` attribute,
+            once stored by `storage.load_phash`, otherwise None. Also
+            None if the `mug` attribute could not be decoded.
         sha1: String of the standard SHA1 hash of the `mug` attribute,
             otherwise None if the `mug` attribute is None.
     """
@@ -82,6 +92,46 @@ class Inmate(object):
         self.seen = seen
         self.tweet = None
 
+    @property
+    def arrest(self):
+        return self._arrest
+
+    @arrest.setter
+    def arrest(self, value):
+        self._arrest = value
+        self._arrest_time = None
+
+    @property
+    def arrest_time(self):
+        if self._arrest_time is None:
+            self._arrest_time = timestamps.parse_arrest(self.arrest)
+        return self._arrest_time
+
+    @property
+    def DOB(self):
+        return self._DOB
+
+    @DOB.setter
+    def DOB(self, value):
+        self._DOB = value
+        self._birth_date = None
+
+    @property
+    def birth_date(self):
+        if self._birth_date is None:
+            self._birth_date = timestamps.parse_date(self.DOB)
+        return self._birth_date
+
+    @property
+    def mug(self):
+        return self._mug
+
+    @mug.setter
+    def mug(self, value):
+        self._mug = value
+        # Hashes are computed lazily and only once per image.
+        self._hashes = {}
+
     @property
     def first_name(self):
         last_name, first_name = [
@@ -96,7 +146,9 @@ class Inmate(object):
         # TODO(bwbaugh|2014-06-28): Decide and keep only one hash.
         if self.mug is None:
             return None
-        return git_hash(self.mug)
+        if 'git_hash' not in self._hashes:
+            self._hashes['git_hash'] = git_hash(self.mug)
+        return self._hashes['git_hash']
 
     @property
     def sha1(self):
@@ -104,12 +156,30 @@ class Inmate(object):
         # TODO(bwbaugh|2014-06-28): Decide and keep only one hash.
         if self.mug is None:
             return None
-        hash_object = hashlib.sha1(self.mug)
-        return hash_object.hexdigest()
+        if 'sha1' not in self._hashes:
+            self._hashes['sha1'] = hashlib.sha1(self.mug).hexdigest()
+        return self._hashes['sha1']
+
+    @property
+    def phash(self):
+        """The perceptual hash of the `mug` attribute, if stored.
+
+        Computing it decodes the image, so it is never done here. See
+        `storage.load_phash`.
+        """
+        return self._hashes.get('phash')
+
+    @phash.setter
+    def phash(self, value):
+        self._hashes['phash'] = value
 
     @staticmethod
     def sort_key_for_arrest(inmate):
-        return datetime.datetime.strptime(inmate.arrest, '%m/%d/%Y %H:%M:%S')
+        """Sort key for anything with an `arrest`, by time of arrest."""
+        try:
+            return inmate.arrest_time
+        except AttributeError:
+            return timestamps.parse_arrest(inmate.arrest)
 
     @classmethod
     def from_dict(cls, data):
@@ -130,6 +200,7 @@ class Inmate(object):
 
         Args:
             kwargs: Keyword arguments will be passed to `json.dumps`.
+                Without any, the faster `serialization.dumps` is used.
 
         Returns:
             String in JSON format. For example:
@@ -149,7 +220,9 @@ class Inmate(object):
               "name": "DOE, JANE"
             }
         """
-        return json.dumps(self._asdict(), **kwargs)
+        if kwargs:
+            return json.dumps(self._asdict(), **kwargs)
+        return serialization.dumps(self._asdict())
 
     def _asdict(self):
         """Helper to generate a dictionary representation."""
@@ -160,13 +233,31 @@ class Inmate(object):
             'git_hash': self.git_hash,
             'id': self.id,
             'name': self.name,
+            'phash': self.phash,
             'seen': self.seen,
             'sha1': self.sha1,
             'tweet': self.tweet
         }
 
     def __repr__(self):
-        """Represent the Inmate as a dictionary, not including the mug shot."""
+        """Represent the Inmate cheaply enough to use in any log message.
+
+        Only identifying fields are included. See `verbose_repr` for a
+        representation of everything except the mug shot.
+        """
+        template = '{class_name}(id={id!r}, name={name!r}, arrest={arrest!r})'
+        return template.format(
+            class_name=self.__class__.__name__,
+            id=self.id,
+            name=self.name,
+            arrest=self.arrest,
+        )
+
+    def verbose_repr(self):
+        """Represent the Inmate as a dictionary, not including the mug shot.
+
+        This hashes the mug shot, so avoid calling it on hot paths.
+        """
         template = '{class_name}({kwargs})'
         return template.format(
             class_name=self.__class__.__name__,
@@ -303,7 +394,12 @@ def _find_missing(inmates, recent_inmates):
 def _get_all_past_records():
     all_past_records = [
         inmate
-        for inmate in storage.read_log(recent=False)
+        for inmate in storage.read_log(
+            recent=False,
+            fields=serialization.PAST_RECORD_FIELDS,
+            interner=serialization.Interner(),
+            tweet_fields=serialization.PAST_TWEET_FIELDS,
+        )
         if inmate.get('tweet') and inmate.get('sha1')
     ]
     log.debug('Loaded %d past inmates.', len(all_past_records))
@@ -396,6 +492,7 @@ def extract_updated_inmates(inmates):
         return []
     updated_inmates = []
     all_past_records = _get_all_past_records()
+    profiling.checkpoint('history')
     for inmate in inmates:
         updated_inmate = _maybe_get_updated_inmate(
             inmate=inmate,
@@ -414,19 +511,19 @@ def _maybe_get_updated_inmate(inmate, all_past_records):
     )
     if not past_records:
         return None
-    most_recent_record = sorted(
+    most_recent_record = max(
         past_records,
-        key=lambda x: datetime.datetime.strptime(
-            x['tweet']['created_at'],
-            '%a %b %d %H:%M:%S +0000 %Y',
-        ),
-        reverse=True,
-    )[0]
+        key=lambda x: timestamps.parse_tweet_time(x['tweet']['created_at']),
+    )
     last_tweet_id = most_recent_record['tweet']['id_str']
     log.debug('Last tweet-ID for inmate-ID %s: %s', inmate.id, last_tweet_id)
     if inmate.sha1 == most_recent_record['sha1']:
         log.debug('Skipping since mug shot is the same.')
         return None
+    # The jail server sometimes re-encodes the same photo.
+    if images.is_same_image(inmate.phash, most_recent_record.get('phash')):
+        log.debug('Skipping since mug shot looks the same.')
+        return None
     return {
         'inmate': inmate,
         'last_tweet_id': last_tweet_id,
@@ -1,14 +1,21 @@
 # -*- coding: utf-8 -*-
 """Code related to the jail report, such as retrieval and parsing."""
+import concurrent.futures
 import datetime
 import logging
 import re
+import socket
+import time
+import urllib.parse
 import urllib.request
 
-import boto.s3.key
 import http.client
 import staticconf
 
+from . import charges as charges_module
+from . import proxies
+from . import retry
+from . import storage
 from . import util
 from .inmate import Inmate
 
@@ -28,31 +35,124 @@ _dlInmates_Charges_\d+_lblAmount_\d+">(?P<amount>.*?)</span>
 """, re.DOTALL | re.X)
 
 
-def _get_opener():
-    """Use a proxy (Polipo through Tor) to send our requests through."""
-    # If Polipo isn't running, you might need to start it manually
-    #   after Tor, and if so be sure to use whatever port it is
-    #   listening on (such as 8123). The default port for Polipo used
-    #   in the Tor Vidalia Bundle is 8118.
-    proxy_support = urllib.request.ProxyHandler({
-        'http': '{host}:{port}'.format(
-            host=staticconf.read('proxy.host'),
-            port=staticconf.read('proxy.port'),
-        )
-    })
-    opener = urllib.request.build_opener(proxy_support)
-    return opener
+# Used when there is no proxy, which is useful when pointing `jail.url`
+#   at a local server for testing.
+_direct_opener = urllib.request.build_opener()
+
+
+# Most bytes read at a time, between checks of the deadline.
+_READ_CHUNK_SIZE = 16 * 1024
+
+# Mug shots are stored by hash, so they never change once uploaded.
+MUG_SHOT_HEADERS = {
+    'Cache-Control': 'max-age=31556952,public',
+    'Content-Type': 'image/jpeg',
+}
+# Mug shots are linked to from tweets, so anyone may read them.
+MUG_SHOT_POLICY = 'public-read'
+
+
+def _read_url(opener, url, seconds):
+    """Return the body at `url`, taking no longer than `seconds` overall.
+
+    Each socket operation, connecting or reading, also times out after
+    `timeout.socket` seconds (or sooner, if less of the deadline is
+    left when connecting). The body is read in chunks so that a server
+    trickling out its response can't hold the request open for long
+    past the deadline.
+
+    Raises:
+        TimeoutError if the deadline or a socket operation timed out.
+    """
+    deadline = util.Deadline(seconds=seconds)
+    socket_timeout = staticconf.read_float('timeout.socket', default=60)
+    try:
+        response = opener.open(url, timeout=deadline.timeout(socket_timeout))
+    except urllib.error.URLError as error:
+        if isinstance(error.reason, socket.timeout):
+            raise TimeoutError(error.reason)
+        raise
+    with response:
+        chunks = []
+        while True:
+            deadline.check()
+            chunk = response.read1(_READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def fetch(url, seconds, site=None):
+    """Read a URL, retrying temporary failures through the site's breaker.
+
+    Each attempt waits for the site's rate limit, goes through the proxy
+    chosen by the pool at that moment, and has its own deadline of
+    `seconds`.
+    """
+    pool = proxies.get_pool()
+
+    def attempt():
+        if site is not None:
+            site.wait_for_request()
+        if pool is None:
+            return _read_url(opener=_direct_opener, url=url, seconds=seconds)
+        proxy = pool.acquire()
+        start = time.monotonic()
+        ok = False
+        try:
+            data = _read_url(opener=proxy.opener, url=url, seconds=seconds)
+            ok = True
+        except Exception as error:
+            # Such as a 404, which the proxy isn't to blame for.
+            ok = not retry.is_retryable(error)
+            raise
+        finally:
+            pool.release(proxy, elapsed_s=time.monotonic() - start, ok=ok)
+        return data
+    return retry.call(
+        attempt,
+        breaker=None if site is None else site.breaker,
+    )
+
+
+def get_report_url():
+    """The URL of the jail report, which is also the base for mug shots."""
+    return staticconf.read('jail.url')
+
+
+def get_mug_shot_url(inmate_id):
+    return make_mug_shot_url(base_url=get_report_url(), inmate_id=inmate_id)
+
+
+def make_mug_shot_url(base_url, inmate_id):
+    return urllib.parse.urljoin(
+        base_url,
+        'ImageHandler.ashx?type=image&imageID={mug_id}'.format(
+            mug_id=inmate_id,
+        ),
+    )
+
 
+def get_jail_report(site=None):
+    """Retrieves the Denton City Jail Custody Report webpage.
 
-def get_jail_report():
-    """Retrieves the Denton City Jail Custody Report webpage."""
+    Temporary failures are retried, as configured under `retry`.
+
+    :param site: Retrieve the report of this site instead.
+    :type site: dentonpolice.sites.Site
+    """
     log.info('Getting Jail Report')
-    opener = _get_opener()
     try:
-        with util.timeout(seconds=staticconf.read('timeout.open_jail_report')):
-            response = opener.open('http://dpdjailview.cityofdenton.com/')
-        log.debug('Reading jail report page')
-        html = response.read().decode('utf-8')
+        seconds = staticconf.read_float('timeout.open_jail_report')
+        if site is None:
+            data = fetch(url=get_report_url(), seconds=seconds)
+        else:
+            data = site.fetch(url=site.get_report_url(), seconds=seconds)
+        html = data.decode('utf-8')
+    except retry.CircuitOpenError as error:
+        html = None
+        log.warning('Not getting jail report: %s', error)
     except urllib.error.HTTPError as error:
         html = None
         log.warning(
@@ -63,13 +163,18 @@ def get_jail_report():
     except (http.client.HTTPException, urllib.error.URLError) as error:
         html = None
         log.warning('Other error while getting jail report: %r', error)
-    except TimeoutError:
+    except (TimeoutError, socket.timeout):
         html = None
         log.warning('Timeout while getting jail report.')
+    except OSError as error:
+        # Such as the connection being reset, even after retrying.
+        html = None
+        log.warning('Other error while getting jail report: %r', error)
     return html
 
 
-def save_jail_report_to_s3(bucket, html, timestamp):
+def save_jail_report_to_s3(
+        bucket, html, timestamp, provenance='dentonpolice'):
     """Uploads the jail report HTML to S3 with a timestamp.
 
     The timestamp is used to set the filename / key.
@@ -78,10 +183,18 @@ def save_jail_report_to_s3(bucket, html, timestamp):
     :type html: str
     :param timestamp: When the report was retrieved, preferably in UTC.
     :type timestamp: datetime.datetime
+    :param provenance: Name of the site the report came from.
+    :type provenance: str
     """
+    # Imported here so that starting up doesn't pay for it unless the
+    #   reports are archived to S3.
+    import boto.s3.key
     key = boto.s3.key.Key(
         bucket=bucket,
-        name=_make_jail_report_key_name(timestamp=timestamp),
+        name=make_jail_report_key_name(
+            timestamp=timestamp,
+            provenance=provenance,
+        ),
     )
     log.debug('Saving report to key: %r', key)
     key.set_contents_from_string(
@@ -94,7 +207,7 @@ def save_jail_report_to_s3(bucket, html, timestamp):
     return key.name
 
 
-def _make_jail_report_key_name(timestamp):
+def make_jail_report_key_name(timestamp, provenance='dentonpolice'):
     # Example: 'jail_report/dentonpolice/2015/04/21/20150421080433.html'
     return (
         'jail_report/'
@@ -104,7 +217,7 @@ def _make_jail_report_key_name(timestamp):
         '{day}/'
         '{full_time}.html'
     ).format(
-        provenance='dentonpolice',
+        provenance=provenance,
         year=timestamp.strftime('%Y'),
         month=timestamp.strftime('%m'),
         day=timestamp.strftime('%d'),
@@ -113,46 +226,98 @@ def _make_jail_report_key_name(timestamp):
     )
 
 
-def get_mug_shots(inmates, bucket):
-    """Retrieves the mug shot for each Inmate and stores it in the Inmate."""
+def get_mug_shots(inmates, bucket, site=None):
+    """Retrieves the mug shot for each Inmate and stores it in the Inmate.
+
+    Mug shots are downloaded in parallel, by default one at a time per
+    proxy so that each download can use its own circuit. A mug shot
+    that can't be retrieved, even after retrying, is skipped and its
+    Inmate is left without one. If the site's circuit breaker opens, the
+    remaining mug shots are skipped too, but those already retrieved
+    are kept.
+
+    :param site: Retrieve the mug shots from this site instead.
+    :type site: dentonpolice.sites.Site
+    :returns: The Inmates that are missing a mug shot.
+    """
     log.info('Getting mug shots')
-    opener = _get_opener()
-    for inmate in inmates:
-        log.info('Opening mug shot URL (ID: %s)', inmate.id)
-        uri = (
-            'http://dpdjailview.cityofdenton.com/'
-            'ImageHandler.ashx?type=image&imageID={mug_id}'
-        ).format(mug_id=inmate.id)
+    if not inmates:
+        return []
+    max_workers = staticconf.read_int('jail.mug_shot_downloads', default=0)
+    if not max_workers:
+        pool = proxies.get_pool()
+        max_workers = len(pool) if pool is not None else 1
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        futures = [
+            executor.submit(_get_mug_shot, inmate=inmate, site=site)
+            for inmate in inmates
+        ]
+    missing = []
+    skipped = 0
+    for inmate, future in zip(inmates, futures):
         try:
-            with util.timeout(
-                seconds=staticconf.read('timeout.open_one_mug_shot'),
-            ):
-                response = opener.open(uri)
-            image_data = response.read()
-        except urllib.error.HTTPError as e:
-            log.warning(
-                'Unable to retrieve inmate-ID %s due to HTTP %s: %r',
-                inmate.id,
-                e.code,
-                e,
-            )
-            continue
-        except http.client.BadStatusLine as e:
-            log.warning(
-                'Unable to retrieve inmate-ID %s: %r',
-                inmate.id,
-                e,
-            )
-            continue
-        except TimeoutError:
-            log.warning(
-                'Timeout while getting mug shot for inmate-ID %s.',
-                inmate.id,
-            )
+            image_data = future.result()
+        except retry.CircuitOpenError:
+            skipped += 1
+            image_data = None
+        if image_data is None:
+            missing.append(inmate)
             continue
         inmate.mug = image_data
         if bucket is not None:
             _save_mug_shot_to_s3(bucket=bucket, inmate=inmate)
+    if skipped:
+        log.warning(
+            'Skipped %d mug shots since the circuit for the site is open.',
+            skipped,
+        )
+    return missing
+
+
+def _get_mug_shot(inmate, site):
+    """Return the mug shot data, or None if it couldn't be retrieved.
+
+    Raises:
+        retry.CircuitOpenError if the site's circuit breaker is open.
+    """
+    log.info('Opening mug shot URL (ID: %s)', inmate.id)
+    seconds = staticconf.read_float('timeout.open_one_mug_shot')
+    try:
+        if site is None:
+            return fetch(
+                url=get_mug_shot_url(inmate_id=inmate.id),
+                seconds=seconds,
+            )
+        return site.fetch(
+            url=site.get_mug_shot_url(inmate_id=inmate.id),
+            seconds=seconds,
+        )
+    except urllib.error.HTTPError as e:
+        log.warning(
+            'Unable to retrieve inmate-ID %s due to HTTP %s: %r',
+            inmate.id,
+            e.code,
+            e,
+        )
+    except (http.client.HTTPException, urllib.error.URLError) as e:
+        log.warning(
+            'Unable to retrieve inmate-ID %s: %r',
+            inmate.id,
+            e,
+        )
+    except (TimeoutError, socket.timeout):
+        log.warning(
+            'Timeout while getting mug shot for inmate-ID %s.',
+            inmate.id,
+        )
+    except OSError as e:
+        # Such as the connection being reset, even after retrying.
+        log.warning(
+            'Unable to retrieve inmate-ID %s: %r',
+            inmate.id,
+            e,
+        )
+    return None
 
 
 def _save_mug_shot_to_s3(bucket, inmate):
@@ -160,24 +325,32 @@ def _save_mug_shot_to_s3(bucket, inmate):
         raise ValueError('Must have image data in order to save.')
     # Compute the hash only once and save the result.
     image_hash = inmate.sha1
+    # Imported here so that starting up doesn't pay for it unless mug
+    #   shots are archived to S3.
+    import boto.s3.key
     key = boto.s3.key.Key(
         bucket=bucket,
-        name='mugshots/{first}/{second}/{hash}.jpg'.format(
-            first=image_hash[0:2],
-            second=image_hash[2:4],
-            hash=image_hash,
-        ),
+        name=make_mug_shot_key_name(image_hash),
     )
+    phash = storage.load_phash(inmate)
+    if phash:
+        key.set_metadata('phash', phash)
     log.debug('Saving mugshot for inmate-ID %s to S3: %r', inmate.id, key)
     key.set_contents_from_string(
         string_data=inmate.mug,
-        headers={
-            'Cache-Control': 'max-age=31556952,public',
-            'Content-Type': 'image/jpeg',
-        },
+        headers=MUG_SHOT_HEADERS,
         # If we've seen this before, keep the original timestamp.
         replace=False,
-        policy='public-read',
+        policy=MUG_SHOT_POLICY,
+    )
+
+
+def make_mug_shot_key_name(image_hash):
+    # Example: 'mugshots/ab/cd/abcd...ef.jpg'
+    return 'mugshots/{first}/{second}/{hash}.jpg'.format(
+        first=image_hash[0:2],
+        second=image_hash[2:4],
+        hash=image_hash,
     )
 
 
@@ -198,7 +371,8 @@ def parse_inmates(html):
             inmate.end(),
             next_inmate,
         ):
-            charges.append(charge.groupdict())
+            # Split out the agency and offense once, here.
+            charges.append(charges_module.normalize(charge.groupdict()))
         data['charges'] = charges
         # Store the current time as when seen
         data['seen'] = str(datetime.datetime.now())
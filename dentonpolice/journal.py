@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""Write-ahead journal of the crawl cycle in progress.
+
+Each stage of a crawl cycle is recorded in `path.cycle_journal` as soon
+as it is complete, along with what later stages need to carry on from
+it. If the process dies mid-cycle, the next cycle resumes after the last
+completed stage rather than starting over:
+
+    report
+        The report was retrieved and saved to `path.recent_report_html`.
+        Resuming reuses it, rather than retrieving a newer one.
+    mug_shots
+        Mug shots were retrieved and saved. Resuming reads them back
+        from storage instead of downloading them again.
+    selected
+        The inmates to process were chosen. Choosing them again would
+        give a different answer once the recent log has been replaced.
+    new_inmates
+        Tweets of new inmates were queued, and the recent log replaced.
+    done
+        The cycle finished.
+
+Each queued post is recorded too, so a resumed cycle doesn't queue a
+post that may already have been made. A cycle older than
+`journal.max_resume_age_s` isn't resumed, since its report is stale.
+"""
+import hashlib
+import logging
+import os
+import time
+
+import staticconf
+
+from . import config
+from . import serialization
+from . import util
+
+
+log = logging.getLogger(__name__)
+
+STAGES = ('report', 'mug_shots', 'selected', 'new_inmates', 'done')
+
+
+def report_hash(html):
+    return hashlib.sha1(html.encode('utf-8')).hexdigest()
+
+
+class CycleJournal(object):
+
+    """The journal of one site's crawl cycles.
+
+    Args:
+        location: Filename of the journal, or None to keep no journal.
+        max_resume_age_s: Oldest cycle, in seconds, that is resumed.
+    """
+
+    def __init__(self, location, max_resume_age_s=900):
+        self.location = location
+        self.max_resume_age_s = max_resume_age_s
+        # Data recorded for each stage reached, and the keys of the
+        #   posts queued, in the cycle being resumed or run.
+        self.stages = {}
+        self.enqueued = set()
+
+    @classmethod
+    def from_config(cls):
+        return cls(
+            location=config.get_path('cycle_journal', default=None),
+            max_resume_age_s=staticconf.read_float(
+                'journal.max_resume_age_s',
+                default=900,
+            ),
+        )
+
+    def resume(self, now=None):
+        """Load an unfinished cycle, if there is one recent enough.
+
+        Returns:
+            True if the cycle should be resumed.
+        """
+        self.stages = {}
+        self.enqueued = set()
+        if not self.location:
+            return False
+        entries = []
+        try:
+            with open(self.location, mode='rb') as f:
+                for line in f:
+                    try:
+                        entries.append(serialization.loads(line))
+                    except ValueError:
+                        # Only the last line can be partly written.
+                        break
+        except FileNotFoundError:
+            return False
+        stages = {}
+        enqueued = set()
+        for entry in entries:
+            if 'enqueued' in entry:
+                enqueued.add(entry['enqueued'])
+            else:
+                stages[entry['stage']] = entry
+        if not stages or 'done' in stages or 'report' not in stages:
+            return False
+        age = (now or time.time()) - stages['report']['time']
+        if age > self.max_resume_age_s:
+            log.info('Not resuming a crawl cycle from %d s ago.', age)
+            return False
+        self.stages = stages
+        self.enqueued = enqueued
+        log.info(
+            'Resuming a crawl cycle after the %s stage.',
+            self.last_stage,
+        )
+        return True
+
+    @property
+    def last_stage(self):
+        reached = [stage for stage in STAGES if stage in self.stages]
+        return reached[-1] if reached else None
+
+    def reached(self, stage):
+        return stage in self.stages
+
+    def get(self, stage):
+        """Return what was recorded when `stage` was reached."""
+        return self.stages[stage]
+
+    def begin(self, html):
+        """Start a new cycle with the report that was just retrieved."""
+        self.stages = {}
+        self.enqueued = set()
+        entry = {
+            'stage': 'report',
+            'time': time.time(),
+            'sha1': report_hash(html),
+        }
+        if self.location:
+            # Replaces the journal of the last cycle.
+            util.atomic_write(
+                self.location,
+                serialization.dumps(entry) + '\n',
+            )
+        self.stages['report'] = entry
+
+    def record(self, stage, **data):
+        """Record that a stage was completed, with data to resume it."""
+        entry = dict(data, stage=stage)
+        self._append(entry)
+        self.stages[stage] = entry
+
+    def record_enqueued(self, key):
+        """Record that a post was queued."""
+        self._append({'enqueued': key})
+        self.enqueued.add(key)
+
+    def _append(self, entry):
+        if not self.location:
+            return
+        with open(self.location, mode='a', encoding='utf-8') as f:
+            f.write(serialization.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
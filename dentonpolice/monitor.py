@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""HTTP endpoint serving the live state of the crawler.
+
+Started alongside the crawl loop if `status.port` is set, so process
+supervisors and load tests can check on the crawler without reading
+its logs. See `status` for what is reported.
+
+Endpoints:
+
+    GET /health
+        `{"healthy": true}`, or a 503 response listing the sites that
+        haven't had a successful cycle in `status.max_cycle_age_s`.
+    GET /status
+        Everything, as JSON.
+    GET /metrics
+        Everything, in the Prometheus text format.
+"""
+import logging
+import urllib.parse
+
+import staticconf
+
+from . import httpserver
+from . import status
+
+
+log = logging.getLogger(__name__)
+
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class _Handler(httpserver.RequestHandler):
+
+    def do_GET(self):
+        path = urllib.parse.urlsplit(self.path).path.rstrip('/')
+        if path == '/health':
+            unhealthy = status.unhealthy_sites()
+            self.send_json(503 if unhealthy else 200, {
+                'healthy': not unhealthy,
+                'unhealthy_sites': unhealthy,
+            })
+        elif path == '/status':
+            self.send_json(200, status.snapshot())
+        elif path == '/metrics':
+            self.send_body(
+                200,
+                METRICS_CONTENT_TYPE,
+                status.metrics().encode('utf-8'),
+            )
+        else:
+            self.send_json(404, {'error': 'Not found.'})
+
+
+class MonitorServer(httpserver.ThreadedHTTPServer):
+
+    """Threaded HTTP server answering with the crawler's status.
+
+    Args:
+        address: Tuple of (host, port). Use port 0 to pick a free port.
+    """
+
+    thread_name = 'status-monitor'
+
+    def __init__(self, address):
+        super().__init__(address, _Handler)
+
+
+def start_from_config():
+    """Serve the status in the background, if `status.port` is set.
+
+    Returns:
+        The MonitorServer, or None if not configured.
+    """
+    port = staticconf.read_int('status.port', default=0)
+    if not port:
+        return None
+    server = MonitorServer(
+        address=(staticconf.read('status.host', default='127.0.0.1'), port),
+    )
+    server.start_in_thread()
+    log.info('Serving the crawler status at %s', server.url)
+    return server
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+"""Index of perceptual hashes for finding similar mug shots.
+
+Useful for spotting the same person booked under different inmate IDs.
+The index is a JSON-lines file at `path.mug_index` mapping each file in
+`path.mug_shot_dir` (or each mug shot in the pack, if
+`path.mug_pack_dir` is set) to its perceptual hash. Building it hashes
+only the mug shots that are new or changed since the last build, using a
+pool of processes, and `storage.save_mug_shots` appends to it as it
+saves.
+
+Lookups use a BK-tree, which only visits the part of the corpus that
+could be within the requested Hamming distance.
+
+Example:
+
+    python -m dentonpolice.mugindex build
+    python -m dentonpolice.mugindex query 318937 --distance 8
+"""
+import argparse
+import concurrent.futures
+import logging
+import os
+import threading
+
+from . import config
+from . import images
+from . import mugpack
+from . import serialization
+
+
+log = logging.getLogger(__name__)
+
+_append_lock = threading.Lock()
+
+
+def _append(location, lines):
+    """Append lines to the index, durably."""
+    data = ''.join(lines).encode('utf-8')
+    with _append_lock, open(location, mode='a+b') as f:
+        if f.seek(0, os.SEEK_END):
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                # Left by a write that didn't finish. Ending it keeps
+                #   the new lines intact, and it is skipped by `load`.
+                data = b'\n' + data
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class BKTree(object):
+
+    """Metric tree over 64-bit hashes using the Hamming distance.
+
+    Each node keeps its children keyed by their distance to it, so by
+    the triangle inequality a search only needs to descend into children
+    whose key is within `max_distance` of the query's distance to the
+    node.
+    """
+
+    def __init__(self):
+        # Each node is [hash, list of values, dict of distance to node].
+        self._root = None
+        self.size = 0
+
+    def add(self, hash_value, value):
+        """Add a value under an integer hash."""
+        self.size += 1
+        if self._root is None:
+            self._root = [hash_value, [value], {}]
+            return
+        node = self._root
+        while True:
+            distance = bin(node[0] ^ hash_value).count('1')
+            if distance == 0:
+                node[1].append(value)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [hash_value, [value], {}]
+                return
+            node = child
+
+    def search(self, hash_value, max_distance):
+        """Return (distance, value) pairs within range, nearest first."""
+        results = []
+        if self._root is None:
+            return results
+        candidates = [self._root]
+        while candidates:
+            node = candidates.pop()
+            distance = bin(node[0] ^ hash_value).count('1')
+            if distance <= max_distance:
+                results.extend((distance, value) for value in node[1])
+            low = distance - max_distance
+            high = distance + max_distance
+            candidates.extend(
+                child
+                for child_distance, child in node[2].items()
+                if low <= child_distance <= high
+            )
+        results.sort(key=lambda result: result[0])
+        return results
+
+
+def inmate_id_from_filename(filename):
+    """Return the inmate ID of a file named `{id}.jpg` or `{id}_{ts}.jpg`."""
+    return os.path.splitext(filename)[0].split('_', 1)[0]
+
+
+def record(location, mug_path, phash, sha1=None):
+    """Append a saved mug shot to the index, if the index is enabled.
+
+    Args:
+        location: Filename of the index, or None if disabled.
+        mug_path: Path of the saved mug shot, or its name in the pack.
+        phash: Perceptual hash of the mug shot.
+        sha1: SHA1 of a mug shot in the pack. Files are instead checked
+            for changes by their size and time of modification.
+    """
+    if not location or not phash:
+        return
+    entry = {'filename': os.path.basename(mug_path), 'phash': phash}
+    if sha1 is not None:
+        entry['sha1'] = sha1
+    else:
+        try:
+            stat = os.stat(mug_path)
+        except FileNotFoundError:
+            pass
+        else:
+            entry.update(size=stat.st_size, mtime=stat.st_mtime)
+    _append(location, [serialization.dumps(entry) + '\n'])
+
+
+def _hash_file(path):
+    with open(path, mode='rb') as f:
+        return images.perceptual_hash(f.read())
+
+
+def _hash_pack_range(location):
+    path, offset, length = location
+    with open(path, mode='rb') as f:
+        f.seek(offset)
+        return images.perceptual_hash(f.read(length))
+
+
+class MugIndex(object):
+
+    """Perceptual hashes of every stored mug shot.
+
+    Args:
+        location: Filename of the index.
+        mug_dir: Directory of the mug shots being indexed.
+        pack: `mugpack.MugPack` of the mug shots being indexed, used
+            instead of `mug_dir` if given.
+    """
+
+    def __init__(self, location, mug_dir, pack=None):
+        self.location = location
+        self.mug_dir = mug_dir
+        self.pack = pack
+        # Filename to the index entry, where later entries win.
+        self.entries = {}
+        self._tree = None
+
+    @classmethod
+    def from_config(cls):
+        return cls(
+            location=config.get_path('mug_index'),
+            mug_dir=config.get_path('mug_shot_dir'),
+            pack=mugpack.get_pack(),
+        )
+
+    def load(self):
+        """Read the index file. Returns self for chaining."""
+        self.entries = {}
+        try:
+            with open(self.location, mode='rb') as f:
+                for line in f:
+                    try:
+                        entry = serialization.loads(line)
+                    except ValueError:
+                        # Left by a write that didn't finish.
+                        log.warning(
+                            'Ignoring a partial line in the mug shot index.',
+                        )
+                        continue
+                    self.entries[entry['filename']] = entry
+        except FileNotFoundError:
+            log.debug('No mug shot index yet at %s', self.location)
+        self._tree = None
+        return self
+
+    def update(self, processes=None):
+        """Hash every mug shot that is new or changed since last indexed.
+
+        Args:
+            processes: Number of worker processes. None uses one per CPU,
+                and 0 hashes in this process.
+
+        Returns:
+            The number of mug shots that were hashed.
+        """
+        if self.pack is not None:
+            stale = self._stale_in_pack()
+            hash_function = _hash_pack_range
+        else:
+            stale = self._stale_in_dir()
+            hash_function = _hash_file
+        log.info('Hashing %d new or changed mug shots.', len(stale))
+        if not stale:
+            return 0
+        sources = [source for _, source, _ in stale]
+        if processes == 0:
+            hashes = [hash_function(source) for source in sources]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+                hashes = list(pool.map(hash_function, sources, chunksize=64))
+        lines = []
+        for (filename, _, fields), phash in zip(stale, hashes):
+            entry = dict(fields, filename=filename, phash=phash)
+            self.entries[filename] = entry
+            lines.append(serialization.dumps(entry) + '\n')
+        _append(self.location, lines)
+        self._tree = None
+        return len(stale)
+
+    def _stale_in_dir(self):
+        """List (filename, path, fields) of files to hash."""
+        stale = []
+        for filename in sorted(os.listdir(self.mug_dir)):
+            if not filename.endswith('.jpg'):
+                continue
+            path = os.path.join(self.mug_dir, filename)
+            stat = os.stat(path)
+            entry = self.entries.get(filename)
+            if (
+                entry is not None and
+                entry.get('size', stat.st_size) == stat.st_size and
+                entry.get('mtime', stat.st_mtime) == stat.st_mtime
+            ):
+                continue
+            stale.append((
+                filename,
+                path,
+                {'size': stat.st_size, 'mtime': stat.st_mtime},
+            ))
+        return stale
+
+    def _stale_in_pack(self):
+        """List (name, location in the pack, fields) of mug shots to hash."""
+        stale = []
+        for name, sha1 in sorted(self.pack.items()):
+            entry = self.entries.get(name)
+            if entry is not None and entry.get('sha1') == sha1:
+                continue
+            stale.append((name, self.pack.location(name), {'sha1': sha1}))
+        return stale
+
+    @property
+    def tree(self):
+        if self._tree is None:
+            self._tree = BKTree()
+            for entry in self.entries.values():
+                if entry['phash']:
+                    self._tree.add(int(entry['phash'], 16), entry['filename'])
+        return self._tree
+
+    def similar(self, phash, max_distance=8, limit=None):
+        """Find mug shots that look similar to the given perceptual hash.
+
+        Returns:
+            List of dicts with the `filename`, `inmate_id`, and `distance`
+            of each match, nearest first.
+        """
+        matches = self.tree.search(int(phash, 16), max_distance)
+        return [
+            {
+                'distance': distance,
+                'filename': filename,
+                'inmate_id': inmate_id_from_filename(filename),
+            }
+            for distance, filename in matches[:limit]
+        ]
+
+    def phash_for(self, name):
+        """Return the hash of a filename, or of an inmate ID's latest."""
+        if name in self.entries:
+            return self.entries[name]['phash']
+        candidates = sorted(
+            filename
+            for filename in self.entries
+            if inmate_id_from_filename(filename) == name
+        )
+        if not candidates:
+            return None
+        return self.entries[candidates[-1]]['phash']
+
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    subparsers = parser.add_subparsers(dest='command')
+    build = subparsers.add_parser('build', help='Hash new mug shots.')
+    build.add_argument('--processes', type=int, default=None)
+    query = subparsers.add_parser('query', help='Find similar mug shots.')
+    query.add_argument(
+        'subject',
+        help='An indexed filename, an inmate ID, or a path to an image.',
+    )
+    query.add_argument('--distance', type=int, default=8)
+    query.add_argument('--limit', type=int, default=20)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    config.load_config()
+    args = _parse_args(argv)
+    index = MugIndex.from_config().load()
+    if args.command == 'build':
+        index.update(processes=args.processes)
+        print('Indexed {} mug shots.'.format(len(index.entries)))
+        return
+    if args.command == 'query':
+        if os.path.isfile(args.subject):
+            phash = _hash_file(args.subject)
+        else:
+            phash = index.phash_for(args.subject)
+        if phash is None:
+            raise SystemExit('No perceptual hash for {!r}.'.format(
+                args.subject,
+            ))
+        for match in index.similar(phash, args.distance, args.limit):
+            print('{distance:2d} {inmate_id} {filename}'.format(**match))
+        return
+    raise SystemExit('Specify a command: build or query.')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
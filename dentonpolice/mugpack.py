@@ -0,0 +1,456 @@
+# -*- coding: utf-8 -*-
+"""Append-only pack files of mug shots.
+
+Rather than one small file per mug shot in `path.mug_shot_dir`, mug
+shots are appended to a few large segment files in `path.mug_pack_dir`:
+
+    segment-000000.pack
+        The images, one after another. A new segment is started once
+        one would grow past `mug_pack.segment_bytes`.
+    index.json
+        One JSON line per saved mug shot, with its `name`, `inmate_id`,
+        `sha1`, `phash`, and the `segment`, `offset`, and `length` of
+        its bytes.
+
+Names are the filenames the directory used, `{id}.jpg` for the first
+mug shot of an inmate and `{id}_{yymmddHHMMSS}.jpg` for later ones. Each
+distinct image is stored once, by its SHA1, however many names it has.
+Reads map the segments with `mmap` and return a `memoryview`, so the
+image is not copied until it is written somewhere else.
+
+The mug shots in `path.mug_shot_dir` are added to a pack the first time
+it is used, see `get_pack`. They can also be added, and removed from the
+directory, with:
+
+    python -m dentonpolice.mugpack migrate [--remove]
+"""
+import argparse
+import collections
+import contextlib
+import datetime
+import hashlib
+import logging
+import mmap
+import os
+import threading
+
+import staticconf
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where only one process may use a pack.
+    fcntl = None
+
+from . import config
+from . import serialization
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SEGMENT_BYTES = 256 * 1024 * 1024
+INDEX_FILENAME = 'index.json'
+# Created once the mug shot directory has been added to the pack.
+MIGRATED_FILENAME = 'migrated'
+
+_packs = {}
+_packs_lock = threading.Lock()
+
+
+def _segment_filename(segment):
+    return 'segment-{:06d}.pack'.format(segment)
+
+
+class MugPack(object):
+
+    """Mug shots stored in append-only segment files.
+
+    The index is read when the pack is created, and what other processes
+    added since is read before each lookup. Writes lock the index, so a
+    pack may be shared between threads, and between the processes of
+    nodes crawling the same site.
+
+    Args:
+        directory: Where the segments and index are kept.
+        segment_bytes: Size at which a new segment is started.
+    """
+
+    def __init__(self, directory, segment_bytes=DEFAULT_SEGMENT_BYTES):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        # SHA1 to the (segment, offset, length) of the image.
+        self.blobs = {}
+        # Name to the SHA1 of its image.
+        self.names = {}
+        # Inmate ID to their names, in the order they were saved.
+        self.by_inmate = collections.defaultdict(list)
+        # SHA1 to the perceptual hash of the image, if it was given.
+        self.phashes = {}
+        self._last_segment = 0
+        # How much of the index has been read.
+        self._index_offset = 0
+        self._maps = {}
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            self._refresh()
+
+    @classmethod
+    def from_config(cls):
+        return cls(
+            directory=config.get_path('mug_pack_dir'),
+            segment_bytes=staticconf.read_int(
+                'mug_pack.segment_bytes',
+                default=DEFAULT_SEGMENT_BYTES,
+            ),
+        )
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self.names)
+
+    def __contains__(self, name):
+        with self._lock:
+            self._refresh()
+            return name in self.names
+
+    def _path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def _refresh(self):
+        """Read the entries added to the index since it was last read.
+
+        Must be called with the lock held.
+        """
+        path = self._path(INDEX_FILENAME)
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return
+        if size <= self._index_offset:
+            return
+        sizes = {}
+        with open(path, mode='rb') as f:
+            f.seek(self._index_offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # Only the last line can be partly written, by a
+                    #   process still writing it or one that crashed.
+                    #   It is read once finished, or removed by `add`.
+                    break
+                self._index_offset += len(line)
+                try:
+                    entry = serialization.loads(line)
+                except ValueError:
+                    log.warning('Ignoring a corrupt line in the mug index.')
+                    continue
+                segment = entry['segment']
+                if segment not in sizes:
+                    try:
+                        sizes[segment] = os.path.getsize(
+                            self._path(_segment_filename(segment)),
+                        )
+                    except FileNotFoundError:
+                        sizes[segment] = 0
+                end = entry['offset'] + entry['length']
+                if end > sizes[segment]:
+                    log.warning(
+                        'Ignoring mug shot %s, which is past the end of '
+                        'segment %d.',
+                        entry['name'],
+                        segment,
+                    )
+                    continue
+                self._remember(entry)
+
+    @contextlib.contextmanager
+    def _locked_index(self):
+        """Open the index for appending, locked against other processes."""
+        with open(self._path(INDEX_FILENAME), mode='ab') as f:
+            if fcntl is not None:
+                # Released when the file is closed.
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            yield f
+
+    def _remember(self, entry):
+        self._last_segment = max(self._last_segment, entry['segment'])
+        self.blobs[entry['sha1']] = (
+            entry['segment'],
+            entry['offset'],
+            entry['length'],
+        )
+        if entry.get('phash'):
+            self.phashes[entry['sha1']] = entry['phash']
+        if entry['name'] not in self.names:
+            self.by_inmate[entry['inmate_id']].append(entry['name'])
+        self.names[entry['name']] = entry['sha1']
+
+    def _append_blob(self, data):
+        """Write image data to the end of the last segment."""
+        segment = self._last_segment
+        path = self._path(_segment_filename(segment))
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            size = 0
+        if size and size + len(data) > self.segment_bytes:
+            segment += 1
+            path = self._path(_segment_filename(segment))
+            size = 0
+        with open(path, mode='ab') as f:
+            # Anything left by a write that didn't finish is skipped.
+            offset = f.seek(0, os.SEEK_END)
+            f.write(data)
+        return segment, offset, len(data)
+
+    def _new_name(self, inmate_id):
+        if not self.by_inmate.get(inmate_id):
+            return '{}.jpg'.format(inmate_id)
+        name = '{inmate_id}_{timestamp}.jpg'.format(
+            inmate_id=inmate_id,
+            timestamp=datetime.datetime.now().strftime('%y%m%d%H%M%S'),
+        )
+        count = 1
+        while name in self.names:
+            count += 1
+            name = '{inmate_id}_{timestamp}_{count}.jpg'.format(
+                inmate_id=inmate_id,
+                timestamp=datetime.datetime.now().strftime('%y%m%d%H%M%S'),
+                count=count,
+            )
+        return name
+
+    def add(self, inmate_id, data, sha1=None, name=None, phash=None):
+        """Save a mug shot, unless the inmate already has the same one.
+
+        Args:
+            inmate_id: String of the inmate's ID.
+            data: Bytes-like image data.
+            sha1: Hex SHA1 of `data`, if already known.
+            name: Name to save it under. By default the next name for
+                the inmate, like the mug shot directory would use.
+            phash: Perceptual hash of the image to store with it, see
+                `get_phash`.
+
+        Returns:
+            Tuple of the name of the mug shot, and whether it was added.
+        """
+        if sha1 is None:
+            sha1 = hashlib.sha1(data).hexdigest()
+        with self._lock, self._locked_index() as index:
+            # Another process may have added to the pack.
+            self._refresh()
+            if index.seek(0, os.SEEK_END) > self._index_offset:
+                # Since the lock is held, this is left by a write that
+                #   didn't finish. Otherwise the entry would be appended
+                #   onto it.
+                log.warning('Removing a partial line from the mug index.')
+                index.truncate(self._index_offset)
+            if name is None:
+                for existing in self.by_inmate.get(inmate_id, ()):
+                    if self.names[existing] == sha1:
+                        return existing, False
+                name = self._new_name(inmate_id)
+            elif name in self.names:
+                return name, False
+            location = self.blobs.get(sha1)
+            if location is None:
+                location = self._append_blob(data)
+            entry = {
+                'name': name,
+                'inmate_id': inmate_id,
+                'sha1': sha1,
+                'segment': location[0],
+                'offset': location[1],
+                'length': location[2],
+            }
+            if phash:
+                entry['phash'] = phash
+            # The index is written after the data, so it never points
+            #   at data that wasn't written.
+            line = (serialization.dumps(entry) + '\n').encode('utf-8')
+            index.write(line)
+            index.flush()
+            self._index_offset += len(line)
+            self._remember(entry)
+        return name, True
+
+    def get_phash(self, sha1):
+        """Return the perceptual hash stored with an image, or None."""
+        with self._lock:
+            self._refresh()
+            return self.phashes.get(sha1)
+
+    def items(self):
+        """Return (name, SHA1) of every mug shot, in the order saved."""
+        with self._lock:
+            self._refresh()
+            return list(self.names.items())
+
+    def latest(self, inmate_id):
+        """Name of the inmate's most recently saved mug shot, or None."""
+        with self._lock:
+            self._refresh()
+            names = self.by_inmate.get(inmate_id)
+            return names[-1] if names else None
+
+    def location(self, name):
+        """Return the (segment path, offset, length) of a mug shot."""
+        with self._lock:
+            self._refresh()
+            segment, offset, length = self.blobs[self.names[name]]
+        return self._path(_segment_filename(segment)), offset, length
+
+    def read(self, name):
+        """Return a mug shot as a read-only memoryview of its segment.
+
+        Raises:
+            KeyError if there is no mug shot with that name.
+        """
+        with self._lock:
+            self._refresh()
+            segment, offset, length = self.blobs[self.names[name]]
+            mapped = self._maps.get(segment)
+            if mapped is None or len(mapped) < offset + length:
+                # The segment has grown since it was mapped. The old map
+                #   is closed once nothing refers to it any more.
+                with open(self._path(_segment_filename(segment)),
+                          mode='rb') as f:
+                    mapped = mmap.mmap(
+                        f.fileno(),
+                        0,
+                        access=mmap.ACCESS_READ,
+                    )
+                self._maps[segment] = mapped
+        return memoryview(mapped)[offset:offset + length]
+
+    def close(self):
+        with self._lock:
+            maps, self._maps = self._maps, {}
+        for mapped in maps.values():
+            try:
+                mapped.close()
+            except BufferError:
+                # Still read by someone, so it is closed when released.
+                pass
+
+    def migrate(self, directory, remove=False):
+        """Add every mug shot in a directory to the pack.
+
+        Mug shots keep their filenames as names, and those already in
+        the pack are skipped, so an interrupted migration can be rerun.
+
+        Args:
+            directory: A mug shot directory, such as `path.mug_shot_dir`.
+            remove: Whether to delete each file once it is verified to
+                be in the pack.
+
+        Returns:
+            The number of mug shots added.
+        """
+        added = 0
+        # Sorted so that each inmate's mug shots are added oldest first.
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith('.jpg'):
+                continue
+            if not remove and filename in self:
+                continue
+            path = os.path.join(directory, filename)
+            with open(path, mode='rb') as f:
+                data = f.read()
+            sha1 = hashlib.sha1(data).hexdigest()
+            inmate_id = os.path.splitext(filename)[0].split('_', 1)[0]
+            _, was_added = self.add(inmate_id, data, sha1=sha1, name=filename)
+            added += was_added
+            if remove:
+                if hashlib.sha1(self.read(filename)).hexdigest() != sha1:
+                    raise ValueError(
+                        'Mug shot {} differs in the pack.'.format(filename),
+                    )
+                os.remove(path)
+        return added
+
+
+def get_pack():
+    """The configured pack of the current site, or None if not enabled.
+
+    Packs are shared by everything in the process using the same
+    directory. The first time a pack is used, the mug shots saved in
+    `path.mug_shot_dir` by an older version are added to it.
+    """
+    directory = config.get_path('mug_pack_dir', default=None)
+    if not directory:
+        return None
+    key = os.path.abspath(directory)
+    with _packs_lock:
+        pack = _packs.get(key)
+        if pack is None:
+            pack = MugPack.from_config()
+            _migrate_once(pack)
+            _packs[key] = pack
+        return pack
+
+
+def _migrate_once(pack):
+    """Add the mug shot directory to the pack, unless already done.
+
+    Several nodes may migrate at once, since each skips the mug shots
+    already added, and none carries on until the whole directory is in
+    the pack.
+    """
+    marker = os.path.join(pack.directory, MIGRATED_FILENAME)
+    if os.path.exists(marker):
+        return
+    directory = config.get_path('mug_shot_dir', default=None)
+    if directory and os.path.isdir(directory):
+        added = pack.migrate(directory)
+        log.info('Added %d mug shots from %s to the pack.', added, directory)
+    with open(marker, mode='w'):
+        pass
+
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    subparsers = parser.add_subparsers(dest='command')
+    migrate = subparsers.add_parser(
+        'migrate',
+        help='Add the mug shots in path.mug_shot_dir to the pack.',
+    )
+    migrate.add_argument(
+        '--remove',
+        action='store_true',
+        help='Delete each file once it is in the pack.',
+    )
+    subparsers.add_parser('stats', help='Describe the pack.')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    config.load_config()
+    args = _parse_args(argv)
+    pack = get_pack()
+    if pack is None:
+        raise SystemExit('Set path.mug_pack_dir to use a pack.')
+    if args.command == 'migrate':
+        added = pack.migrate(
+            directory=config.get_path('mug_shot_dir'),
+            remove=args.remove,
+        )
+        print('Added {} mug shots to the pack.'.format(added))
+        return
+    if args.command == 'stats':
+        print('{names} mug shots of {inmates} inmates, {blobs} distinct '
+              'images in {bytes:,d} bytes.'.format(
+                  names=len(pack.names),
+                  inmates=len(pack.by_inmate),
+                  blobs=len(pack.blobs),
+                  bytes=sum(length for _, _, length in pack.blobs.values()),
+              ))
+        return
+    raise SystemExit('Specify a command: migrate or stats.')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+"""Durable queue of pending tweets, posted in the background.
+
+The crawler only enqueues posts, so it never waits on Twitter. Each
+pending post is a JSON file in the outbox directory, with the mug shot
+to upload (if any) stored next to it. Filenames begin with an
+increasing sequence number, so posts go out in the order they were
+enqueued, which for a batch of new inmates is the order of arrest.
+
+A `Poster` thread drains the outbox while respecting a minimum interval
+between posts. Posts that fail are retried with exponential backoff,
+and set aside in a `failed` subdirectory after too many attempts, or
+at once if Twitter rejected them. Meanwhile later posts go out, except
+those about the same inmate, which stay in order. Inmates are recorded
+to the main log once their tweet is posted.
+"""
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+
+import staticconf
+
+from . import config
+from . import images
+from . import serialization
+from . import storage
+from . import twitter
+from . import util
+from .inmate import Inmate
+
+
+log = logging.getLogger(__name__)
+
+_sequence_lock = threading.Lock()
+_last_sequence = 0
+
+# Statuses of Twitter errors that retrying a post won't fix, such as a
+#   duplicate tweet (403) or a rejected image (400).
+_PERMANENT_ERROR_CODES = frozenset([400, 403, 404, 413])
+
+
+def _next_sequence():
+    """Return an increasing number, based on the time in microseconds."""
+    global _last_sequence
+    with _sequence_lock:
+        _last_sequence = max(int(time.time() * 1e6), _last_sequence + 1)
+        return _last_sequence
+
+
+def _get_directory():
+    # Shared by all sites, unlike other paths, so one poster drains it.
+    directory = staticconf.read('path.outbox_dir')
+    os.makedirs(os.path.join(directory, 'failed'), exist_ok=True)
+    return directory
+
+
+def _find_entry_name(directory, key):
+    suffix = '-{key}.json'.format(key=key)
+    for filename in os.listdir(directory):
+        if filename.endswith(suffix):
+            return filename[:-len('.json')]
+    return None
+
+
+def enqueue(key, entry, mug=None):
+    """Durably add a post to the outbox, unless it is already pending.
+
+    Args:
+        key: String that uniquely identifies the post, used so that the
+            same post is not enqueued twice.
+        entry: JSON serializable dict describing the post.
+        mug: Optional byte string of the image to upload.
+
+    Returns:
+        True if the post was added, otherwise False if already pending.
+    """
+    directory = _get_directory()
+    if _find_entry_name(directory, key):
+        log.debug('Post %r is already in the outbox.', key)
+        return False
+    name = '{sequence:020d}-{key}'.format(sequence=_next_sequence(), key=key)
+    entry = dict(entry, key=key, attempts=0, not_before=0)
+    if mug is not None:
+        util.atomic_write(os.path.join(directory, name + '.jpg'), mug)
+    # The JSON file is written last, since its presence marks the post
+    #   as pending.
+    util.atomic_write(
+        os.path.join(directory, name + '.json'),
+        serialization.dumps(entry),
+    )
+    log.debug('Added post %r to the outbox.', key)
+    return True
+
+
+def enqueue_mug_shot(inmate, caption, mug, **tweet_params):
+    """Add a mug shot tweet for an inmate to the outbox.
+
+    Args:
+        inmate: The Inmate the tweet is about. It is recorded to the
+            main log of the current site once posted.
+        caption: String of the tweet text.
+        mug: Byte string of the mug shot image to upload.
+        tweet_params: Extra parameters for `twitter.tweet_mug_shots`.
+    """
+    return enqueue(
+        key='mug-{id}-{sha1}'.format(
+            id=inmate.id,
+            sha1=hashlib.sha1(mug).hexdigest(),
+        ),
+        entry={
+            'kind': 'mug_shot',
+            'caption': caption,
+            'inmate': {
+                'arrest': inmate.arrest,
+                'charges': inmate.charges,
+                'DOB': inmate.DOB,
+                'id': inmate.id,
+                'name': inmate.name,
+                'phash': inmate.phash,
+                'seen': inmate.seen,
+            },
+            'tweet_params': tweet_params,
+            'storage_dir': config.get_site_root(),
+        },
+        mug=mug,
+    )
+
+
+def enqueue_status(key, status):
+    """Add a text-only tweet to the outbox."""
+    return enqueue(key=key, entry={'kind': 'status', 'status': status})
+
+
+def pending_count():
+    """Return the number of posts waiting in the outbox."""
+    return sum(
+        1
+        for filename in os.listdir(_get_directory())
+        if filename.endswith('.json')
+    )
+
+
+def pending_upload_count():
+    """Return the number of mug shots waiting in the outbox to upload."""
+    return sum(
+        1
+        for filename in os.listdir(_get_directory())
+        if filename.endswith('.jpg')
+    )
+
+
+def post_pending(
+        twitter_client, min_interval_s=0, stop_event=None, coordinator=None):
+    """Post everything in the outbox that is ready, in order.
+
+    A post that isn't ready to be retried yet is skipped, along with the
+    later posts about the same inmate, so that those never go out of
+    order. See `_order_group`.
+
+    Args:
+        twitter_client: Client used to post.
+        min_interval_s: Minimum number of seconds between posts.
+        stop_event: Optional `threading.Event` that stops posting early.
+        coordinator: Optional `coordination.Coordinator`. If given, each
+            post is claimed first, and posts that another node has made
+            (or is making) are dropped from this outbox.
+
+    Returns:
+        The number of posts that were successfully made.
+    """
+    directory = _get_directory()
+    names = sorted(
+        filename[:-len('.json')]
+        for filename in os.listdir(directory)
+        if filename.endswith('.json')
+    )
+    posted = 0
+    # Groups with an earlier post that hasn't been made.
+    waiting = set()
+    for name in names:
+        if stop_event is not None and stop_event.is_set():
+            break
+        with open(os.path.join(directory, name + '.json'), mode='rb') as f:
+            entry = serialization.loads(f.read())
+        group = _order_group(entry)
+        if group in waiting:
+            log.debug('Post %r waits for an earlier post.', entry['key'])
+            continue
+        if entry['not_before'] > time.time():
+            log.debug('Post %r is not ready to be retried.', entry['key'])
+            waiting.add(group)
+            continue
+        if coordinator is not None and not coordinator.claim_post(
+                entry['key']):
+            log.info('Post %r was claimed by another node.', entry['key'])
+            _remove_entry(directory, name)
+            continue
+        if not _post_entry(twitter_client, directory, name, entry):
+            if coordinator is not None:
+                coordinator.release_post(entry['key'])
+            waiting.add(group)
+            continue
+        if coordinator is not None:
+            coordinator.finish_post(entry['key'])
+        posted += 1
+        if stop_event is not None:
+            stop_event.wait(min_interval_s)
+        else:
+            time.sleep(min_interval_s)
+    return posted
+
+
+def _order_group(entry):
+    """Posts in the same group are made in the order they were enqueued.
+
+    That is every post about an inmate, whose later tweets reply to the
+    earlier ones. Other posts don't depend on each other.
+    """
+    if entry['kind'] == 'mug_shot':
+        return (entry.get('storage_dir'), entry['inmate']['id'])
+    return entry['key']
+
+
+def _is_permanent(error):
+    """Whether Twitter rejected a post, so that retrying won't help."""
+    return getattr(error, 'error_code', None) in _PERMANENT_ERROR_CODES
+
+
+def _post_entry(twitter_client, directory, name, entry):
+    mug_path = os.path.join(directory, name + '.jpg')
+    inmate = None
+    try:
+        if entry['kind'] == 'mug_shot':
+            inmate = Inmate.from_dict(entry['inmate'])
+            with open(mug_path, mode='rb') as f:
+                inmate.mug = f.read()
+            # Stored when the mug shot was saved, see `storage`.
+            inmate.phash = entry['inmate'].get('phash')
+            # The original is kept on the inmate so that its hash is
+            #   what gets recorded to the log.
+            twitter.tweet_mug_shots(
+                twitter_client=twitter_client,
+                inmate=inmate,
+                caption=entry['caption'],
+                mug_shot_file=io.BytesIO(
+                    images.prepare_for_upload(inmate.mug, sha1=inmate.sha1),
+                ),
+                **entry['tweet_params']
+            )
+        else:
+            log.info('Posting status %r', entry['key'])
+            twitter_client.update_status(status=entry['status'])
+    except Exception as error:
+        _handle_failure(directory, name, entry, error, inmate)
+        return False
+    if inmate is not None:
+        _log_inmate(entry, inmate)
+    _remove_entry(directory, name)
+    return True
+
+
+def _handle_failure(directory, name, entry, error, inmate):
+    entry['attempts'] += 1
+    max_attempts = staticconf.read_int('twitter.max_post_attempts', default=5)
+    if entry['attempts'] >= max_attempts or _is_permanent(error):
+        log.error(
+            'Giving up on post %r after %d attempts: %r',
+            entry['key'],
+            entry['attempts'],
+            error,
+        )
+        if inmate is not None:
+            # Still record the inmate, just without a tweet.
+            _log_inmate(entry, inmate)
+        for filename in (name + '.jpg', name + '.json'):
+            path = os.path.join(directory, filename)
+            if os.path.exists(path):
+                os.replace(path, os.path.join(directory, 'failed', filename))
+        return
+    # Respect the rate limit reset time if Twitter gave us one.
+    try:
+        delay = int(getattr(error, 'retry_after', None))
+    except (TypeError, ValueError):
+        delay = min(60 * 2 ** (entry['attempts'] - 1), 60 * 60)
+    entry['not_before'] = time.time() + delay
+    log.warning(
+        'Will retry post %r in %d seconds after error: %r',
+        entry['key'],
+        delay,
+        error,
+    )
+    util.atomic_write(
+        os.path.join(directory, name + '.json'),
+        serialization.dumps(entry),
+    )
+
+
+def _log_inmate(entry, inmate):
+    with config.site_root(entry.get('storage_dir')):
+        storage.log_inmates([inmate])
+
+
+def _remove_entry(directory, name):
+    # Remove the JSON file first, since it marks the post as pending.
+    os.remove(os.path.join(directory, name + '.json'))
+    try:
+        os.remove(os.path.join(directory, name + '.jpg'))
+    except FileNotFoundError:
+        pass
+
+
+class Poster(threading.Thread):
+
+    """Background thread that keeps draining the outbox.
+
+    Args:
+        poll_interval_s: Seconds to wait before checking the outbox
+            again after it has been drained.
+        coordinator: Optional `coordination.Coordinator` shared with
+            other nodes, so that each post is only made once.
+    """
+
+    def __init__(self, poll_interval_s=10, coordinator=None):
+        super().__init__(name='outbox-poster', daemon=True)
+        self.poll_interval_s = poll_interval_s
+        self.coordinator = coordinator
+        self._stop_event = threading.Event()
+
+    def run(self):
+        log.info('Starting outbox poster.')
+        while not self._stop_event.is_set():
+            try:
+                self.drain()
+            except Exception:
+                log.exception('Uncaught error while posting outbox.')
+            self._stop_event.wait(self.poll_interval_s)
+
+    def drain(self):
+        """Make every post that is ready, unless Twitter is disabled.
+
+        Returns:
+            The number of posts that were successfully made.
+        """
+        twitter_client = twitter.get_twitter_client()
+        if twitter_client is None:
+            return 0
+        return post_pending(
+            twitter_client=twitter_client,
+            min_interval_s=staticconf.read_float(
+                'twitter.min_seconds_between_posts',
+                default=0,
+            ),
+            stop_event=self._stop_event,
+            coordinator=self.coordinator,
+        )
+
+    def stop(self):
+        self._stop_event.set()
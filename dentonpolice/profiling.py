@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""Profiling crawl cycles, for investigating slow ones.
+
+Enabled by setting `profiling.cycles`, or by passing `--profile N` to
+`python -m dentonpolice`. The next N crawl cycles are then profiled,
+and for each one these are written to `profiling.directory`:
+
+    <n>-<site>.prof
+        cProfile statistics of the thread running the cycle, for
+        `python -m pstats` or a viewer such as snakeviz.
+    <n>-<site>.txt
+        The functions that took the most time, including their callees.
+    <n>-<site>.folded
+        If `profiling.sample_interval_s` is set, stacks sampled from
+        every thread, such as the mug shot downloads that cProfile
+        can't see, in the folded format used to draw flame graphs.
+    <n>-<site>-<label>-memory.txt, <n>-<site>-<label>.snapshot
+        If `profiling.memory` is set, tracemalloc snapshots taken at each
+        `checkpoint` the cycle passes, such as while the parsed inmates
+        or the past records are loaded, and at the `end`. The summary
+        lists where the memory held by this package was allocated.
+
+When disabled, cycles run exactly as before; the scheduler is never
+given a profiler.
+"""
+import collections
+import contextlib
+import io
+import logging
+import os
+import sys
+import threading
+
+import staticconf
+
+
+log = logging.getLogger(__name__)
+
+# Functions listed in each summary.
+TOP_FUNCTIONS = 40
+# Allocation sites listed in each memory summary.
+TOP_ALLOCATIONS = 25
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# What `checkpoint` does on the thread of the cycle being profiled.
+_active = threading.local()
+
+
+def checkpoint(label):
+    """Take a memory snapshot, if this cycle is profiling memory.
+
+    Otherwise does nothing, so it is cheap to call from a crawl cycle.
+    """
+    take_snapshot = getattr(_active, 'take_snapshot', None)
+    if take_snapshot is not None:
+        take_snapshot(label)
+
+
+class StackSampler(object):
+
+    """Counts the stacks of every other thread, sampled periodically.
+
+    Args:
+        interval_s: Seconds between samples.
+    """
+
+    def __init__(self, interval_s):
+        self.interval_s = interval_s
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run,
+            name='stack-sampler',
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval_s):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append('{}:{}'.format(
+                        os.path.basename(code.co_filename),
+                        code.co_name,
+                    ))
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def write(self, path):
+        """Write the stacks in the folded format, most common first."""
+        with open(path, mode='w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+
+class CycleProfiler(object):
+
+    """Profiles the next few crawl cycles.
+
+    Only one cycle is profiled at a time. Cycles of other sites that run
+    meanwhile aren't profiled, and don't count.
+
+    Args:
+        directory: Where the profiles are written.
+        cycles: How many cycles to profile.
+        sample_interval_s: Seconds between stack samples, or 0 to not
+            sample.
+        memory: Whether to take a tracemalloc snapshot of each cycle.
+    """
+
+    def __init__(self, directory, cycles, sample_interval_s=0, memory=False):
+        self.directory = directory
+        self.remaining = cycles
+        self.sample_interval_s = sample_interval_s
+        self.memory = memory
+        self.profiled = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, cycles=None):
+        """The configured profiler, or None if profiling is disabled.
+
+        Args:
+            cycles: Number of cycles to profile, overriding
+                `profiling.cycles`.
+        """
+        if cycles is None:
+            cycles = staticconf.read_int('profiling.cycles', default=0)
+        if not cycles:
+            return None
+        return cls(
+            directory=staticconf.read(
+                'profiling.directory',
+                default='profiles',
+            ),
+            cycles=cycles,
+            sample_interval_s=staticconf.read_float(
+                'profiling.sample_interval_s',
+                default=0,
+            ),
+            memory=staticconf.read_bool('profiling.memory', default=False),
+        )
+
+    @contextlib.contextmanager
+    def profile(self, name):
+        """Profile the code run within, if there are cycles left to."""
+        if self.remaining <= 0 or not self._lock.acquire(blocking=False):
+            yield
+            return
+        try:
+            self.remaining -= 1
+            self.profiled += 1
+            prefix = os.path.join(
+                self.directory,
+                '{:04d}-{}'.format(self.profiled, name),
+            )
+            with self._profiling(prefix):
+                yield
+            log.info('Wrote profiles of the cycle to %s.*', prefix)
+            if self.remaining == 0:
+                log.info('Finished profiling %d cycles.', self.profiled)
+        finally:
+            self._lock.release()
+
+    @contextlib.contextmanager
+    def _profiling(self, prefix):
+        import cProfile
+        os.makedirs(self.directory, exist_ok=True)
+        started_tracing = False
+        if self.memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(10)
+                started_tracing = True
+            # The peak is only of this cycle if tracing started with it,
+            #   or can be reset, which needs Python 3.9.
+            cycle_peak = started_tracing
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+                cycle_peak = True
+
+            def take_snapshot(label):
+                path = '{}-{}'.format(prefix, label)
+                snapshot = tracemalloc.take_snapshot()
+                snapshot.dump(path + '.snapshot')
+                _write_memory_summary(
+                    snapshot,
+                    path + '-memory.txt',
+                    with_peak=cycle_peak,
+                )
+            _active.take_snapshot = take_snapshot
+        sampler = None
+        if self.sample_interval_s:
+            sampler = StackSampler(self.sample_interval_s)
+            sampler.start()
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            if sampler is not None:
+                sampler.stop()
+                sampler.write(prefix + '.folded')
+            _write_profile(profiler, prefix)
+            if self.memory:
+                _active.take_snapshot = None
+                take_snapshot('end')
+                if started_tracing:
+                    tracemalloc.stop()
+
+
+def _write_profile(profiler, prefix):
+    import pstats
+    profiler.dump_stats(prefix + '.prof')
+    summary = io.StringIO()
+    stats = pstats.Stats(profiler, stream=summary)
+    stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+    with open(prefix + '.txt', mode='w', encoding='utf-8') as f:
+        f.write(summary.getvalue())
+
+
+def _write_memory_summary(snapshot, path, with_peak=True):
+    import tracemalloc
+    ours = snapshot.filter_traces([
+        tracemalloc.Filter(True, os.path.join(_PACKAGE_DIR, '*')),
+    ])
+    current, peak = tracemalloc.get_traced_memory()
+    if with_peak:
+        traced = 'Traced {:,d} bytes, and at most {:,d} bytes.'.format(
+            current,
+            peak,
+        )
+    else:
+        traced = 'Traced {:,d} bytes.'.format(current)
+    lines = [traced, '']
+    for title, statistics in [
+            ('Held by dentonpolice, by line', ours.statistics('lineno')),
+            ('Held by dentonpolice, by file', ours.statistics('filename')),
+            ('Held in total, by line', snapshot.statistics('lineno')),
+    ]:
+        total = sum(statistic.size for statistic in statistics)
+        lines.append('{} ({:,d} bytes):'.format(title, total))
+        lines.extend(
+            '  {}'.format(statistic)
+            for statistic in statistics[:TOP_ALLOCATIONS]
+        )
+        lines.append('')
+    with open(path, mode='w', encoding='utf-8') as f:
+        f.write('\n'.join(lines))
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""Spreading requests over a pool of proxies, such as several Tor circuits.
+
+Each proxy keeps a moving average of how long its requests take. A
+request goes to the healthy proxy with the lowest expected wait, which
+is its average latency scaled by the requests already in flight through
+it, so concurrent downloads spread over the pool. A proxy whose request
+fails, or takes longer than `proxy.slow_s`, is marked degraded and only
+used again after `proxy.degraded_s`, or when every proxy is degraded.
+
+The proxies must speak HTTP, since urllib has no SOCKS support. For
+Tor, run an HTTP proxy such as Polipo or Privoxy in front of each
+SocksPort, so that each one uses its own circuit.
+"""
+import logging
+import random
+import threading
+import time
+import urllib.request
+
+import staticconf
+
+
+log = logging.getLogger(__name__)
+
+# Weight of the newest sample in the moving average of latency.
+_LATENCY_SMOOTHING = 0.3
+
+# Pools by their configuration, so their measurements are kept.
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class Proxy(object):
+
+    """One proxy in the pool, and how it has been performing.
+
+    Args:
+        address: `host:port` of an HTTP proxy.
+    """
+
+    def __init__(self, address):
+        self.address = address
+        # Unknown until measured, and optimistic so it gets tried.
+        self.latency_s = None
+        self.in_flight = 0
+        self.degraded_until = 0
+        self.opener = urllib.request.build_opener(
+            urllib.request.ProxyHandler({'http': address}),
+        )
+
+    def __repr__(self):
+        return 'Proxy(address={!r}, latency_s={!r})'.format(
+            self.address,
+            self.latency_s,
+        )
+
+    def is_degraded(self, now):
+        return self.degraded_until > now
+
+    def expected_wait(self):
+        return (self.latency_s or 0) * (1 + self.in_flight)
+
+
+class ProxyPool(object):
+
+    """Chooses a proxy for each request. Safe to share between threads.
+
+    Args:
+        addresses: List of `host:port` of the proxies.
+        slow_s: A request taking longer than this degrades its proxy.
+        degraded_s: How long a degraded proxy is avoided.
+        seed: Seed for breaking ties, for reproducibility.
+    """
+
+    def __init__(self, addresses, slow_s=30, degraded_s=300, seed=None):
+        if not addresses:
+            raise ValueError('A proxy pool needs at least one proxy.')
+        self.proxies = [Proxy(address) for address in addresses]
+        self.slow_s = slow_s
+        self.degraded_s = degraded_s
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+
+    def __len__(self):
+        return len(self.proxies)
+
+    def acquire(self):
+        """Choose the proxy for a request, which must then be released."""
+        with self._lock:
+            now = time.monotonic()
+            candidates = [
+                proxy
+                for proxy in self.proxies
+                if not proxy.is_degraded(now)
+            ]
+            if not candidates:
+                # Better to try a degraded proxy than none at all, and
+                #   the one that recovers soonest is the best bet.
+                candidates = [
+                    min(self.proxies, key=lambda proxy: proxy.degraded_until),
+                ]
+            self._random.shuffle(candidates)
+            proxy = min(candidates, key=Proxy.expected_wait)
+            proxy.in_flight += 1
+        return proxy
+
+    def health(self):
+        """Describe how each proxy is doing, as a list of dicts."""
+        with self._lock:
+            now = time.monotonic()
+            return [
+                {
+                    'address': proxy.address,
+                    'latency_s': proxy.latency_s,
+                    'in_flight': proxy.in_flight,
+                    'degraded': proxy.is_degraded(now),
+                    'degraded_for_s': max(0, proxy.degraded_until - now),
+                }
+                for proxy in self.proxies
+            ]
+
+    def release(self, proxy, elapsed_s, ok):
+        """Record how a request through `proxy` went."""
+        with self._lock:
+            proxy.in_flight -= 1
+            if ok and proxy.latency_s is None:
+                proxy.latency_s = elapsed_s
+            elif ok:
+                proxy.latency_s += _LATENCY_SMOOTHING * (
+                    elapsed_s - proxy.latency_s
+                )
+            if ok and elapsed_s <= self.slow_s:
+                return
+            proxy.degraded_until = time.monotonic() + self.degraded_s
+        log.warning(
+            'Proxy %s degraded for %s seconds after a %s request '
+            '(%.1f seconds).',
+            proxy.address,
+            self.degraded_s,
+            'slow' if ok else 'failed',
+            elapsed_s,
+        )
+
+
+def get_pool():
+    """The configured ProxyPool, or None to connect directly.
+
+    Uses the `proxy.pool` list of `host:port` addresses if given,
+    otherwise the single `proxy.host` and `proxy.port`. The same pool
+    is returned for as long as the configuration is unchanged.
+    """
+    addresses = staticconf.read('proxy.pool', default=None)
+    if not addresses:
+        if not staticconf.read('proxy.host', default=None):
+            return None
+        addresses = ['{host}:{port}'.format(
+            host=staticconf.read('proxy.host'),
+            port=staticconf.read('proxy.port'),
+        )]
+    key = (
+        tuple(addresses),
+        staticconf.read_float('proxy.slow_s', default=30),
+        staticconf.read_float('proxy.degraded_s', default=300),
+    )
+    with _pools_lock:
+        if key not in _pools:
+            log.info('Using a pool of %d proxies: %s', len(key[0]), key[0])
+            _pools[key] = ProxyPool(
+                addresses=key[0],
+                slow_s=key[1],
+                degraded_s=key[2],
+            )
+        return _pools[key]
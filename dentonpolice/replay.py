@@ -0,0 +1,478 @@
+# -*- coding: utf-8 -*-
+"""Replaying archived jail reports through the crawler, as fast as it can.
+
+The archived reports (see `archive`) record what the crawler saw, and
+the mug shot pack and inmate log record what it did about it. Replaying
+feeds a site's reports through `crawler.main` in the order they were
+retrieved, in a scratch directory, with stand-ins for the network, S3,
+and Twitter:
+
+    Reports
+        Read from the archive, `path.report_archive_dir` by default.
+    Mug shots
+        Read from the site's mug shot pack. The newest one saved by the
+        time of the report is used, going by the local time in its name.
+        An inmate with none is treated as a failed download. Without a
+        pack, every inmate gets a synthetic mug shot, and the posting
+        decisions can't be expected to match.
+    Twitter
+        The outbox is drained after each cycle, by a client that only
+        records each post, as if made at the time of the report.
+
+The first report only primes the scratch directory, as the crawler
+would have had it: its mug shots are saved, its inmates are the recent
+log, and the records tweeted before it are the inmate log. Then cycles
+per second and the time spent in each stage are printed, and the tweets
+about each inmate are compared with those in the inmate log from the
+replayed span. Any difference is listed and the exit status is 1, so a
+replay works as a regression test for how inmates are chosen and stored:
+
+    python -m dentonpolice.replay [--site NAME] [--since YYYYMMDDHHMMSS]
+        [--limit N] [--archive DIR | --s3] [--keep DIR]
+"""
+import argparse
+import calendar
+import collections
+import itertools
+import logging
+import os
+import shutil
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+
+import staticconf
+
+from . import archive
+from . import config
+from . import crawler
+from . import fakejail
+from . import jail
+from . import mugpack
+from . import outbox
+from . import s3
+from . import serialization
+from . import sites
+from . import status
+from . import storage
+from . import timestamps
+from . import twitter
+
+
+log = logging.getLogger(__name__)
+
+REPLAY_URL = 'http://replay.invalid/'
+# Recorded tweets up to this long after the last report still count as
+#   decided by it, since posts wait in the outbox.
+POST_DELAY_S = 15 * 60
+
+
+def _report_time(key):
+    """Seconds since the epoch that an archived report was retrieved."""
+    return calendar.timegm(time.strptime(
+        key.rsplit('/', 1)[-1][:14],
+        '%Y%m%d%H%M%S',
+    ))
+
+
+def _mug_time(name):
+    """Seconds since the epoch that a mug shot was saved.
+
+    Only later mug shots have the local time in their name, so an
+    inmate's first counts as saved before anything else.
+    """
+    parts = os.path.splitext(name)[0].split('_')
+    if len(parts) < 2:
+        return float('-inf')
+    return time.mktime(time.strptime(parts[1], '%y%m%d%H%M%S'))
+
+
+def _tweet_time(record):
+    return calendar.timegm(
+        timestamps.parse_tweet_time(record['tweet']['created_at']).timetuple(),
+    )
+
+
+def list_reports(source, site_name, since=None, limit=None):
+    """Return the keys of a site's archived reports, oldest first.
+
+    Args:
+        source: The `archive.LocalArchive` or `archive.S3Archive`.
+        site_name: Name of the site the reports are from.
+        since: Skip reports retrieved before this 'YYYYMMDDHHMMSS', or
+            any prefix of it.
+        limit: Most reports to return.
+    """
+    prefix = '{}{}/'.format(archive.REPORT_PREFIX, site_name)
+    keys = [key for key in source.keys(prefix) if key.endswith('.html')]
+    if since:
+        keys = [key for key in keys if key.rsplit('/', 1)[-1] >= since]
+    return keys[:limit]
+
+
+class ReplaySite(sites.DentonSite):
+
+    """Serves the archived report being replayed, and its mug shots.
+
+    Args:
+        name: Name of the site the reports are from.
+        storage_dir: Scratch directory for the replay's files.
+        mugs: `mugpack.MugPack` of the mug shots saved at the time, or
+            None to make up a mug shot for each inmate.
+        tweet_params: Those of the site the reports are from.
+    """
+
+    def __init__(self, name, storage_dir, mugs=None, tweet_params=None):
+        super().__init__(
+            name=name,
+            url=REPLAY_URL,
+            storage_dir=storage_dir,
+            min_seconds_between_checks=0,
+            tweet_params=tweet_params,
+        )
+        self.mugs = mugs
+        # The report being replayed, and when it was retrieved.
+        self.html = None
+        self.time = None
+
+    def fetch(self, url, seconds):
+        if url == self.url:
+            return self.html
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+        inmate_id = query['imageID'][0]
+        if self.mugs is None:
+            return fakejail.make_synthetic_mug(inmate_id)
+        name = None
+        for saved in self.mugs.by_inmate.get(inmate_id, ()):
+            if _mug_time(saved) <= self.time:
+                name = saved
+        if name is None:
+            raise urllib.error.HTTPError(
+                url, 404, 'No mug shot was saved by then.', {}, None,
+            )
+        return bytes(self.mugs.read(name))
+
+
+class RecordingTwitter(object):
+
+    """Stands in for the Twitter client, only recording each post."""
+
+    def __init__(self):
+        # When the posts are made, in seconds since the epoch.
+        self.time = None
+        self.posts = []
+        self._ids = itertools.count(1)
+
+    def _post(self, status):
+        tweet = {
+            'id_str': str(next(self._ids)),
+            'created_at': time.strftime(
+                timestamps.TWEET_FORMAT,
+                time.gmtime(self.time),
+            ),
+            'text': status,
+        }
+        self.posts.append(tweet)
+        return tweet
+
+    def update_status(self, status):
+        return self._post(status)
+
+    def update_status_with_media(self, status, media, **tweet_params):
+        return self._post(status)
+
+
+class ReplayResult(object):
+
+    """What a replay did, and how quickly.
+
+    Attributes:
+        cycles: Number of crawl cycles replayed.
+        elapsed_s: Seconds they took, including posting.
+        stage_totals_s: Dict of each stage to the seconds spent in it.
+        posted: Counter of the tweets made about each inmate ID.
+        recorded: Counter of the tweets in the inmate log about each
+            inmate ID in the same span, or None if it wasn't checked.
+    """
+
+    def __init__(self):
+        self.cycles = 0
+        self.elapsed_s = 0
+        self.stage_totals_s = collections.Counter()
+        self.posted = collections.Counter()
+        self.recorded = None
+
+    @property
+    def cycles_per_s(self):
+        return self.cycles / self.elapsed_s if self.elapsed_s else 0
+
+    def differences(self):
+        """Return the inmates tweeted about more or less than recorded.
+
+        Returns:
+            Dict of each inmate ID to the number of tweets replayed, and
+            the number recorded.
+        """
+        if self.recorded is None:
+            return {}
+        return {
+            inmate_id: (self.posted[inmate_id], self.recorded[inmate_id])
+            for inmate_id in sorted(set(self.posted) | set(self.recorded))
+            if self.posted[inmate_id] != self.recorded[inmate_id]
+        }
+
+    def summary(self):
+        lines = [
+            'Replayed {} cycles in {:.2f} s, {:.2f} cycles/s.'.format(
+                self.cycles,
+                self.elapsed_s,
+                self.cycles_per_s,
+            ),
+        ]
+        for stage, seconds in self.stage_totals_s.items():
+            lines.append('  {:<16} {:8.2f} ms/cycle {:6.1%}'.format(
+                stage,
+                1000 * seconds / max(self.cycles, 1),
+                seconds / self.elapsed_s if self.elapsed_s else 0,
+            ))
+        lines.append('Tweeted {} times about {} inmates.'.format(
+            sum(self.posted.values()),
+            len(self.posted),
+        ))
+        if self.recorded is None:
+            return '\n'.join(lines)
+        differences = self.differences()
+        lines.append(
+            'The inmate log has {} tweets about {} inmates, and {} '
+            'inmates differ.'.format(
+                sum(self.recorded.values()),
+                len(self.recorded),
+                len(differences),
+            ),
+        )
+        for inmate_id, (posted, recorded) in differences.items():
+            lines.append('  {}: replayed {}, recorded {}'.format(
+                inmate_id,
+                posted,
+                recorded,
+            ))
+        return '\n'.join(lines)
+
+
+def _read_records(location):
+    records = []
+    try:
+        with open(location, mode='rb') as f:
+            for line in f:
+                records.append(serialization.loads(line))
+    except FileNotFoundError:
+        pass
+    return records
+
+
+def _prime(site, html, recorded):
+    """Leave the replay's files as they were before the first cycle.
+
+    Returns:
+        The number of records written to the inmate log.
+    """
+    site.html = html
+    with config.site_root(site.storage_dir):
+        inmates = site.parse_inmates(html.decode('utf-8'))
+        jail.get_mug_shots(inmates=inmates, bucket=None, site=site)
+        storage.save_mug_shots(inmates)
+        storage.log_inmates(inmates, recent=True)
+        storage.log_most_inmates_count(len(inmates))
+        past = [
+            record
+            for record in recorded
+            if record.get('tweet') and _tweet_time(record) < site.time
+        ]
+        with open(config.get_path('inmate_log'), mode='w',
+                  encoding='utf-8') as f:
+            f.writelines(serialization.dumps(record) + '\n' for record in past)
+    return len(past)
+
+
+def run(source, keys, site, recorded=None):
+    """Replay archived reports through the crawler.
+
+    The configuration must already keep every file in a scratch
+    directory, see `main`.
+
+    Args:
+        source: The `archive.LocalArchive` or `archive.S3Archive` of the
+            reports.
+        keys: Keys of the reports, oldest first. The first only primes
+            the replay.
+        site: The `ReplaySite`.
+        recorded: Records of the inmate log to compare the tweets with,
+            or None to not compare.
+
+    Returns:
+        A `ReplayResult`.
+    """
+    result = ReplayResult()
+    if not keys:
+        return result
+    status.reset()
+    twitter_client = RecordingTwitter()
+    twitter.override_twitter_client(twitter_client)
+    try:
+        site.time = _report_time(keys[0])
+        seeded = _prime(site, source.get(keys[0]), recorded or [])
+        post_s = 0
+        for key in keys[1:]:
+            site.html = source.get(key)
+            site.time = twitter_client.time = _report_time(key)
+            start = time.perf_counter()
+            crawler.main(bucket=None, site=site)
+            posting = time.perf_counter()
+            outbox.post_pending(twitter_client=twitter_client)
+            end = time.perf_counter()
+            post_s += end - posting
+            result.elapsed_s += end - start
+            result.cycles += 1
+    finally:
+        twitter.override_twitter_client(None)
+    for state in status.snapshot()['sites']:
+        if state['name'] == site.name:
+            result.stage_totals_s.update(state['stage_totals_s'])
+    result.stage_totals_s['post'] = post_s
+    with config.site_root(site.storage_dir):
+        replayed = _read_records(config.get_path('inmate_log'))[seeded:]
+    result.posted.update(
+        record['id'] for record in replayed if record.get('tweet')
+    )
+    if recorded is not None:
+        first = _report_time(keys[1]) if len(keys) > 1 else site.time
+        last = site.time + POST_DELAY_S
+        result.recorded = collections.Counter(
+            record['id']
+            for record in recorded
+            if record.get('tweet') and first <= _tweet_time(record) <= last
+        )
+    return result
+
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--site',
+        help='Name of the site to replay. Defaults to the first site.',
+    )
+    parser.add_argument(
+        '--since',
+        metavar='YYYYMMDDHHMMSS',
+        help='Start with the first report retrieved at or after this.',
+    )
+    parser.add_argument('--limit', type=int, help='Most reports to replay.')
+    parser.add_argument(
+        '--archive',
+        metavar='DIR',
+        help='Read reports from here instead of path.report_archive_dir.',
+    )
+    parser.add_argument(
+        '--s3',
+        action='store_true',
+        help='Read reports from the S3 bucket.',
+    )
+    parser.add_argument(
+        '--keep',
+        metavar='DIR',
+        help='Replay in this directory and keep it, rather than a '
+        'temporary one.',
+    )
+    parser.add_argument(
+        '--verbose',
+        action='store_true',
+        help='Log everything the crawler does, which is much slower.',
+    )
+    return parser.parse_args(argv)
+
+
+def _configure(directory):
+    """Keep every file in `directory`, and never wait."""
+    namespace = staticconf.config.get_namespace(staticconf.config.DEFAULT)
+    # Every path, since an absolute one would otherwise be used as is,
+    #   overwriting the files of the crawler being replayed.
+    paths = {
+        key[len('path.'):]: os.path.join(directory, key[len('path.'):])
+        for key, value in namespace.get_config_values().items()
+        if key.startswith('path.') and value is not None
+    }
+    paths['report_archive_dir'] = None
+    staticconf.DictConfiguration({
+        'minimum_report_age_s': 0,
+        'path': paths,
+        # The stand-ins answer at once, so threads would only get in
+        #   the way.
+        'jail': {'mug_shot_downloads': 1},
+        'proxy': {'host': None, 'pool': None},
+    })
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARN)
+    config.load_config()
+    site_list = sites.load_sites()
+    if args.site:
+        site_list = [site for site in site_list if site.name == args.site]
+        if not site_list:
+            raise SystemExit('No site is named {!r}.'.format(args.site))
+    recorded_site = site_list[0]
+    with config.site_root(recorded_site.storage_dir):
+        if args.s3:
+            bucket = s3.get_bucket()
+            if bucket is None:
+                raise SystemExit('Configure aws.s3 to replay from S3.')
+            source = archive.S3Archive(bucket)
+        elif args.archive:
+            source = archive.LocalArchive(args.archive)
+        else:
+            source = archive.get_report_archive()
+            if source is None:
+                raise SystemExit('Set path.report_archive_dir, or pass '
+                                 '--archive or --s3.')
+        pack_dir = config.get_path('mug_pack_dir', default=None)
+        mugs = None
+        if pack_dir and os.path.exists(
+                os.path.join(pack_dir, mugpack.INDEX_FILENAME)):
+            mugs = mugpack.MugPack(pack_dir)
+        else:
+            log.warning('No mug shot pack, so using synthetic mug shots.')
+        # Nothing to compare with if there is no inmate log.
+        recorded = _read_records(config.get_path('inmate_log')) or None
+    keys = list_reports(
+        source,
+        site_name=recorded_site.name,
+        since=args.since,
+        limit=args.limit,
+    )
+    directory = args.keep or tempfile.mkdtemp(prefix='dentonpolice-replay-')
+    _configure(directory)
+    site = ReplaySite(
+        name=recorded_site.name,
+        storage_dir=directory,
+        mugs=mugs,
+        tweet_params=recorded_site.tweet_params,
+    )
+    print('Replaying {} reports of {} in {}.'.format(
+        len(keys),
+        site.name,
+        directory,
+    ))
+    try:
+        result = run(source, keys, site, recorded=recorded)
+    finally:
+        if not args.keep:
+            shutil.rmtree(directory, ignore_errors=True)
+    print(result.summary())
+    if result.differences():
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""Retrying failed requests to a jail roster, without hammering it.
+
+Each request is retried a few times with jittered exponential backoff.
+A circuit breaker counts consecutive failures per site, and once too
+many have failed it opens, so that further requests fail immediately
+until `retry.circuit_reset_s` has passed. Then a single trial request
+is let through, which closes the circuit again if it succeeds. This
+keeps a site that is down, or a dead Tor circuit, from being sent a
+request for every mug shot on the report.
+"""
+import http.client
+import logging
+import random
+import socket
+import threading
+import time
+import urllib.error
+
+import staticconf
+
+
+log = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+
+    """Raised instead of making a request while the circuit is open."""
+
+
+def is_retryable(error):
+    """Whether a failed request might succeed if tried again.
+
+    Server errors, rate limiting, connection problems, and timeouts are
+    retried. Other client errors, such as a 404, are not.
+    """
+    if isinstance(error, urllib.error.HTTPError):
+        return error.code >= 500 or error.code == 429
+    return isinstance(error, (
+        urllib.error.URLError,
+        http.client.HTTPException,
+        ConnectionError,
+        TimeoutError,
+        socket.timeout,
+    ))
+
+
+class Backoff(object):
+
+    """Exponential backoff with full jitter.
+
+    The delay before retry `attempt` (starting at 1) is uniformly random
+    between zero and `base_s * 2 ** (attempt - 1)`, capped at `max_s`.
+    The randomness keeps concurrent crawlers from retrying in lockstep.
+    """
+
+    def __init__(self, base_s=1, max_s=30, seed=None):
+        self.base_s = base_s
+        self.max_s = max_s
+        self._random = random.Random(seed)
+
+    def delay(self, attempt):
+        ceiling = min(self.max_s, self.base_s * 2 ** (attempt - 1))
+        return self._random.uniform(0, ceiling)
+
+
+class CircuitBreaker(object):
+
+    """Stops requests after too many consecutive failures.
+
+    Safe to share between threads.
+
+    Args:
+        failure_threshold: Consecutive failures that open the circuit.
+        reset_s: How long the circuit stays open before a trial request.
+    """
+
+    def __init__(self, failure_threshold=5, reset_s=300):
+        self.failure_threshold = failure_threshold
+        self.reset_s = reset_s
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    @property
+    def is_open(self):
+        with self._lock:
+            return self._opened_at is not None
+
+    def allow(self):
+        """Return whether a request may be made now."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial_running:
+                return False
+            if time.monotonic() - self._opened_at < self.reset_s:
+                return False
+            # Half open: let one request through to test the waters.
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                log.info('Circuit closed after a successful request.')
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if (
+                self._opened_at is not None or
+                self._failures >= self.failure_threshold
+            ):
+                if self._opened_at is None:
+                    log.warning(
+                        'Circuit opened after %d consecutive failures. '
+                        'Not trying again for %s seconds.',
+                        self._failures,
+                        self.reset_s,
+                    )
+                self._opened_at = time.monotonic()
+
+
+def make_circuit_breaker():
+    """A CircuitBreaker using the `retry` configuration."""
+    return CircuitBreaker(
+        failure_threshold=staticconf.read_int(
+            'retry.circuit_failure_threshold',
+            default=5,
+        ),
+        reset_s=staticconf.read_float('retry.circuit_reset_s', default=300),
+    )
+
+
+def call(func, breaker=None, attempts=None, backoff=None, sleep=time.sleep):
+    """Call `func` until it succeeds, retrying errors that may be temporary.
+
+    Args:
+        func: Function of no arguments making the request.
+        breaker: Optional CircuitBreaker, consulted before each attempt
+            and told the outcome.
+        attempts: Most times to call `func`. Defaults to `retry.attempts`.
+        backoff: Backoff between attempts. Defaults to one configured by
+            `retry.backoff_base_s` and `retry.backoff_max_s`.
+        sleep: Function used to wait between attempts.
+
+    Returns:
+        The return value of `func`.
+
+    Raises:
+        CircuitOpenError if the breaker doesn't allow a request, or the
+        error of the last attempt.
+    """
+    if attempts is None:
+        attempts = staticconf.read_int('retry.attempts', default=3)
+    if backoff is None:
+        backoff = Backoff(
+            base_s=staticconf.read_float('retry.backoff_base_s', default=1),
+            max_s=staticconf.read_float('retry.backoff_max_s', default=30),
+        )
+    attempt = 1
+    while True:
+        if breaker is not None and not breaker.allow():
+            raise CircuitOpenError('Circuit is open; not making request.')
+        try:
+            result = func()
+        except Exception as error:
+            retryable = is_retryable(error)
+            if breaker is not None:
+                if retryable:
+                    breaker.record_failure()
+                else:
+                    # Such as a 404, so the site itself is responding.
+                    breaker.record_success()
+            if not retryable or attempt >= attempts:
+                raise
+            delay = backoff.delay(attempt)
+            log.info(
+                'Attempt %d of %d failed, retrying in %.1f seconds: %r',
+                attempt,
+                attempts,
+                delay,
+                error,
+            )
+            sleep(delay)
+            attempt += 1
+            continue
+        if breaker is not None:
+            breaker.record_success()
+        return result
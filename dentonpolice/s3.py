@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""The S3 bucket that reports and mug shots are archived to.
+
+Connecting to S3 (and even importing boto) is deferred until the bucket
+is first used, so that starting up stays fast.
+"""
+import logging
+import threading
+
+import staticconf
+
+
+log = logging.getLogger(__name__)
+
+
+class LazyBucket(object):
+
+    """Stands in for a boto S3 bucket, connecting on first use.
+
+    Any attribute of the real bucket can be used, and the first one
+    connects to S3. Safe to share between threads.
+
+    Args:
+        region: AWS region of the bucket.
+        bucket_name: Name of the bucket.
+    """
+
+    def __init__(self, region, bucket_name):
+        self.region = region
+        self.bucket_name = bucket_name
+        self._bucket = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return 'LazyBucket(region={!r}, bucket_name={!r})'.format(
+            self.region,
+            self.bucket_name,
+        )
+
+    def get_bucket(self):
+        """Return the real boto bucket, connecting if needed."""
+        with self._lock:
+            if self._bucket is None:
+                import boto.s3
+                connection = boto.s3.connect_to_region(
+                    region_name=self.region,
+                )
+                self._bucket = connection.get_bucket(
+                    bucket_name=self.bucket_name,
+                )
+                log.info('AWS configured to use bucket %r', self._bucket)
+            return self._bucket
+
+    def __getattr__(self, name):
+        # Only called for attributes not found the usual way.
+        return getattr(self.get_bucket(), name)
+
+
+def get_bucket():
+    """The configured bucket as a LazyBucket, or None if not configured."""
+    if not staticconf.read('aws.s3.bucket', default=None):
+        return None
+    return LazyBucket(
+        region=staticconf.read('aws.s3.region'),
+        bucket_name=staticconf.read('aws.s3.bucket'),
+    )
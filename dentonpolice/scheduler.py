@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""Crawling several jail rosters concurrently from one process."""
+import concurrent.futures
+import functools
+import logging
+import threading
+import time
+
+from . import crawler
+
+
+log = logging.getLogger(__name__)
+
+
+class Scheduler(object):
+
+    """Checks each site on its own schedule, using a pool of threads.
+
+    A site is checked again `min_seconds_between_checks` after its last
+    check finished. An error while checking one site is logged, and
+    doesn't affect the others.
+
+    Args:
+        sites: List of `sites.Site` to crawl.
+        bucket: S3 bucket passed to `crawler.main`, or None.
+        max_workers: Most sites checked at once. Defaults to all of them.
+        coordinator: Optional `coordination.Coordinator`. If given, a
+            site is only checked if its lease can be acquired, which
+            spreads the sites over every node sharing the coordinator.
+            The lease is renewed as each stage of the check finishes.
+        poll_interval_s: With a coordinator, how long to wait before
+            trying again to lease a site held by another node.
+        profiler: Optional `profiling.CycleProfiler` to profile checks.
+    """
+
+    def __init__(
+            self, sites, bucket, max_workers=None, coordinator=None,
+            poll_interval_s=30, profiler=None):
+        self.sites = sites
+        self.bucket = bucket
+        self.coordinator = coordinator
+        self.profiler = profiler
+        self.poll_interval_s = poll_interval_s
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers or len(sites),
+        )
+        self._lock = threading.Lock()
+        self._next_check = {site.name: 0 for site in sites}
+        self._running = {}
+        self._wake = threading.Event()
+
+    def run_pending(self, now=None):
+        """Start checking every site that is due and not already running.
+
+        Returns:
+            List of futures for the checks that were started.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            due = [
+                site
+                for site in self.sites
+                if site.name not in self._running and
+                self._next_check[site.name] <= now
+            ]
+            # Marked as running until their leases are settled, so that
+            #   nothing else starts them meanwhile.
+            for site in due:
+                self._running[site.name] = None
+        started = []
+        for site in due:
+            # Acquiring a lease can wait on the database, so it is done
+            #   without holding the lock.
+            if not self._acquire(site):
+                with self._lock:
+                    del self._running[site.name]
+                    self._next_check[site.name] = now + self.poll_interval_s
+                continue
+            with self._lock:
+                # Submitted under the lock, so that the check can't
+                #   finish before it is recorded as running.
+                future = self._executor.submit(self._check, site)
+                self._running[site.name] = future
+            started.append(future)
+        return started
+
+    def _acquire(self, site):
+        if self.coordinator is None:
+            return True
+        try:
+            return self.coordinator.acquire_site(site.name)
+        except Exception:
+            log.exception('Unable to lease site %r.', site.name)
+            return False
+
+    def run_once(self):
+        """Check every site once, concurrently, and wait for them all."""
+        with self._lock:
+            self._next_check = {site.name: 0 for site in self.sites}
+        concurrent.futures.wait(self.run_pending())
+
+    def run_forever(self, stop_event=None):
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            self.run_pending()
+            with self._lock:
+                waiting = [
+                    due
+                    for name, due in self._next_check.items()
+                    if name not in self._running
+                ]
+            timeout = None
+            if waiting:
+                timeout = max(0, min(waiting) - time.monotonic())
+            # Woken early when a check finishes, so it can be rescheduled.
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def _check(self, site):
+        log.info('Checking site %r.', site.name)
+        renew_lease = None
+        if self.coordinator is not None:
+            renew_lease = functools.partial(
+                self.coordinator.renew_site,
+                site.name,
+            )
+        try:
+            if self.profiler is None:
+                crawler.main(
+                    bucket=self.bucket,
+                    site=site,
+                    renew_lease=renew_lease,
+                )
+            else:
+                with self.profiler.profile(site.name):
+                    crawler.main(
+                        bucket=self.bucket,
+                        site=site,
+                        renew_lease=renew_lease,
+                    )
+        except Exception:
+            log.exception('Uncaught error while checking site %r.', site.name)
+        finally:
+            if self.coordinator is not None:
+                try:
+                    self.coordinator.release_site(
+                        site.name,
+                        next_check_in_s=site.min_seconds_between_checks,
+                    )
+                except Exception:
+                    # The lease expires by itself, so carry on.
+                    log.exception(
+                        'Unable to release the lease of site %r.',
+                        site.name,
+                    )
+            with self._lock:
+                del self._running[site.name]
+                self._next_check[site.name] = (
+                    time.monotonic() + site.min_seconds_between_checks
+                )
+            log.info(
+                'Checking site %r again in %s seconds.',
+                site.name,
+                site.min_seconds_between_checks,
+            )
+            self._wake.set()
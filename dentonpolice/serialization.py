@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""JSON encoding and decoding of inmate records.
+
+Uses `orjson` when it is installed, which is several times faster than
+the standard library, and otherwise falls back to `json`. Install the
+`speedups` extra to get the faster library.
+
+Loading the whole history would otherwise give every record its own
+copy of strings that repeat constantly, such as names, arrest times,
+and charges. An `Interner` makes equal values share one object.
+"""
+import json
+import logging
+import sys
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+log = logging.getLogger(__name__)
+
+# Fields needed when looking up past records of an inmate.
+PAST_RECORD_FIELDS = ('name', 'arrest', 'sha1', 'phash', 'tweet')
+# Fields of the tweet needed when looking up past records. The rest of a
+#   tweet, such as the user who posted it, is most of a record's size.
+PAST_TWEET_FIELDS = ('id_str', 'created_at')
+
+# Fields of a record whose values often repeat in other records.
+_REPEATED_FIELDS = ('name', 'DOB', 'arrest')
+
+if orjson is not None:
+    BACKEND = 'orjson'
+
+    def loads(data):
+        """Decode a JSON document from a string or byte string."""
+        return orjson.loads(data)
+
+    def dumps(obj):
+        """Encode an object as a JSON string."""
+        return orjson.dumps(obj).decode('utf-8')
+else:
+    BACKEND = 'json'
+
+    def loads(data):
+        """Decode a JSON document from a string or byte string."""
+        if not isinstance(data, str):
+            # Before Python 3.6, `json` only accepts strings.
+            data = bytes(data).decode('utf-8')
+        return json.loads(data)
+
+    def dumps(obj):
+        """Encode an object as a JSON string."""
+        return json.dumps(obj)
+
+
+class Interner(object):
+
+    """Makes equal values of repeated fields share one object.
+
+    Strings are shared by value, and so are whole charges, since the
+    same few charge, type, and amount combinations make up most of them.
+    Records that have been through an Interner must be treated as read
+    only, since changing a shared charge would change it everywhere.
+    """
+
+    def __init__(self):
+        self._strings = {}
+        self._charges = {}
+
+    def __len__(self):
+        return len(self._strings) + len(self._charges)
+
+    def string(self, value):
+        """Return the shared copy of a string (or None)."""
+        if value is None:
+            return None
+        return self._strings.setdefault(value, value)
+
+    def charge(self, charge):
+        """Return the shared copy of an equal charge dict."""
+        key = tuple(sorted(charge.items()))
+        try:
+            return self._charges[key]
+        except KeyError:
+            pass
+        shared = {
+            sys.intern(name): self.string(value)
+            for name, value in key
+        }
+        self._charges[key] = shared
+        return shared
+
+    def record(self, data):
+        """Share the repeated values of a decoded record, in place."""
+        for key in _REPEATED_FIELDS:
+            if key in data:
+                data[key] = self.string(data[key])
+        charges = data.get('charges')
+        if charges:
+            data['charges'] = [self.charge(charge) for charge in charges]
+        tweet = data.get('tweet')
+        if tweet:
+            # Much of a tweet, like its user and source, is the same in
+            #   every tweet.
+            data['tweet'] = self.nested(tweet)
+        return data
+
+    def nested(self, value):
+        """Share the strings anywhere within decoded JSON."""
+        if isinstance(value, str):
+            return self.string(value)
+        if isinstance(value, dict):
+            return {
+                self.string(key): self.nested(item)
+                for key, item in value.items()
+            }
+        if isinstance(value, list):
+            return [self.nested(item) for item in value]
+        return value
+
+
+def make_reader(fields=None, interner=None, tweet_fields=None):
+    """Return a function that decodes one log line into a dict.
+
+    Args:
+        fields: Optional collection of the keys the caller needs. Only
+            those keys are kept, which keeps large histories small in
+            memory. Keys missing from a record are left out rather than
+            set to None. By default all keys are kept.
+        interner: Optional `Interner` used to share repeated values
+            between the records read.
+        tweet_fields: Optional collection of the keys of the `tweet`
+            that the caller needs, like `fields` for the record.
+    """
+    if fields is None and interner is None and tweet_fields is None:
+        return loads
+    if fields is not None:
+        fields = tuple(fields)
+    if tweet_fields is not None:
+        tweet_fields = tuple(tweet_fields)
+
+    def read(line):
+        data = loads(line)
+        if fields is not None:
+            data = {key: data[key] for key in fields if key in data}
+        if tweet_fields is not None and data.get('tweet'):
+            data['tweet'] = {
+                key: data['tweet'][key]
+                for key in tweet_fields
+                if key in data['tweet']
+            }
+        if interner is not None:
+            interner.record(data)
+        return data
+    return read
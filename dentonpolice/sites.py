@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""Adapters for the jail rosters that can be crawled.
+
+Each site knows where its report is, where to find a mug shot, and how
+to parse its report into inmates. Sites are configured under the
+`sites` key, and otherwise only the Denton report at `jail.url` is
+crawled. To support a new roster, subclass `Site` and register it in
+`ADAPTERS`.
+"""
+import logging
+import threading
+import time
+
+import staticconf
+
+from . import jail
+from . import retry
+
+
+log = logging.getLogger(__name__)
+
+# How often to check each jail report, unless configured otherwise.
+SECONDS_BETWEEN_CHECKS = 60 * 5
+
+
+class RateLimiter(object):
+
+    """Spaces out calls to `wait` by at least `min_interval_s` seconds.
+
+    Safe to share between threads.
+    """
+
+    def __init__(self, min_interval_s):
+        self.min_interval_s = min_interval_s
+        self._lock = threading.Lock()
+        self._next_time = 0
+
+    def wait(self):
+        if not self.min_interval_s:
+            return
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.min_interval_s
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Site(object):
+
+    """A jail roster and how to crawl it.
+
+    Args:
+        name: Unique name of the site, also used as the provenance of
+            reports archived to S3 e.g., 'dentonpolice'.
+        url: URL of the jail report.
+        storage_dir: Directory that the configured `path.*` files of
+            this site are relative to. Empty to use them as is.
+        min_seconds_between_checks: How long to wait after checking the
+            report before checking it again.
+        min_seconds_between_requests: Minimum time between requests to
+            the site, including for each mug shot.
+        tweet_params: Extra parameters for each tweet, such as the
+            `place_id`, `lat`, and `long` of the jail.
+    """
+
+    def __init__(
+            self, name, url, storage_dir='',
+            min_seconds_between_checks=SECONDS_BETWEEN_CHECKS,
+            min_seconds_between_requests=0, tweet_params=None):
+        self.name = name
+        self.url = url
+        self.storage_dir = storage_dir
+        self.min_seconds_between_checks = min_seconds_between_checks
+        self.tweet_params = tweet_params or {}
+        self._rate_limiter = RateLimiter(min_seconds_between_requests)
+        # Shared by every request to the site, so that after repeated
+        #   failures it is left alone for a while.
+        self.breaker = retry.make_circuit_breaker()
+
+    def __repr__(self):
+        return '{class_name}(name={name!r}, url={url!r})'.format(
+            class_name=self.__class__.__name__,
+            name=self.name,
+            url=self.url,
+        )
+
+    def wait_for_request(self):
+        """Block until another request to the site is allowed."""
+        self._rate_limiter.wait()
+
+    def fetch(self, url, seconds):
+        """Return the bytes at a URL of the site.
+
+        Waits for the rate limit and retries temporary failures, as
+        `jail.fetch` does. Overridden to crawl something other than the
+        live site, such as archived reports in `replay`.
+        """
+        return jail.fetch(url=url, seconds=seconds, site=self)
+
+    def get_report_url(self):
+        return self.url
+
+    def get_mug_shot_url(self, inmate_id):
+        raise NotImplementedError
+
+    def parse_inmates(self, html):
+        """Return the list of Inmates listed in the report HTML."""
+        raise NotImplementedError
+
+
+class DentonSite(Site):
+
+    """City Jail Custody Report for Denton, TX."""
+
+    def get_mug_shot_url(self, inmate_id):
+        return jail.make_mug_shot_url(base_url=self.url, inmate_id=inmate_id)
+
+    def parse_inmates(self, html):
+        return jail.parse_inmates(html)
+
+
+ADAPTERS = {
+    'denton': DentonSite,
+}
+
+
+def get_default_site():
+    """The Denton site, as configured by `jail.url`."""
+    return DentonSite(name='dentonpolice', url=jail.get_report_url())
+
+
+def load_sites():
+    """Return the configured sites, or only the default site if none.
+
+    Each item of the `sites` list is a dict with the `adapter` name from
+    `ADAPTERS`, and the keyword arguments for that adapter's class.
+    """
+    configured = staticconf.read('sites', default=None)
+    if not configured:
+        return [get_default_site()]
+    loaded = []
+    for options in configured:
+        options = dict(options)
+        adapter = options.pop('adapter')
+        try:
+            site_class = ADAPTERS[adapter]
+        except KeyError:
+            raise ValueError('Unknown site adapter: {!r}'.format(adapter))
+        loaded.append(site_class(**options))
+    names = [site.name for site in loaded]
+    if len(set(names)) != len(names):
+        raise ValueError('Site names must be unique: {!r}'.format(names))
+    log.info('Loaded %d sites: %r', len(loaded), loaded)
+    return loaded
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""Live state of the crawler, for process supervisors and load tests.
+
+Each site's crawl cycles are timed stage by stage, using the stages of
+`journal.STAGES` plus `record_count` and `updated_inmates`. Along with
+the inmate count of the last report, the outbox depth, cache hit rates,
+and the health of the proxies, they are described by `snapshot` as a
+JSON serializable dict, and by `metrics` in the Prometheus text format.
+`monitor` serves both over HTTP.
+
+Recording is cheap, so cycles are always timed.
+"""
+import collections
+import contextlib
+import logging
+import threading
+import time
+
+import staticconf
+
+from . import charges
+from . import images
+from . import outbox
+from . import proxies
+from . import timestamps
+
+
+log = logging.getLogger(__name__)
+
+# Functions whose `functools.lru_cache` hit rates are reported.
+_LRU_CACHES = {
+    'parse_arrest': timestamps.parse_arrest,
+    'parse_date': timestamps.parse_date,
+    'parse_tweet_time': timestamps.parse_tweet_time,
+    'split_charge': charges.split_charge,
+}
+
+_lock = threading.Lock()
+_started = time.time()
+_sites = {}
+
+
+class SiteStatus(object):
+
+    """How one site's crawl cycles have been going.
+
+    Args:
+        name: Name of the site.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.cycles = 0
+        self.failures = 0
+        self.running_since = None
+        self.last_finished = None
+        self.last_success = None
+        self.last_error = None
+        self.last_duration_s = None
+        self.inmate_count = None
+        # Seconds each stage took in the last cycle.
+        self.stage_durations_s = {}
+        # Total seconds spent in each stage, over every cycle.
+        self.stage_totals_s = collections.Counter()
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'cycles': self.cycles,
+            'failures': self.failures,
+            'running_since': self.running_since,
+            'last_finished': self.last_finished,
+            'last_success': self.last_success,
+            'last_error': self.last_error,
+            'last_duration_s': self.last_duration_s,
+            'inmate_count': self.inmate_count,
+            'stage_durations_s': dict(self.stage_durations_s),
+            'stage_totals_s': dict(self.stage_totals_s),
+        }
+
+
+def _get_site(name):
+    site = _sites.get(name)
+    if site is None:
+        site = _sites[name] = SiteStatus(name)
+    return site
+
+
+class CycleTimer(object):
+
+    """Times the stages of one crawl cycle of a site.
+
+    Call `lap` as each stage finishes, and `fail` if the cycle ends
+    without doing its work.
+    """
+
+    def __init__(self, site_name):
+        self.site_name = site_name
+        self.started = time.time()
+        self.durations_s = collections.OrderedDict()
+        self.error = None
+        self._last_lap = time.perf_counter()
+
+    def lap(self, stage):
+        """Record that `stage` finished, and how long it took."""
+        now = time.perf_counter()
+        self.durations_s[stage] = (
+            self.durations_s.get(stage, 0) + now - self._last_lap
+        )
+        self._last_lap = now
+
+    def fail(self, error):
+        """Record that the cycle didn't succeed, with a reason."""
+        self.error = error
+
+
+@contextlib.contextmanager
+def cycle(site_name):
+    """Time the crawl cycle run within, as a `CycleTimer`.
+
+    The cycle counts as successful unless it raises, or `fail` is called.
+    """
+    timer = CycleTimer(site_name)
+    with _lock:
+        _get_site(site_name).running_since = timer.started
+    try:
+        yield timer
+    except Exception as error:
+        timer.fail(repr(error))
+        raise
+    finally:
+        _finish(timer)
+
+
+def _finish(timer):
+    now = time.time()
+    with _lock:
+        site = _get_site(timer.site_name)
+        site.cycles += 1
+        site.running_since = None
+        site.last_finished = now
+        site.last_duration_s = now - timer.started
+        site.stage_durations_s = dict(timer.durations_s)
+        site.stage_totals_s.update(timer.durations_s)
+        if timer.error is None:
+            site.last_success = now
+        else:
+            site.failures += 1
+            site.last_error = timer.error
+
+
+def set_inmate_count(site_name, count):
+    """Record the number of inmates on a site's latest report."""
+    with _lock:
+        _get_site(site_name).inmate_count = count
+
+
+def reset():
+    """Forget everything recorded so far."""
+    global _started
+    with _lock:
+        _started = time.time()
+        _sites.clear()
+
+
+def _cache_stats():
+    counts = {}
+    for name, function in _LRU_CACHES.items():
+        info = function.cache_info()
+        counts[name] = (info.hits, info.misses)
+    counts['upload_image'] = (
+        images.upload_cache_counts['hits'],
+        images.upload_cache_counts['misses'],
+    )
+    return {
+        name: {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else None,
+        }
+        for name, (hits, misses) in sorted(counts.items())
+    }
+
+
+def _proxy_health():
+    pool = proxies.get_pool()
+    if pool is None:
+        return []
+    return pool.health()
+
+
+def _outbox_depth():
+    try:
+        return {
+            'posts': outbox.pending_count(),
+            'uploads': outbox.pending_upload_count(),
+        }
+    except OSError as error:
+        log.warning('Unable to count the outbox: %r', error)
+        return {'posts': None, 'uploads': None}
+
+
+def unhealthy_sites(now=None):
+    """Names of the sites without a recent enough successful cycle.
+
+    A site is unhealthy once `status.max_cycle_age_s` has passed since
+    its last successful cycle, or since the process started if it hasn't
+    had one yet.
+    """
+    now = now or time.time()
+    max_age_s = staticconf.read_float('status.max_cycle_age_s', default=1800)
+    with _lock:
+        return sorted(
+            site.name
+            for site in _sites.values()
+            if now - (site.last_success or _started) > max_age_s
+        )
+
+
+def snapshot(now=None):
+    """Describe the crawler's state as a JSON serializable dict."""
+    now = now or time.time()
+    with _lock:
+        sites = [site.to_dict() for _, site in sorted(_sites.items())]
+        started = _started
+    unhealthy = unhealthy_sites(now=now)
+    return {
+        'healthy': not unhealthy,
+        'unhealthy_sites': unhealthy,
+        'time': now,
+        'uptime_s': now - started,
+        'sites': sites,
+        'outbox': _outbox_depth(),
+        'caches': _cache_stats(),
+        'proxies': _proxy_health(),
+    }
+
+
+def _escape(value):
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('"', '\\"')
+        .replace('\n', '\\n')
+    )
+
+
+def _format_metric(name, labels, value):
+    if labels:
+        name = '{}{{{}}}'.format(name, ','.join(
+            '{}="{}"'.format(key, _escape(label))
+            for key, label in sorted(labels.items())
+        ))
+    return '{} {}'.format(name, repr(float(value)))
+
+
+def metrics(now=None):
+    """Describe the crawler's state in the Prometheus text format."""
+    state = snapshot(now=now)
+    families = collections.OrderedDict()
+
+    def add(name, kind, description, value, **labels):
+        if value is None:
+            return
+        name = 'dentonpolice_' + name
+        if name not in families:
+            families[name] = [
+                '# HELP {} {}'.format(name, description),
+                '# TYPE {} {}'.format(name, kind),
+            ]
+        families[name].append(_format_metric(name, labels, value))
+
+    add('up', 'gauge', 'Whether every site is healthy.', state['healthy'])
+    add('uptime_seconds', 'gauge', 'Seconds since the process started.',
+        state['uptime_s'])
+    for site in state['sites']:
+        name = site['name']
+        add('cycles_total', 'counter', 'Crawl cycles finished.',
+            site['cycles'], site=name)
+        add('cycle_failures_total', 'counter', 'Crawl cycles that failed.',
+            site['failures'], site=name)
+        add('last_success_timestamp_seconds', 'gauge',
+            'When the last successful crawl cycle finished.',
+            site['last_success'], site=name)
+        add('cycle_duration_seconds', 'gauge',
+            'How long the last crawl cycle took.',
+            site['last_duration_s'], site=name)
+        add('cycle_running', 'gauge', 'Whether a crawl cycle is running.',
+            site['running_since'] is not None, site=name)
+        add('inmates', 'gauge', 'Inmates on the latest report.',
+            site['inmate_count'], site=name)
+        for stage, seconds in site['stage_durations_s'].items():
+            add('stage_duration_seconds', 'gauge',
+                'How long each stage took in the last crawl cycle.',
+                seconds, site=name, stage=stage)
+    with _lock:
+        totals = [
+            (site.name, stage, seconds)
+            for _, site in sorted(_sites.items())
+            for stage, seconds in sorted(site.stage_totals_s.items())
+        ]
+    for name, stage, seconds in totals:
+        add('stage_seconds_total', 'counter',
+            'Seconds spent in each stage, over every crawl cycle.',
+            seconds, site=name, stage=stage)
+    add('outbox_posts', 'gauge', 'Posts waiting in the outbox.',
+        state['outbox']['posts'])
+    add('outbox_uploads', 'gauge',
+        'Mug shots waiting in the outbox to be uploaded.',
+        state['outbox']['uploads'])
+    for cache, stats in state['caches'].items():
+        add('cache_hits_total', 'counter', 'Cache hits.',
+            stats['hits'], cache=cache)
+        add('cache_misses_total', 'counter', 'Cache misses.',
+            stats['misses'], cache=cache)
+    for proxy in state['proxies']:
+        address = proxy['address']
+        add('proxy_latency_seconds', 'gauge',
+            'Moving average of the latency of requests through a proxy.',
+            proxy['latency_s'], proxy=address)
+        add('proxy_in_flight', 'gauge',
+            'Requests in flight through a proxy.',
+            proxy['in_flight'], proxy=address)
+        add('proxy_degraded', 'gauge', 'Whether a proxy is being avoided.',
+            proxy['degraded'], proxy=address)
+    return ''.join(
+        line + '\n'
+        for lines in families.values()
+        for line in lines
+    )
@@ -1,17 +1,31 @@
 # -*- coding: utf-8 -*-
 """Code related to the jail report, such as retrieval and parsing."""
+import collections
 import datetime
 import errno
 import fnmatch
-import json
 import logging
 import os
+import threading
 
-import staticconf
+from . import config
+from . import images
+from . import mugindex
+from . import mugpack
+from . import serialization
+from . import util
 
 
 log = logging.getLogger(__name__)
 
+# The main log is appended to by both the crawler and the outbox poster.
+_log_lock = threading.Lock()
+
+# Perceptual hashes of recently seen mug shots, by SHA1.
+_phashes = collections.OrderedDict()
+_phashes_lock = threading.Lock()
+_MAX_PHASHES = 10000
+
 
 def save_mug_shots(inmates):
     """Saves the mug shot image data to a file for each Inmate.
@@ -21,10 +35,18 @@ def save_mug_shots(inmates):
     is different, the new mug shot is saved with the current date / time
     appended to the filename.
 
+    If `path.mug_pack_dir` is set, they are saved to a `mugpack.MugPack`
+    under the same names instead, and skipped if the inmate already has
+    an identical mug shot.
+
     Args:
         inmates: List of Inmate objects to be processed.
     """
-    path = staticconf.read('path.mug_shot_dir')
+    pack = mugpack.get_pack()
+    if pack is not None:
+        _save_mug_shots_to_pack(pack, inmates)
+        return
+    path = config.get_path('mug_shot_dir')
     try:
         os.makedirs(path)
     except OSError as e:
@@ -88,11 +110,68 @@ def save_mug_shots(inmates):
         )
         with open(location, mode='wb') as f:
             f.write(inmate.mug)
+        mugindex.record(
+            location=config.get_path('mug_index', default=None),
+            mug_path=location,
+            phash=load_phash(inmate),
+        )
+
+
+def _save_mug_shots_to_pack(pack, inmates):
+    for inmate in inmates:
+        if inmate.mug is None:
+            log.debug('Skipping inmate-ID %s with no mug shot.', inmate.id)
+            continue
+        name, added = pack.add(
+            inmate.id,
+            inmate.mug,
+            sha1=inmate.sha1,
+            phash=load_phash(inmate),
+        )
+        if not added:
+            log.debug('Skipping already saved mug shot (ID: %s)', inmate.id)
+            continue
+        log.debug('Saved mug shot for inmate-ID %s as: %s', inmate.id, name)
+        mugindex.record(
+            location=config.get_path('mug_index', default=None),
+            mug_path=name,
+            phash=inmate.phash,
+            sha1=inmate.sha1,
+        )
+
+
+def load_phash(inmate):
+    """Set and return the perceptual hash of the inmate's mug shot.
+
+    Computing the hash decodes the image, so it is only done for a mug
+    shot not seen before. Otherwise the hash is looked up from the pack,
+    where it is stored with the mug shot, or from those recently seen.
+    """
+    if inmate.mug is None or inmate.phash is not None:
+        return inmate.phash
+    sha1 = inmate.sha1
+    pack = mugpack.get_pack()
+    phash = pack.get_phash(sha1) if pack is not None else None
+    if phash is None:
+        with _phashes_lock:
+            phash = _phashes.get(sha1)
+    if phash is None:
+        phash = images.perceptual_hash(inmate.mug)
+        with _phashes_lock:
+            _phashes[sha1] = phash
+            if len(_phashes) > _MAX_PHASHES:
+                _phashes.popitem(last=False)
+    inmate.phash = phash
+    return phash
 
 
 def log_inmates(inmates, recent=False, mode='a'):
     """Log to file all Inmate information excluding mug shot image data.
 
+    The whole batch is serialized before touching the file. The recent
+    log is replaced atomically, so a crash never leaves it truncated,
+    while the main log is appended to with a single write.
+
     Args:
         inmates: List of Inmate objects to be processed.
         recent: Default of False will append to the main log file.
@@ -100,25 +179,31 @@ def log_inmates(inmates, recent=False, mode='a'):
             is representative of the inmates seen during the last check.
     """
     if recent:
-        location = staticconf.read('path.recent_inmate_log')
+        location = config.get_path('recent_inmate_log')
         mode = 'w'
     else:
-        location = staticconf.read('path.inmate_log')
+        location = config.get_path('inmate_log')
     if recent:
-        log_function = log.debug
+        log_level = logging.DEBUG
     else:
-        log_function = log.info
-    with open(location, mode=mode, encoding='utf-8') as f:
+        log_level = logging.INFO
+    if log.isEnabledFor(log_level):
         for inmate in inmates:
-            log_function(
+            log.log(
+                log_level,
                 'Recording inmate to the %s log: %s',
                 'recent' if recent else 'standard',
                 inmate,
             )
-            f.write(inmate.to_json() + '\n')
+    data = ''.join(inmate.to_json() + '\n' for inmate in inmates)
+    if mode == 'w':
+        util.atomic_write(location, data)
+    else:
+        with _log_lock, open(location, mode=mode, encoding='utf-8') as f:
+            f.write(data)
 
 
-def read_log(recent=False):
+def read_log(recent=False, fields=None, interner=None, tweet_fields=None):
     """Loads Inmate information from log to re-create Inmate objects.
 
     Mug shot data is not retrieved, neither from file nor server.
@@ -128,24 +213,38 @@ def read_log(recent=False):
         is representative of the inmates seen during the last check.
         While this is not the default, it is the option most used.
     :type recent: bool
+    :param fields: Only keep these keys of each record, for callers that
+        don't need the whole record. By default all keys are kept.
+    :type fields: iterable of str
+    :param interner: Share repeated values between records, which keeps
+        a large history much smaller in memory. The records must then
+        be treated as read only.
+    :type interner: dentonpolice.serialization.Interner
+    :param tweet_fields: Only keep these keys of each record's tweet.
+    :type tweet_fields: iterable of str
 
     :returns: The raw inmate objects from the log.
     :rtype: list of dict
     """
     if recent:
-        location = staticconf.read('path.recent_inmate_log')
+        location = config.get_path('recent_inmate_log')
     else:
-        location = staticconf.read('path.inmate_log')
+        location = config.get_path('inmate_log')
     log.debug(
         'Reading inmates from {log_name} log'.format(
             log_name='recent' if recent else 'standard',
         )
     )
+    read = serialization.make_reader(
+        fields=fields,
+        interner=interner,
+        tweet_fields=tweet_fields,
+    )
     inmate_list = []
     try:
-        with open(location, encoding='utf-8') as f:
+        with open(location, mode='rb') as f:
             for line in f:
-                inmate_list.append(json.loads(line))
+                inmate_list.append(read(line))
     except IOError as e:
         # No such file
         if e.errno == errno.ENOENT:
@@ -158,11 +257,23 @@ def read_log(recent=False):
 def most_recent_mug(inmate):
     """Returns the filename of the most recent mug shot for the Inmate.
 
+    If mug shots are kept in a pack, this is the name in the pack. Either
+    way, pass it to `read_mug` to get the image.
+
     Args:
-        inmates: List of Inmate objects to be processed.
+        inmate: The Inmate to find the mug shot of.
+
+    Returns:
+        The filename, or an empty string if none has been saved.
     """
+    pack = mugpack.get_pack()
+    if pack is not None:
+        best = pack.latest(inmate.id) or ''
+        if not best:
+            log.debug('Found no recent mug shot for inmate-ID %s.', inmate.id)
+        return best
     best = ''
-    for filename in os.listdir(staticconf.read('path.mug_shot_dir')):
+    for filename in os.listdir(config.get_path('mug_shot_dir')):
         # First conditional is for the original filename. The second
         # conditional is for newer timestamps.
         if (fnmatch.fnmatch(filename, '{}.jpg'.format(inmate.id)) or
@@ -184,6 +295,20 @@ def most_recent_mug(inmate):
     return best
 
 
+def read_mug(filename):
+    """Returns the image data of a mug shot named by `most_recent_mug`.
+
+    From a pack this is a memoryview of the mapped segment, which avoids
+    copying the image; otherwise it is the bytes of the file.
+    """
+    pack = mugpack.get_pack()
+    if pack is not None:
+        return pack.read(filename)
+    with open(os.path.join(config.get_path('mug_shot_dir'), filename),
+              mode='rb') as f:
+        return f.read()
+
+
 def get_most_inmates_count():
     """Returns the filename of the most recent mug shot for the Inmate.
 
@@ -192,7 +317,7 @@ def get_most_inmates_count():
     """
     most_count, on_date = (None, None)
     try:
-        with open(staticconf.read('path.most_inmate_count'), mode='r') as f:
+        with open(config.get_path('most_inmate_count'), mode='r') as f:
             (most_count, on_date) = f.read().split('\n')
             most_count = int(most_count)
     except IOError as e:
@@ -208,7 +333,9 @@ def get_most_inmates_count():
 
 def log_most_inmates_count(count):
     """Logs to file the most-count and the current date."""
-    now = now = datetime.datetime.now().strftime('%m/%d/%y %H:%M:%S')
+    now = datetime.datetime.now().strftime('%m/%d/%y %H:%M:%S')
     log.info('Logging most inmates count at %s on %s', count, now)
-    with open(staticconf.read('path.most_inmate_count'), mode='w') as f:
-        f.write('{}\n{}'.format(count, now))
+    util.atomic_write(
+        config.get_path('most_inmate_count'),
+        '{}\n{}'.format(count, now),
+    )
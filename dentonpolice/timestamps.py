@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""Fast parsing of the few timestamp layouts we see.
+
+The jail report writes arrest times as '09/07/2012 15:30:57' and dates
+of birth as '11/26/1988', and Twitter writes tweet times as 'Sun Apr 19
+22:50:00 +0000 2015'. Each layout has fixed widths, so these parsers
+slice out the numbers instead of using `datetime.strptime`, which is
+several times slower. Anything that doesn't fit the layout falls back
+to `strptime`, so bad input still raises `ValueError`. Results are
+cached, since the same strings are parsed over and over.
+"""
+import datetime
+import functools
+
+
+ARREST_FORMAT = '%m/%d/%Y %H:%M:%S'
+DATE_FORMAT = '%m/%d/%Y'
+TWEET_FORMAT = '%a %b %d %H:%M:%S +0000 %Y'
+
+_MONTHS = {
+    name: number
+    for number, name in enumerate(
+        ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+         'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'),
+        start=1,
+    )
+}
+
+
+def _digits(text, starts):
+    """Whether each two characters from each of `starts` are digits.
+
+    `int` alone would also accept signs, spaces, and underscores.
+    """
+    return all(text[start:start + 2].isdigit() for start in starts)
+
+
+@functools.lru_cache(maxsize=16384)
+def parse_arrest(text):
+    """Parse an arrest time like '09/07/2012 15:30:57'."""
+    if (len(text) == 19 and text[2] == text[5] == '/' and
+            text[10] == ' ' and text[13] == text[16] == ':' and
+            _digits(text, (0, 3, 6, 8, 11, 14, 17))):
+        try:
+            return datetime.datetime(
+                int(text[6:10]), int(text[0:2]), int(text[3:5]),
+                int(text[11:13]), int(text[14:16]), int(text[17:19]),
+            )
+        except ValueError:
+            pass
+    return datetime.datetime.strptime(text, ARREST_FORMAT)
+
+
+@functools.lru_cache(maxsize=16384)
+def parse_date(text):
+    """Parse a date like '11/26/1988', returning a datetime at midnight."""
+    if (len(text) == 10 and text[2] == text[5] == '/' and
+            _digits(text, (0, 3, 6, 8))):
+        try:
+            return datetime.datetime(
+                int(text[6:10]), int(text[0:2]), int(text[3:5]),
+            )
+        except ValueError:
+            pass
+    return datetime.datetime.strptime(text, DATE_FORMAT)
+
+
+@functools.lru_cache(maxsize=16384)
+def parse_tweet_time(text):
+    """Parse the `created_at` time of a tweet.
+
+    For example, 'Sun Apr 19 22:50:00 +0000 2015'. The time is in UTC.
+    """
+    if (len(text) == 30 and text[13] == text[16] == ':' and
+            text[19:26] == ' +0000 ' and text[4:7] in _MONTHS and
+            _digits(text, (8, 11, 14, 17, 26, 28))):
+        try:
+            return datetime.datetime(
+                int(text[26:30]), _MONTHS[text[4:7]], int(text[8:10]),
+                int(text[11:13]), int(text[14:16]), int(text[17:19]),
+            )
+        except ValueError:
+            pass
+    return datetime.datetime.strptime(text, TWEET_FORMAT)
@@ -1,13 +1,12 @@
 # -*- coding: utf-8 -*-
 """Code related to the jail report, such as retrieval and parsing."""
 import datetime
-import locale
 import logging
 import re
 
 import staticconf
-from twython import Twython
 
+from . import charges
 from . import zodiac
 
 
@@ -19,16 +18,57 @@ URL_LENGTH = 23  # Assume HTTPS, otherwise HTTP is 22.
 MEDIA_URL_LENGTH = 24
 TWEET_LIMIT = 140 - MEDIA_URL_LENGTH  # The mug shot is included as a link.
 
+# Characters that need to be padded with spaces to fix TwitPic display.
+_PADDED_CHARACTERS_PATTERN = re.compile(r'([<>])')
+_MULTIPLE_SPACES_PATTERN = re.compile(r'\s{2,}')
+
+# Clients are reused across checks so that their HTTP session, and its
+#   pooled connections, are too. Keyed by the credentials used.
+_twitter_clients = {}
+# Used instead of a real client if set, see `override_twitter_client`.
+_override_client = None
+
 
 def get_twitter_client():
+    """Return the shared Twitter client, or None if Twitter is disabled.
+
+    A new client is only created the first time, or if the credentials
+    in the configuration have changed since.
+    """
+    if _override_client is not None:
+        return _override_client
     if not staticconf.read_bool('twitter.enabled', default=False):
         return None
-    return Twython(
-        app_key=staticconf.read('twitter.api_key'),
-        app_secret=staticconf.read('twitter.api_secret'),
-        oauth_token=staticconf.read('twitter.access_token'),
-        oauth_token_secret=staticconf.read('twitter.access_token_secret'),
+    credentials = (
+        staticconf.read('twitter.api_key'),
+        staticconf.read('twitter.api_secret'),
+        staticconf.read('twitter.access_token'),
+        staticconf.read('twitter.access_token_secret'),
     )
+    twitter_client = _twitter_clients.get(credentials)
+    if twitter_client is None:
+        log.debug('Creating a new Twitter client.')
+        # Imported here since it is slow, and unused if Twitter is off.
+        from twython import Twython
+        _twitter_clients.clear()
+        twitter_client = Twython(
+            app_key=credentials[0],
+            app_secret=credentials[1],
+            oauth_token=credentials[2],
+            oauth_token_secret=credentials[3],
+        )
+        _twitter_clients[credentials] = twitter_client
+    return twitter_client
+
+
+def override_twitter_client(twitter_client):
+    """Post with `twitter_client` regardless of the configuration.
+
+    Such as a stand-in that records posts instead of making them. Pass
+    None to go back to the configured client.
+    """
+    global _override_client
+    _override_client = twitter_client
 
 
 def tweet_mug_shots(
@@ -83,12 +123,8 @@ def get_twitter_message(inmate):
     # Append arrest time
     parts.append(inmate.arrest)
     # Append first name with age
-    birth_date = datetime.datetime.strptime(inmate.DOB, '%m/%d/%Y')
-    arrest_date = datetime.datetime.strptime(
-        inmate.arrest,
-        '%m/%d/%Y %H:%M:%S',
-    )
-    age = int((arrest_date - birth_date).days / 365.2425)
+    birth_date = inmate.birth_date
+    age = int((inmate.arrest_time - birth_date).days / 365.2425)
     parts.append(
         '{first_name}, {age} yrs old {zodiac}'.format(
             first_name=inmate.first_name,
@@ -103,40 +139,13 @@ def get_twitter_message(inmate):
             if charge['amount']:
                 bond += int(float(charge['amount'][1:]))
         if bond:
-            locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
-            bond = locale.currency(bond, grouping=True)[:-3]
-            parts.append('Bond: ' + bond)
-    # Append list of charges
-    # But first shorten the charge text
-    city_list = [
-        'ARLINGTON',
-        'CORINTH',
-        'DALLAS',
-        'DC',
-        'DECATUR',
-        'DENTON',
-        'DPD',
-        'EULESS',
-        'FLOWER MOUND',
-        'FRISCO',
-        'LAKE DALLAS',
-        'LEWISVILLE',
-        'RICHARDSON',
-        'TARRANT',
-        'TDCJ',
-    ]
-    cities = '(?:{cities})*'.format(cities='|'.join(city_list))
-    extras = r'\s*(?:CO)?\s*(?:SO)?\s*(?:PD)?\s*(?:WARRANT)?(?:S)?\s*/\s*'
+            # Whole US dollars with thousands separators e.g., '$1,500'.
+            parts.append('Bond: ${:,d}'.format(bond))
+    # Append list of charges, without the agency that made the arrest.
     for charge in inmate.charges:
-        charge['charge'] = re.sub(r'\A' + cities + extras,
-                                  '',
-                                  charge['charge'])
-        # pad certain characters with spaces to fix TwitPic display
-        charge['charge'] = re.sub(r'([<>])', r' \1 ', charge['charge'])
-        # collapse multiple spaces
-        charge['charge'] = re.sub(r'\s{2,}', r' ', charge['charge'])
-        if charge['charge']:
-            parts.append(charge['charge'])
+        offense = _format_offense(charges.offense_of(charge))
+        if offense:
+            parts.append(offense)
     message = '\n'.join(parts)
     # Truncate to TWEET_LIMIT, otherwise we will get HTTP 403 when
     # submitting to Twitter for the status being over 140 chars.
@@ -164,12 +173,35 @@ def get_twitter_message(inmate):
         return message_with_petition
 
 
+def shorten_charge(charge):
+    """Remove the agency prefix and tidy the spacing of a charge."""
+    return _format_offense(charges.split_charge(charge)[1])
+
+
+def _format_offense(offense):
+    # pad certain characters with spaces to fix TwitPic display
+    offense = _PADDED_CHARACTERS_PATTERN.sub(r' \1 ', offense)
+    # collapse multiple spaces
+    return _MULTIPLE_SPACES_PATTERN.sub(' ', offense).strip()
+
+
 def tweet_most_count(twitter_client, count, most_count, on_date):
     """Tweet that we have seen the most number of inmates in jail at once."""
     if twitter_client is None:
         log.info('Not posting most-count since Twitter is disabled.')
+        return
     log.info('Posting new record of %s inmates', count)
-    # Post to twitter and log
+    twitter_client.update_status(
+        status=get_most_count_message(
+            count=count,
+            most_count=most_count,
+            on_date=on_date,
+        ),
+    )
+
+
+def get_most_count_message(count, most_count, on_date):
+    """Constructs the status for a new most-count record."""
     now = datetime.datetime.now().strftime('%m/%d/%y %H:%M:%S')
     message = (
         'New Record: {count} inmates listed in jail as of {time}.'.format(
@@ -186,5 +218,5 @@ def tweet_most_count(twitter_client, count, most_count, on_date):
     # we might be able to use a smaller length here.
     jail_url = 'http://dpdjailview.cityofdenton.com/'
     if len(message) + len(jail_url) + 1 <= 140:
-        message += ' ' + jail_url.decode('utf-8')
-    twitter_client.update_status(status=message)
+        message += ' ' + jail_url
+    return message
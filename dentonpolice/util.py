@@ -6,35 +6,82 @@
 # http://creativecommons.org/licenses/by-nc-sa/3.0/
 """Generally applicable utility functions."""
 import logging
-import signal
+import os
+import stat
+import tempfile
+import time
 from hashlib import sha1
 
 
 log = logging.getLogger(__name__)
 
 
-class timeout(object):
+class Deadline(object):
 
-    """Context manager to raise a timeout if an operation takes too long.
+    """A point in time by which an operation must finish.
 
-    Not thread safe. For more information see:
-    <http://stackoverflow.com/q/2281850/1988505>
+    Replaces the SIGALRM based timeout, which only worked in the main
+    thread and with whole seconds. A deadline is just a monotonic clock
+    reading, so it can be shared by threads, asyncio tasks, and handed
+    to subprocesses as a timeout. Blocking calls should be given
+    `timeout()` as their own timeout, and loops should call `check()`
+    between steps so that the whole operation stays within the deadline.
+
+    Args:
+        seconds: Time allowed from now, which may be fractional.
     """
 
     def __init__(self, seconds):
         self.seconds = seconds
-
-    def handle_timeout(self, signum, frame):
-        log.debug('Handling alarm. (threshold: %s seconds)', self.seconds)
-        raise TimeoutError
-
-    def __enter__(self):
-        signal.signal(signal.SIGALRM, self.handle_timeout)
-        signal.alarm(self.seconds)
-
-    def __exit__(self, type, value, traceback):
-        # TODO(bwbaugh): If no error, maybe warn if time remaining is small?
-        signal.alarm(0)
+        self.expires_at = time.monotonic() + seconds
+
+    def __repr__(self):
+        return 'Deadline(seconds={!r}, remaining={:.3f})'.format(
+            self.seconds,
+            self.remaining(),
+        )
+
+    def remaining(self):
+        """Seconds left before the deadline, never less than zero."""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+    def check(self):
+        """Raise TimeoutError if the deadline has passed."""
+        if self.expired:
+            log.debug('Deadline of %s seconds expired.', self.seconds)
+            raise TimeoutError(
+                'Deadline of {} seconds expired.'.format(self.seconds)
+            )
+
+    def timeout(self, cap=None):
+        """Timeout for one blocking call, such as a socket operation.
+
+        Args:
+            cap: Longest the single call may take, even if more time
+                remains before the deadline e.g., a per-read timeout.
+
+        Raises:
+            TimeoutError if the deadline has already passed.
+        """
+        self.check()
+        remaining = self.remaining()
+        if cap is not None:
+            remaining = min(remaining, cap)
+        return remaining
+
+    async def wait_for(self, awaitable):
+        """Await within the deadline, raising TimeoutError if it passes."""
+        import asyncio
+        try:
+            return await asyncio.wait_for(awaitable, self.timeout())
+        except asyncio.TimeoutError:
+            raise TimeoutError(
+                'Deadline of {} seconds expired.'.format(self.seconds)
+            )
 
 
 def git_hash(data):
@@ -59,3 +106,40 @@ def git_hash(data):
     hash_object.update(header)
     hash_object.update(data)
     return hash_object.hexdigest()
+
+
+def atomic_write(path, data, encoding='utf-8'):
+    """Replace the file at `path` so readers never see a partial write.
+
+    The data is written with a single call to a temporary file in the
+    same directory, flushed to disk, and then renamed over `path`.
+
+    Args:
+        path: Destination filename.
+        data: String or byte string of the complete new file contents.
+            Strings are encoded using `encoding`.
+    """
+    if isinstance(data, str):
+        data = data.encode(encoding)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(
+        dir=directory,
+        prefix='.{}.'.format(os.path.basename(path)),
+        suffix='.tmp',
+    )
+    try:
+        with os.fdopen(fd, mode='wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        # Temporary files are private, so keep the permissions of the
+        # file being replaced (or the usual default for a new file).
+        try:
+            file_mode = stat.S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            file_mode = 0o644
+        os.chmod(temp_path, file_mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
@@ -28,4 +28,11 @@ setuptools.setup(
         'raven>=5.2.0',
         'twython>=3.1.2',
     ],
+    extras_require={
+        # Faster JSON encoding and decoding of the inmate log.
+        'speedups': ['orjson'],
+        # Resizing mug shots before they are uploaded, and perceptual
+        #   hashes for detecting whether a mug shot has really changed.
+        'images': ['numpy', 'Pillow'],
+    },
 )
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from dentonpolice import api
+from dentonpolice import history
+
+
+@pytest.fixture
+def server(request, tmpdir):
+    with open(str(tmpdir.join('log.json')), mode='w') as f:
+        for index in range(5):
+            f.write(json.dumps({
+                'id': str(index),
+                'name': 'DOE, JANE',
+                'arrest': '04/21/2015 08:04:33',
+                'charges': [{'charge': 'PUBLIC INTOX'}],
+            }) + '\n')
+    server = api.APIServer(
+        address=('127.0.0.1', 0),
+        history=history.History(
+            log_location=str(tmpdir.join('log.json')),
+            recent_location=str(tmpdir.join('recent.json')),
+        ),
+    )
+    server.start_in_thread()
+    request.addfinalizer(server.server_close)
+    request.addfinalizer(server.shutdown)
+    return server
+
+
+def _get(server, path):
+    with urllib.request.urlopen(server.url + path) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+class TestAPI(object):
+
+    def test_search_paginated(self, server):
+        body = _get(server, 'inmates?charge=intox&offset=1&limit=2')
+        assert body['total'] == 5
+        assert [record['id'] for record in body['results']] == ['3', '2']
+
+    def test_inmate_by_id(self, server):
+        body = _get(server, 'inmates/4')
+        assert body['results'][0]['name'] == 'DOE, JANE'
+
+    def test_charge_frequencies(self, server):
+        body = _get(server, 'charges?q=intox')
+        assert body['results'] == [{'offense': 'PUBLIC INTOX', 'count': 5}]
+
+    def test_current_empty(self, server):
+        assert _get(server, 'inmates/current')['total'] == 0
+
+    @pytest.mark.parametrize(
+        argnames='path,status',
+        argvalues=[
+            ('inmates/999', 404),
+            ('elsewhere', 404),
+            ('inmates?limit=abc', 400),
+            ('inmates?offset=-1', 400),
+        ],
+    )
+    def test_errors(self, server, path, status):
+        with pytest.raises(urllib.error.HTTPError) as excinfo:
+            _get(server, path)
+        assert excinfo.value.code == status
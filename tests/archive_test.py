@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+import hashlib
+
+import mock
+import pytest
+import staticconf.testing
+
+from dentonpolice import archive
+from dentonpolice import jail
+from dentonpolice import mugpack
+from dentonpolice import serialization
+from dentonpolice import sites
+
+
+@pytest.fixture
+def app_config(request, tmpdir):
+    mock_configuration = staticconf.testing.MockConfiguration({
+        'path.inmate_log': str(tmpdir.join('log.json')),
+        'path.mug_pack_dir': str(tmpdir.join('pack')),
+        'path.recent_inmate_log': str(tmpdir.join('recent.json')),
+        'path.report_archive_dir': str(tmpdir.join('reports')),
+    })
+    mock_configuration.setup()
+    request.addfinalizer(mock_configuration.teardown)
+    return mock_configuration
+
+
+def sha1(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+@pytest.fixture
+def remote(tmpdir):
+    return archive.LocalArchive(str(tmpdir.join('bucket')))
+
+
+class TestReconcile(object):
+
+    @pytest.fixture
+    def site_list(self):
+        return [sites.Site(name='dentonpolice', url='')]
+
+    @pytest.fixture
+    def drifted(self, app_config, remote, tmpdir):
+        # Local mug shots, one of which was never uploaded
+        pack = mugpack.get_pack()
+        pack.add('1', b'uploaded')
+        pack.add('2', b'local only')
+        remote.put(jail.make_mug_shot_key_name(sha1(b'uploaded')), b'uploaded')
+        # Archived mug shots of a logged inmate and of an unknown one
+        remote.put(jail.make_mug_shot_key_name(sha1(b'lost')), b'lost')
+        remote.put(jail.make_mug_shot_key_name(sha1(b'who')), b'who')
+        tmpdir.join('log.json').write(
+            serialization.dumps({'id': '3', 'sha1': sha1(b'lost')}) + '\n'
+        )
+        # And reports kept on only one side each
+        reports = archive.get_report_archive()
+        reports.put('jail_report/dentonpolice/2015/04/21/1.html', 'local')
+        remote.put('jail_report/dentonpolice/2015/04/22/2.html', 'remote')
+
+    def test_transfers_only_the_difference(
+            self, drifted, remote, site_list):
+        # When the local store is reconciled with the archive
+        plans = archive.reconcile(remote, site_list=site_list, workers=2)
+        # Then what was missing on each side is transferred
+        plan = plans['dentonpolice']
+        assert plan.mug_uploads == [(sha1(b'local only'), '2.jpg')]
+        assert plan.mug_downloads == [(sha1(b'lost'), '3')]
+        assert plan.mug_skipped == 1
+        assert remote.get(
+            jail.make_mug_shot_key_name(sha1(b'local only')),
+        ) == b'local only'
+        pack = mugpack.get_pack()
+        assert bytes(pack.read(pack.latest('3'))) == b'lost'
+        reports = archive.get_report_archive()
+        assert reports.get(
+            'jail_report/dentonpolice/2015/04/22/2.html',
+        ) == b'remote'
+        assert remote.get(
+            'jail_report/dentonpolice/2015/04/21/1.html',
+        ) == b'local'
+        # And reconciling again has nothing left to do
+        plans = archive.reconcile(remote, site_list=site_list)
+        assert not plans['dentonpolice']
+
+    def test_dry_run(self, drifted, remote, site_list, tmpdir):
+        before = sorted(str(path) for path in tmpdir.visit())
+        plans = archive.reconcile(remote, site_list=site_list, dry_run=True)
+        assert plans['dentonpolice']
+        assert sorted(str(path) for path in tmpdir.visit()) == before
+
+    def test_report_conflicts_left_alone(self, app_config, remote, site_list):
+        key = 'jail_report/dentonpolice/2015/04/21/1.html'
+        archive.get_report_archive().put(key, 'local')
+        remote.put(key, 'remote')
+        plans = archive.reconcile(remote, site_list=site_list)
+        assert plans['dentonpolice'].report_conflicts == [key]
+        assert remote.get(key) == b'remote'
+
+    def test_uploaded_mug_shots_are_public(self, drifted, remote, site_list):
+        with mock.patch.object(remote, 'put', wraps=remote.put) as mock_put:
+            archive.reconcile(remote, site_list=site_list)
+        mug_key = jail.make_mug_shot_key_name(sha1(b'local only'))
+        policies = [
+            call[1].get('policy')
+            for call in mock_put.call_args_list
+            if call[0][0] == mug_key
+        ]
+        # Like the mug shots uploaded while crawling
+        assert policies == [jail.MUG_SHOT_POLICY]
+
+
+class TestS3Archive(object):
+
+    def test_put_with_policy(self):
+        s3 = archive.S3Archive(bucket=mock.sentinel.bucket)
+        with mock.patch('boto.s3.key.Key', autospec=True) as mock_key:
+            s3.put('mugshots/a.jpg', b'data', policy='public-read')
+        mock_key.assert_called_once_with(
+            bucket=mock.sentinel.bucket,
+            name='mugshots/a.jpg',
+        )
+        mock_key.return_value.set_contents_from_string.assert_called_once_with(
+            string_data=b'data',
+            headers=None,
+            replace=False,
+            policy='public-read',
+        )
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from dentonpolice import charges
+
+
+class TestSplitCharge(object):
+
+    @pytest.mark.parametrize(
+        argnames='text,agency,offense',
+        argvalues=[
+            ('DPD / PUBLIC INTOXICATION', 'DPD', 'PUBLIC INTOXICATION'),
+            ('LEWISVILLE PD WARRANTS / THEFT', 'LEWISVILLE PD WARRANTS',
+             'THEFT'),
+            ('DENTON CO SO WARRANT / THEFT  <$50', 'DENTON CO SO WARRANT',
+             'THEFT <$50'),
+            ('LOCAL MUNICIPAL WARRANT', '', 'LOCAL MUNICIPAL WARRANT'),
+        ],
+    )
+    def test_split(self, text, agency, offense):
+        assert charges.split_charge(text) == (agency, offense)
+
+    def test_offenses_are_interned(self):
+        first = charges.split_charge('DPD / ' + 'PUBLIC INTOX'.lower())[1]
+        second = charges.split_charge('TDCJ / PUBLIC INTOX')[1]
+        assert first is second
+
+
+class TestNormalize(object):
+
+    def test_copy_keeps_raw_charge(self):
+        charge = {'charge': 'DPD / THEFT', 'type': 'BOND', 'amount': '$1'}
+        result = charges.normalize(charge)
+        assert result == dict(charge, agency='DPD', offense='THEFT')
+        assert 'offense' not in charge
+
+
+class TestChargeIndex(object):
+
+    @pytest.fixture
+    def index(self):
+        index = charges.ChargeIndex(vocabulary=charges.Vocabulary())
+        index.add(0, [{'charge': 'DPD / THEFT PROP <$50'}])
+        index.add(1, [{'charge': 'THEFT PROP >=$50<$500'},
+                      {'charge': 'DPD / PUBLIC INTOX'}])
+        index.add(2, [{'charge': 'DPD / THEFT PROP <$50'}, {'charge': ''}])
+        return index
+
+    def test_search_words_of_one_offense(self, index):
+        assert index.search('theft') == {0, 1, 2}
+        assert index.search('prop 500') == {1}
+        # Words from different offenses don't match together.
+        assert index.search('theft intox') == set()
+
+    def test_frequencies(self, index):
+        assert index.frequencies() == [
+            ('THEFT PROP <$50', 2),
+            ('PUBLIC INTOX', 1),
+            ('THEFT PROP >=$50<$500', 1),
+        ]
+        assert index.frequencies(query='intox') == [('PUBLIC INTOX', 1)]
+        assert index.frequencies(limit=1) == [('THEFT PROP <$50', 2)]
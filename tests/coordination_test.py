@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import mock
+import pytest
+
+from dentonpolice import coordination
+from dentonpolice import crawler
+from dentonpolice import scheduler
+from dentonpolice import sites
+
+
+@pytest.fixture
+def nodes(tmpdir):
+    path = str(tmpdir.join('coordination.sqlite'))
+    return [
+        coordination.Coordinator(path=path, owner='first', lease_seconds=60),
+        coordination.Coordinator(path=path, owner='second', lease_seconds=60),
+    ]
+
+
+class TestSiteLeases(object):
+
+    def test_only_one_node_holds_a_site(self, nodes):
+        first, second = nodes
+        assert first.acquire_site('denton')
+        assert not second.acquire_site('denton')
+        # Other sites are still available.
+        assert second.acquire_site('lewisville')
+
+    def test_release_schedules_next_check(self, nodes):
+        first, second = nodes
+        assert first.acquire_site('denton')
+        first.release_site('denton', next_check_in_s=300)
+        assert not second.acquire_site('denton')
+        first.release_site('denton', next_check_in_s=0)
+        # Only the owner can release the lease.
+        assert not second.acquire_site('denton')
+
+    def test_expired_lease_is_taken_over(self, nodes):
+        first, second = nodes
+        assert first.acquire_site('denton')
+        with mock.patch.object(coordination.time, 'time', return_value=1e12):
+            assert second.acquire_site('denton')
+
+    def test_renewed_lease_is_kept(self, nodes):
+        first, second = nodes
+        assert first.acquire_site('denton')
+        later = coordination.time.time() + 45
+        with mock.patch.object(coordination.time, 'time', return_value=later):
+            assert first.renew_site('denton')
+        with mock.patch.object(
+                coordination.time, 'time', return_value=later + 45):
+            # The lease would have expired without the renewal.
+            assert not second.acquire_site('denton')
+
+    def test_expired_lease_is_not_renewed(self, nodes):
+        first, second = nodes
+        assert first.acquire_site('denton')
+        with mock.patch.object(coordination.time, 'time', return_value=1e12):
+            assert second.acquire_site('denton')
+            assert not first.renew_site('denton')
+
+
+class TestPostClaims(object):
+
+    def test_post_is_made_once(self, nodes):
+        first, second = nodes
+        assert first.claim_post('mug-1-abc')
+        assert not second.claim_post('mug-1-abc')
+        first.finish_post('mug-1-abc')
+        with mock.patch.object(coordination.time, 'time', return_value=1e12):
+            # Even after the claim expires, a finished post stays made.
+            assert not second.claim_post('mug-1-abc')
+
+    def test_failed_post_can_be_retried(self, nodes):
+        first, second = nodes
+        assert first.claim_post('mug-1-abc')
+        first.release_post('mug-1-abc')
+        assert second.claim_post('mug-1-abc')
+
+
+class TestSchedulerWithCoordinator(object):
+
+    def test_site_checked_by_one_node(self, nodes):
+        # Given two nodes configured with the same sites
+        site_list = [sites.Site(name='denton', url='')]
+        schedulers = [
+            scheduler.Scheduler(
+                sites=site_list,
+                bucket=None,
+                coordinator=coordinator,
+            )
+            for coordinator in nodes
+        ]
+        # When both nodes check their sites
+        with mock.patch.object(crawler, 'main', autospec=True) as mock_main:
+            for instance in schedulers:
+                instance.run_once()
+        # Then the site should only be checked once
+        assert mock_main.call_count == 1
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import mock
+import pytest
+import staticconf.testing
+
+from dentonpolice import fakejail
+from dentonpolice import jail
+from dentonpolice import retry
+from dentonpolice import sites
+
+
+@pytest.fixture
+def server(request):
+    server = fakejail.FakeJailServer(
+        address=('127.0.0.1', 0),
+        reports=fakejail.ReportSource(inmate_count=5, seed=1),
+    )
+    server.start_in_thread()
+
+    def shutdown():
+        server.shutdown()
+        server.server_close()
+    request.addfinalizer(shutdown)
+    return server
+
+
+@pytest.fixture
+def app_config(request, server):
+    mock_configuration = staticconf.testing.MockConfiguration({
+        'jail.url': server.url,
+        'proxy.host': None,
+        'timeout.open_jail_report': 5,
+        'timeout.open_one_mug_shot': 5,
+    })
+    mock_configuration.setup()
+    request.addfinalizer(mock_configuration.teardown)
+    return mock_configuration
+
+
+class TestMakeSyntheticReport(object):
+
+    def test_parses_into_inmates(self):
+        # Given a synthetic report
+        html = fakejail.make_synthetic_report(count=7, seed=3)
+        # When we parse it like a real report
+        inmates = jail.parse_inmates(html)
+        # Then every inmate should be found in order
+        assert [inmate.id for inmate in inmates] == [
+            str(300000 + index) for index in range(7)
+        ]
+
+    def test_same_seed_same_report(self):
+        first = fakejail.make_synthetic_report(count=3, seed=5)
+        second = fakejail.make_synthetic_report(count=3, seed=5)
+        assert first == second
+
+
+class TestMakeSyntheticMug(object):
+
+    def test_unique_per_inmate(self):
+        first = fakejail.make_synthetic_mug('1')
+        second = fakejail.make_synthetic_mug('2')
+        assert first != second
+        assert first.startswith(b'\xff\xd8')
+        assert first.endswith(b'\xff\xd9')
+
+
+class TestFakeJailServer(object):
+
+    def test_crawler_fetches_report_and_mugs(self, server, app_config):
+        # Given the crawler is configured to use the fake server
+        # When we get the report and mug shots
+        inmates = jail.parse_inmates(jail.get_jail_report())
+        jail.get_mug_shots(inmates=inmates, bucket=None)
+        # Then every inmate should have their synthetic mug shot
+        assert len(inmates) == 5
+        for inmate in inmates:
+            assert inmate.mug == fakejail.make_synthetic_mug(inmate.id)
+        assert server.stats['requests'] == 6
+
+    def test_error_rate(self, server):
+        # Given a server that always fails
+        server.behavior = fakejail.Behavior(error_rate=1)
+        # When we make a request
+        with pytest.raises(urllib.error.HTTPError) as excinfo:
+            urllib.request.urlopen(server.url)
+        # Then the response should be an error
+        assert excinfo.value.code == 503
+        assert server.stats['errors'] == 1
+
+    def test_stalled_report_times_out_in_thread(self, server, app_config):
+        # Given a server that never responds
+        server.behavior = fakejail.Behavior(timeout_rate=1, stall_s=2)
+        results = []
+        # When we get the report from a thread other than the main one
+        with staticconf.testing.MockConfiguration(
+            dict(app_config.config_data, **{
+                'timeout.open_jail_report': 0.2,
+                'retry.attempts': 1,
+            }),
+        ):
+            start = time.monotonic()
+            thread = threading.Thread(
+                target=lambda: results.append(jail.get_jail_report()),
+            )
+            thread.start()
+            thread.join()
+            elapsed = time.monotonic() - start
+        # Then it should give up at the deadline
+        assert results == [None]
+        assert elapsed < 1
+
+    def test_trickling_mug_shot_times_out(self, server, app_config):
+        # Given a server that sends mug shots very slowly
+        server.behavior = fakejail.Behavior(bandwidth_bps=100)
+        inmates = jail.parse_inmates(fakejail.make_synthetic_report(count=1))
+        # When we get the mug shots with a short deadline
+        with staticconf.testing.MockConfiguration(
+            dict(app_config.config_data, **{
+                'timeout.open_one_mug_shot': 0.3,
+                'retry.attempts': 1,
+            }),
+        ):
+            start = time.monotonic()
+            jail.get_mug_shots(inmates=inmates, bucket=None)
+            elapsed = time.monotonic() - start
+        # Then the mug shot should be skipped once the deadline passes
+        assert inmates[0].mug is None
+        assert elapsed < 1
+
+    def test_circuit_breaker_keeps_retrieved_mugs(self, server, app_config):
+        # Given a site whose mug shots start failing part way through
+        site = sites.DentonSite(name='fake', url=server.url)
+        site.breaker = retry.CircuitBreaker(failure_threshold=2)
+        inmates = jail.parse_inmates(fakejail.make_synthetic_report(count=5))
+        jail.get_mug_shots(inmates=inmates[:2], bucket=None, site=site)
+        server.behavior = fakejail.Behavior(error_rate=1)
+        app_config.namespace.update_values({
+            'retry.attempts': 2,
+            'retry.backoff_base_s': 0,
+        })
+        requests_before = server.stats['requests']
+        # When we get the rest of the mug shots
+        missing = jail.get_mug_shots(inmates=inmates, bucket=None, site=site)
+        # Then the site should stop being asked once the circuit opens
+        assert site.breaker.is_open
+        assert server.stats['requests'] - requests_before == 2
+        # And the earlier mug shots should still be there
+        assert missing == inmates
+        assert [bool(inmate.mug) for inmate in inmates] == [
+            True, True, False, False, False,
+        ]
+
+    def test_reset_mug_shot_is_skipped(self, server, app_config):
+        # Given a connection that keeps getting reset for one mug shot
+        inmates = jail.parse_inmates(fakejail.make_synthetic_report(count=3))
+        read_url = jail._read_url
+
+        def reset_second(opener, url, seconds):
+            if url.endswith('=' + inmates[1].id):
+                raise ConnectionResetError(104, 'Connection reset by peer')
+            return read_url(opener=opener, url=url, seconds=seconds)
+        app_config.namespace.update_values({
+            'retry.attempts': 2,
+            'retry.backoff_base_s': 0,
+        })
+        # When we get the mug shots
+        with mock.patch.object(jail, '_read_url', side_effect=reset_second):
+            missing = jail.get_mug_shots(inmates=inmates, bucket=None)
+        # Then only that one should be missing
+        assert missing == [inmates[1]]
+        assert [bool(inmate.mug) for inmate in inmates] == [
+            True, False, True,
+        ]
+
+    def test_reset_report_is_skipped(self, server, app_config):
+        # Given a connection that keeps getting reset
+        app_config.namespace.update_values({
+            'retry.attempts': 2,
+            'retry.backoff_base_s': 0,
+        })
+        with mock.patch.object(
+                jail,
+                '_read_url',
+                side_effect=ConnectionResetError(104, 'Connection reset'),
+        ):
+            # When we get the report
+            html = jail.get_jail_report()
+        # Then it is missing, as for other network errors
+        assert html is None
+
+    def test_mug_shots_spread_over_proxy_pool(self, server, app_config):
+        # Given a second server, and both act as proxies for the jail
+        #   since they serve the path of whatever URL they are asked for
+        other = fakejail.FakeJailServer(
+            address=('127.0.0.1', 0),
+            reports=fakejail.ReportSource(inmate_count=5, seed=1),
+        )
+        other.start_in_thread()
+        server.behavior = other.behavior = fakejail.Behavior(latency_s=0.1)
+        try:
+            app_config.namespace.update_values({
+                'jail.url': 'http://jail.invalid/',
+                'proxy.pool': [
+                    '127.0.0.1:{}'.format(server.server_address[1]),
+                    '127.0.0.1:{}'.format(other.server_address[1]),
+                ],
+            })
+            inmates = jail.parse_inmates(
+                fakejail.make_synthetic_report(count=6),
+            )
+            # When we get the mug shots
+            missing = jail.get_mug_shots(inmates=inmates, bucket=None)
+        finally:
+            other.shutdown()
+            other.server_close()
+        # Then they should have been downloaded through both proxies
+        assert missing == []
+        assert server.stats['requests'] >= 1
+        assert other.stats['requests'] >= 1
+        assert server.stats['requests'] + other.stats['requests'] == 6
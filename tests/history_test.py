@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from dentonpolice import history
+
+
+def _record(id, name, arrest, *charges):
+    return {
+        'id': id,
+        'name': name,
+        'arrest': arrest,
+        'charges': [
+            {'charge': charge, 'type': 'BOND', 'amount': '$1.00'}
+            for charge in charges
+        ],
+    }
+
+
+def _write(path, records, mode='a'):
+    with open(str(path), mode=mode) as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+
+@pytest.fixture
+def inmate_history(tmpdir):
+    _write(tmpdir.join('log.json'), [
+        _record('1', 'DOE, JANE', '04/21/2015 08:04:33', 'THEFT PROP<$50'),
+        _record('2', 'DOE, JOHN', '04/21/2015 09:00:00', 'PUBLIC INTOX'),
+        _record('3', 'ROE, RICHARD', '04/22/2015 10:00:00',
+                'THEFT PROP<$50', 'DWI'),
+    ])
+    _write(tmpdir.join('recent.json'), [
+        _record('3', 'ROE, RICHARD', '04/22/2015 10:00:00', 'DWI'),
+    ])
+    instance = history.History(
+        log_location=str(tmpdir.join('log.json')),
+        recent_location=str(tmpdir.join('recent.json')),
+    )
+    instance.refresh()
+    return instance
+
+
+def _ids(results):
+    return [record['id'] for record in results]
+
+
+class TestHistory(object):
+
+    def test_search_by_name_words(self, inmate_history):
+        total, results = inmate_history.search(name='doe')
+        assert total == 2
+        # Newest first.
+        assert _ids(results) == ['2', '1']
+        assert _ids(inmate_history.search(name='Jane Doe')[1]) == ['1']
+
+    def test_search_by_charge(self, inmate_history):
+        assert _ids(inmate_history.search(charge='theft')[1]) == ['3', '1']
+
+    def test_charge_words_match_within_one_offense(self, inmate_history):
+        assert _ids(inmate_history.search(charge='theft dwi')[1]) == []
+
+    def test_charge_frequencies(self, inmate_history):
+        assert inmate_history.charge_frequencies() == (3, [
+            ('THEFT PROP<$50', 2),
+            ('DWI', 1),
+            ('PUBLIC INTOX', 1),
+        ])
+
+    def test_search_combined(self, inmate_history):
+        total, results = inmate_history.search(
+            charge='theft',
+            arrested='2015-04-21',
+        )
+        assert _ids(results) == ['1']
+
+    def test_search_no_match(self, inmate_history):
+        assert inmate_history.search(name='nobody') == (0, [])
+
+    def test_pagination(self, inmate_history):
+        total, results = inmate_history.search(offset=1, limit=1)
+        assert total == 3
+        assert _ids(results) == ['2']
+
+    def test_current_inmates(self, inmate_history):
+        assert _ids(inmate_history.current_inmates()[1]) == ['3']
+
+    def test_refresh_only_reads_appended(self, inmate_history, tmpdir):
+        # Given a new record and the start of another are appended
+        path = tmpdir.join('log.json')
+        _write(path, [_record('4', 'DOE, JANE', '05/01/2015 00:00:00')])
+        with open(str(path), mode='a') as f:
+            f.write('{"id": "5", "na')
+        # When we refresh
+        # Then only the complete new record should be added
+        assert inmate_history.refresh() == 1
+        assert _ids(inmate_history.search(name='jane')[1]) == ['4', '1']
+        # And the partial one should be added once it is complete
+        with open(str(path), mode='a') as f:
+            f.write('me": "X, Y", "arrest": "05/02/2015 00:00:00"}\n')
+        assert inmate_history.refresh() == 1
+        assert _ids(inmate_history.search(id='5')[1]) == ['5']
+
+    def test_replaced_log_is_reindexed(self, inmate_history, tmpdir):
+        path = tmpdir.join('log.json')
+        path.remove()
+        _write(path, [_record('9', 'NEW, LOG', '01/01/2016 00:00:00')])
+        inmate_history.refresh()
+        assert inmate_history.search() == (1, inmate_history.records)
+        assert _ids(inmate_history.search(name='doe')[1]) == []
+
+    def test_recent_reloaded_when_replaced(self, inmate_history, tmpdir):
+        path = tmpdir.join('recent.json')
+        path.remove()
+        _write(path, [
+            _record('7', 'A, B', '01/01/2016 00:00:00'),
+            _record('8', 'C, D', '01/01/2016 00:00:00'),
+        ])
+        inmate_history.refresh()
+        assert _ids(inmate_history.current_inmates()[1]) == ['7', '8']
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import io
+
+import pytest
+import staticconf.testing
+
+from dentonpolice import images
+
+Image = pytest.importorskip('PIL.Image')
+
+
+@pytest.fixture
+def app_config(request, tmpdir):
+    mock_configuration = staticconf.testing.MockConfiguration({
+        'path.upload_cache_dir': str(tmpdir.join('upload_cache')),
+        'images.max_dimension': 64,
+        'images.jpeg_quality': 85,
+    })
+    mock_configuration.setup()
+    request.addfinalizer(mock_configuration.teardown)
+    return mock_configuration
+
+
+def make_jpeg(size, quality=100):
+    output = io.BytesIO()
+    Image.new('RGB', size, (200, 100, 50)).save(
+        output,
+        format='JPEG',
+        quality=quality,
+    )
+    return output.getvalue()
+
+
+class TestPrepareForUpload(object):
+
+    def test_large_image_is_shrunk(self, app_config):
+        # Given a mug shot larger than the maximum dimension
+        mug = make_jpeg((256, 128))
+        # When we prepare it for upload
+        result = images.prepare_for_upload(mug)
+        # Then it should fit within the maximum dimension
+        assert Image.open(io.BytesIO(result)).size == (64, 32)
+        assert len(result) < len(mug)
+
+    def test_result_is_cached(self, app_config, tmpdir):
+        mug = make_jpeg((256, 128))
+        first = images.prepare_for_upload(mug, sha1='ab' * 20)
+        assert tmpdir.join(
+            'upload_cache',
+            images._get_settings_key(),
+            'ab',
+            'ab' * 20 + '.jpg',
+        ).check()
+        # A cached result is returned even if given different data.
+        assert images.prepare_for_upload(b'', sha1='ab' * 20) == first
+
+    def test_cache_follows_settings(self, app_config):
+        # Given an image prepared with the current settings
+        mug = make_jpeg((256, 128))
+        images.prepare_for_upload(mug, sha1='ab' * 20)
+        # When the settings change
+        app_config.namespace.update_values({'images.max_dimension': 32})
+        # Then the image is prepared again with them
+        result = images.prepare_for_upload(mug, sha1='ab' * 20)
+        assert Image.open(io.BytesIO(result)).size == (32, 16)
+
+    def test_not_an_image(self, app_config):
+        assert images.prepare_for_upload(b'not an image') == b'not an image'
+
+
+def make_gradient_jpeg(reverse=False, quality=90):
+    image = Image.new('L', (64, 64))
+    image.putdata([
+        (255 - x * 4 if reverse else x * 4)
+        for y in range(64)
+        for x in range(64)
+    ])
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=quality)
+    return output.getvalue()
+
+
+class TestPerceptualHash(object):
+
+    @pytest.mark.parametrize(argnames='method', argvalues=['dhash', 'ahash'])
+    def test_reencoded_image_is_similar(self, method):
+        # Given the same photo encoded two different ways
+        first = make_gradient_jpeg(quality=90)
+        second = make_gradient_jpeg(quality=40)
+        assert first != second
+        # When we compute their perceptual hashes
+        first_hash = images.perceptual_hash(first, method=method)
+        second_hash = images.perceptual_hash(second, method=method)
+        # Then they should be (nearly) the same
+        assert len(first_hash) == 16
+        assert images.hamming_distance(first_hash, second_hash) <= 2
+
+    def test_different_images_differ(self):
+        first = images.perceptual_hash(make_gradient_jpeg())
+        second = images.perceptual_hash(make_gradient_jpeg(reverse=True))
+        assert images.hamming_distance(first, second) > 32
+
+    def test_not_an_image(self):
+        assert images.perceptual_hash(b'not an image') is None
+
+
+class TestIsSameImage(object):
+
+    def test_missing_hash(self):
+        assert not images.is_same_image('0' * 16, None)
+
+    def test_within_distance(self):
+        assert images.is_same_image('0' * 16, '0' * 15 + '7')
+        assert not images.is_same_image('0' * 16, 'f' * 16)
@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+import datetime
+
 import mock
 import pytest
 
@@ -40,3 +42,97 @@ class TestInmate(object):
         )
         # Then the list should be sorted by arrest date.
         assert sorted_list == [first, middle, last]
+
+    def test_parses_times_once(self, inmate):
+        with mock.patch(
+            'dentonpolice.timestamps.parse_arrest',
+            return_value=datetime.datetime(2012, 9, 7),
+        ) as mock_parse:
+            assert inmate.arrest_time == inmate.arrest_time
+        assert mock_parse.call_count == 1
+        # Changing the arrest time should parse the new one
+        inmate.arrest = '01/02/2015 03:04:05'
+        assert inmate.arrest_time == datetime.datetime(2015, 1, 2, 3, 4, 5)
+
+    def test_repr_does_not_hash_mug(self, inmate):
+        # Given an inmate with a mug shot
+        inmate.mug = b'image data'
+        # When we represent the inmate for a log message
+        with mock.patch('hashlib.sha1') as mock_sha1:
+            result = repr(inmate)
+        # Then the mug shot should not be hashed
+        assert not mock_sha1.called
+        assert result == (
+            "Inmate(id=134, name='SMITH, JOHN', arrest='2015/04/19 22:41:40')"
+        )
+
+    def test_verbose_repr(self, inmate):
+        inmate.mug = b'image data'
+        result = inmate.verbose_repr()
+        assert "sha1='{}'".format(inmate.sha1) in result
+        assert "charges=[{" in result
+
+    def test_hash_recomputed_for_new_mug(self, inmate):
+        inmate.mug = b'first'
+        first_sha1 = inmate.sha1
+        inmate.mug = b'second'
+        assert inmate.sha1 != first_sha1
+
+
+class TestMaybeGetUpdatedInmate(object):
+
+    @pytest.fixture
+    def past_records(self):
+        return [
+            {
+                'name': 'SMITH, JOHN',
+                'arrest': '04/19/2015 22:41:40',
+                'sha1': 'old-sha1',
+                'phash': 'ffff0000ffff0000',
+                'tweet': {
+                    'created_at': 'Sun Apr 19 22:50:00 +0000 2015',
+                    'id_str': '123',
+                },
+            },
+        ]
+
+    @pytest.fixture
+    def current(self):
+        current = inmate.Inmate(
+            id='1',
+            name='SMITH, JOHN',
+            DOB='01/01/1901',
+            arrest='04/19/2015 22:41:40',
+            seen='2015-04-19 22:42:13.123456',
+            charges=[],
+        )
+        current.mug = b'new image data'
+        return current
+
+    @pytest.mark.parametrize(
+        argnames='phash,expected_updated',
+        argvalues=[
+            # Re-encoded copy of the same photo.
+            ('ffff0000ffff0001', False),
+            # Actually a different photo.
+            ('0000ffff0000ffff', True),
+            # Unable to tell, so fall back to comparing the hash.
+            (None, True),
+        ],
+    )
+    def test_perceptual_hash(
+            self, current, past_records, phash, expected_updated):
+        # Given an inmate whose mug shot bytes changed since the last tweet
+        with mock.patch.object(
+            inmate.Inmate,
+            'phash',
+            new_callable=mock.PropertyMock,
+            return_value=phash,
+        ):
+            # When we check whether the inmate has been updated
+            result = inmate._maybe_get_updated_inmate(
+                inmate=current,
+                all_past_records=past_records,
+            )
+        # Then it depends on whether the image looks different
+        assert bool(result) == expected_updated
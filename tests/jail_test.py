@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 import datetime
 
+from dentonpolice import charges
+from dentonpolice import fakejail
 from dentonpolice import jail
 
 
@@ -10,7 +12,39 @@ class TestMakeJailReportKeyName(object):
         # Given a timestamp
         timestamp = datetime.datetime(2015, 4, 21, 17, 28, 20, 565745)
         # When we make a key-name from a timestamp
-        result = jail._make_jail_report_key_name(timestamp=timestamp)
+        result = jail.make_jail_report_key_name(timestamp=timestamp)
         # Then the value should be what we expect
         expected = 'jail_report/dentonpolice/2015/04/21/20150421172820.html'
         assert result == expected
+
+    def test_provenance(self):
+        timestamp = datetime.datetime(2015, 4, 21, 17, 28, 20, 565745)
+        result = jail.make_jail_report_key_name(
+            timestamp=timestamp,
+            provenance='othercounty',
+        )
+        expected = 'jail_report/othercounty/2015/04/21/20150421172820.html'
+        assert result == expected
+
+
+class TestMakeMugShotKeyName(object):
+
+    def test_return_value(self):
+        result = jail.make_mug_shot_key_name('abcdef0123')
+        assert result == 'mugshots/ab/cd/abcdef0123.jpg'
+
+
+class TestParseInmates(object):
+
+    def test_charges_are_normalized(self):
+        # Given a report
+        html = fakejail.make_synthetic_report(count=3)
+        # When we parse it
+        inmates = jail.parse_inmates(html)
+        # Then each charge should have its offense split out
+        for inmate in inmates:
+            for charge in inmate.charges:
+                assert charge['offense'] == charges.split_charge(
+                    charge['charge'],
+                )[1]
+                assert charge['charge'].endswith(charge['offense'])
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+import mock
+import pytest
+import staticconf.testing
+
+from dentonpolice import crawler
+from dentonpolice import fakejail
+from dentonpolice import journal
+from dentonpolice import outbox
+from dentonpolice import storage
+
+
+class TestCycleJournal(object):
+
+    @pytest.fixture
+    def location(self, tmpdir):
+        return str(tmpdir.join('cycle.json'))
+
+    def test_resumes_unfinished_cycle(self, location):
+        # Given a cycle that stopped after queueing a post
+        cycle = journal.CycleJournal(location)
+        cycle.begin('<html></html>')
+        cycle.record('mug_shots', saved={'1': 'abc'})
+        cycle.record_enqueued('new-1')
+        # When the next cycle starts
+        resumed = journal.CycleJournal(location)
+        # Then it picks up where the last one stopped
+        assert resumed.resume()
+        assert resumed.last_stage == 'mug_shots'
+        assert resumed.get('mug_shots')['saved'] == {'1': 'abc'}
+        assert resumed.enqueued == {'new-1'}
+
+    def test_finished_cycle_not_resumed(self, location):
+        cycle = journal.CycleJournal(location)
+        cycle.begin('<html></html>')
+        cycle.record('done')
+        assert not journal.CycleJournal(location).resume()
+
+    def test_old_cycle_not_resumed(self, location):
+        cycle = journal.CycleJournal(location, max_resume_age_s=60)
+        cycle.begin('<html></html>')
+        start = cycle.get('report')['time']
+        assert cycle.resume(now=start + 30)
+        assert not cycle.resume(now=start + 90)
+
+    def test_partial_line_ignored(self, location, tmpdir):
+        cycle = journal.CycleJournal(location)
+        cycle.begin('<html></html>')
+        tmpdir.join('cycle.json').write('{"stage": "mug_', mode='a')
+        resumed = journal.CycleJournal(location)
+        assert resumed.resume()
+        assert resumed.last_stage == 'report'
+
+
+class TestCrawlerResumes(object):
+
+    @pytest.fixture
+    def server(self, request):
+        server = fakejail.FakeJailServer(
+            address=('127.0.0.1', 0),
+            reports=fakejail.ReportSource(inmate_count=3, seed=1),
+        )
+        server.start_in_thread()
+        request.addfinalizer(server.server_close)
+        request.addfinalizer(server.shutdown)
+        return server
+
+    @pytest.fixture
+    def app_config(self, request, server, tmpdir):
+        mock_configuration = staticconf.testing.MockConfiguration({
+            'jail.url': server.url,
+            'minimum_report_age_s': 0,
+            'path.cycle_journal': str(tmpdir.join('cycle.json')),
+            'path.inmate_log': str(tmpdir.join('log.json')),
+            'path.most_inmate_count': str(tmpdir.join('most.txt')),
+            'path.mug_pack_dir': str(tmpdir.join('pack')),
+            'path.outbox_dir': str(tmpdir.join('outbox')),
+            'path.recent_inmate_log': str(tmpdir.join('recent.json')),
+            'path.recent_report_html': str(tmpdir.join('recent.html')),
+            'proxy.host': None,
+            'timeout.open_jail_report': 5,
+            'timeout.open_one_mug_shot': 5,
+            'twitter.enabled': True,
+            'twitter.api_key': 'journal_test_key',
+            'twitter.api_secret': 'secret',
+            'twitter.access_token': 'token',
+            'twitter.access_token_secret': 'token_secret',
+        })
+        mock_configuration.setup()
+        request.addfinalizer(mock_configuration.teardown)
+        return mock_configuration
+
+    def test_resumes_without_redoing_work(self, server, app_config):
+        # Given a cycle that crashed after queueing the first new inmate
+        calls = []
+        enqueue_mug_shot = outbox.enqueue_mug_shot
+
+        def enqueue_once(**kwargs):
+            if calls:
+                raise RuntimeError('Crashed.')
+            calls.append(kwargs['inmate'].id)
+            return enqueue_mug_shot(**kwargs)
+        with mock.patch.object(
+                outbox, 'enqueue_mug_shot', side_effect=enqueue_once):
+            with pytest.raises(RuntimeError):
+                crawler.main(bucket=None)
+        requests = server.stats['requests']
+        assert requests == 4
+        # When the next cycle runs
+        with mock.patch.object(
+                outbox,
+                'enqueue_mug_shot',
+                wraps=outbox.enqueue_mug_shot,
+        ) as mock_enqueue:
+            crawler.main(bucket=None)
+        # Then nothing is retrieved or queued again
+        assert server.stats['requests'] == requests
+        resumed_ids = [
+            call[1]['inmate'].id for call in mock_enqueue.call_args_list
+        ]
+        assert resumed_ids
+        assert calls[0] not in resumed_ids
+        # Each new inmate is queued once, besides the most inmates post
+        assert outbox.pending_count() == len(calls) + len(resumed_ids) + 1
+        # And the cycle is finished, with every inmate in the recent log
+        assert len(storage.read_log(recent=True)) == 3
+        assert not journal.CycleJournal.from_config().resume()
+
+    def test_stops_when_lease_is_lost(self, server, app_config):
+        # Given a lease that is lost once the report is retrieved
+        renew_lease = mock.Mock(return_value=False)
+        # When a cycle runs
+        crawler.main(bucket=None, renew_lease=renew_lease)
+        # Then it stops before doing anything else
+        renew_lease.assert_called_once_with()
+        assert outbox.pending_count() == 0
+        # And the next owner resumes it
+        assert journal.CycleJournal.from_config().resume()
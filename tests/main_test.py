@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from dentonpolice import fakejail
+from dentonpolice import mugpack
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Most seconds that importing the entry point may take. Generous, since
+#   it is measured in a fresh interpreter on whatever machine runs the
+#   tests, but it catches a slow import creeping back in.
+IMPORT_BUDGET_S = 1.0
+
+# Slow to import, and only needed once configured and used.
+LAZY_MODULES = ('boto', 'raven', 'twython', 'asyncio', 'numpy', 'PIL')
+
+
+def _run_python(args, cwd=ROOT, timeout=60):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    return subprocess.run(
+        [sys.executable] + args,
+        cwd=cwd,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+        timeout=timeout,
+    )
+
+
+class TestImport(object):
+
+    def test_within_budget(self):
+        # Given a fresh interpreter
+        code = (
+            'import sys, time\n'
+            'start = time.perf_counter()\n'
+            'import dentonpolice.__main__\n'
+            'print(time.perf_counter() - start)\n'
+            'print(",".join(sorted(sys.modules)))\n'
+        )
+        # When we import the entry point
+        result = _run_python(['-c', code])
+        assert result.returncode == 0, result.stdout
+        elapsed, modules = result.stdout.splitlines()[-2:]
+        # Then it should be quick
+        assert float(elapsed) < IMPORT_BUDGET_S
+        # And not import the clients it might not need
+        modules = set(modules.split(','))
+        for name in LAZY_MODULES:
+            assert name not in modules
+
+
+@pytest.fixture
+def server(request):
+    server = fakejail.FakeJailServer(
+        address=('127.0.0.1', 0),
+        reports=fakejail.ReportSource(inmate_count=3, seed=1),
+    )
+    server.start_in_thread()
+    request.addfinalizer(server.server_close)
+    request.addfinalizer(server.shutdown)
+    return server
+
+
+class TestOnce(object):
+
+    def test_crawls_once_and_exits(self, server, tmpdir):
+        # Given the default configuration, pointed at a fake jail
+        shutil.copy(os.path.join(ROOT, 'config.yaml'), str(tmpdir))
+        tmpdir.join('config-env.yaml').write(
+            'minimum_report_age_s: 0\n'
+            'jail:\n'
+            '  url: {url}\n'
+            'proxy:\n'
+            '  host: null\n'.format(url=server.url)
+        )
+        # When we run the crawler once
+        result = _run_python(['-m', 'dentonpolice', '--once'], cwd=tmpdir)
+        # Then it should exit after saving every inmate's mug shot
+        assert result.returncode == 0, result.stdout
+        assert len(mugpack.MugPack(str(tmpdir.join('mug_pack')))) == 3
+        assert server.stats['requests'] == 4
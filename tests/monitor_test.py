@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+import staticconf.testing
+
+from dentonpolice import monitor
+from dentonpolice import status
+
+
+@pytest.fixture
+def server(request, tmpdir):
+    mock_configuration = staticconf.testing.MockConfiguration({
+        'path.outbox_dir': str(tmpdir.join('outbox')),
+        'status.max_cycle_age_s': 60,
+    })
+    mock_configuration.setup()
+    request.addfinalizer(mock_configuration.teardown)
+    status.reset()
+    request.addfinalizer(status.reset)
+    server = monitor.MonitorServer(address=('127.0.0.1', 0))
+    server.start_in_thread()
+    request.addfinalizer(server.server_close)
+    request.addfinalizer(server.shutdown)
+    return server
+
+
+def _get(server, path):
+    with urllib.request.urlopen(server.url + path) as response:
+        return response.headers['Content-Type'], response.read()
+
+
+class TestMonitor(object):
+
+    def test_health(self, server):
+        with status.cycle('denton'):
+            pass
+        _, body = _get(server, 'health')
+        assert json.loads(body.decode('utf-8')) == {
+            'healthy': True,
+            'unhealthy_sites': [],
+        }
+
+    def test_unhealthy(self, server):
+        status.reset()
+        status._started -= 120
+        with status.cycle('denton') as timer:
+            timer.fail('No report.')
+        with pytest.raises(urllib.error.HTTPError) as error:
+            _get(server, 'health')
+        assert error.value.code == 503
+
+    def test_status(self, server):
+        with status.cycle('denton'):
+            pass
+        content_type, body = _get(server, 'status')
+        assert content_type.startswith('application/json')
+        assert json.loads(body.decode('utf-8'))['sites'][0]['cycles'] == 1
+
+    def test_metrics(self, server):
+        content_type, body = _get(server, 'metrics')
+        assert content_type == monitor.METRICS_CONTENT_TYPE
+        assert b'dentonpolice_up 1.0\n' in body
+
+    def test_not_found(self, server):
+        with pytest.raises(urllib.error.HTTPError) as error:
+            _get(server, 'nope')
+        assert error.value.code == 404
+
+    def test_disabled_by_default(self, server):
+        assert monitor.start_from_config() is None
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import io
+import random
+
+import pytest
+
+from dentonpolice import mugindex
+from dentonpolice import mugpack
+
+
+class TestBKTree(object):
+
+    def test_matches_brute_force(self):
+        # Given a tree of random hashes
+        rng = random.Random(0)
+        hashes = [rng.getrandbits(64) for _ in range(500)]
+        tree = mugindex.BKTree()
+        for index, hash_value in enumerate(hashes):
+            tree.add(hash_value, index)
+        query = hashes[0] ^ 0b1011
+        # When we search within a distance
+        result = tree.search(query, max_distance=20)
+        # Then it should find exactly what a full scan would
+        expected = sorted(
+            (bin(hash_value ^ query).count('1'), index)
+            for index, hash_value in enumerate(hashes)
+            if bin(hash_value ^ query).count('1') <= 20
+        )
+        assert sorted(result) == expected
+        assert result[0] == (3, 0)
+
+    def test_duplicate_hashes(self):
+        tree = mugindex.BKTree()
+        tree.add(7, 'first')
+        tree.add(7, 'second')
+        assert tree.search(7, max_distance=0) == [(0, 'first'), (0, 'second')]
+
+
+class TestMugIndex(object):
+
+    @pytest.fixture
+    def mug_dir(self, tmpdir):
+        Image = pytest.importorskip('PIL.Image')
+        for filename, reverse in [
+                ('1.jpg', False),
+                ('1_150419224140.jpg', False),
+                ('2.jpg', True),
+        ]:
+            image = Image.new('L', (32, 32))
+            image.putdata([
+                (255 - x * 8 if reverse else x * 8)
+                for y in range(32)
+                for x in range(32)
+            ])
+            output = io.BytesIO()
+            image.save(output, format='JPEG')
+            tmpdir.join('mugs', filename).write_binary(
+                output.getvalue(),
+                ensure=True,
+            )
+        return tmpdir.join('mugs')
+
+    def test_update_is_incremental(self, mug_dir, tmpdir):
+        # Given an index that has been built once
+        location = str(tmpdir.join('index.json'))
+        index = mugindex.MugIndex(location=location, mug_dir=str(mug_dir))
+        assert index.update(processes=0) == 3
+        # When a new mug shot is saved and the index is loaded and updated
+        mug_dir.join('3.jpg').write_binary(mug_dir.join('2.jpg').read_binary())
+        index = mugindex.MugIndex(location=location, mug_dir=str(mug_dir))
+        # Then only the new mug shot is hashed
+        assert index.load().update(processes=0) == 1
+        assert len(index.entries) == 4
+
+    def test_ignores_unfinished_writes(self, mug_dir, tmpdir):
+        # Given a crash while an entry was being appended
+        location = tmpdir.join('index.json')
+        mugindex.record(str(location), str(mug_dir.join('1.jpg')), 'ab' * 8)
+        location.write('{"filename": "2.j', mode='a')
+        # When the index is loaded and appended to
+        index = mugindex.MugIndex(location=str(location), mug_dir=None)
+        assert list(index.load().entries) == ['1.jpg']
+        mugindex.record(str(location), str(mug_dir.join('2.jpg')), 'cd' * 8)
+        # Then only the complete entries are read
+        assert sorted(index.load().entries) == ['1.jpg', '2.jpg']
+
+    def test_similar(self, mug_dir, tmpdir):
+        index = mugindex.MugIndex(
+            location=str(tmpdir.join('index.json')),
+            mug_dir=str(mug_dir),
+        )
+        index.update(processes=1)
+        matches = index.similar(index.phash_for('2'), max_distance=4)
+        assert [match['inmate_id'] for match in matches] == ['2']
+        matches = index.similar(index.phash_for('1'), max_distance=4)
+        assert sorted(match['filename'] for match in matches) == [
+            '1.jpg',
+            '1_150419224140.jpg',
+        ]
+
+    def test_update_from_pack(self, mug_dir, tmpdir):
+        # Given the mug shots are in a pack
+        pack = mugpack.MugPack(directory=str(tmpdir.join('pack')))
+        pack.migrate(str(mug_dir))
+        location = str(tmpdir.join('index.json'))
+        index = mugindex.MugIndex(location=location, mug_dir=None, pack=pack)
+        assert index.update(processes=0) == 3
+        # When another is added and the index is updated
+        pack.add('3', bytes(pack.read('2.jpg')))
+        index = mugindex.MugIndex(location=location, mug_dir=None, pack=pack)
+        # Then only the new one is hashed
+        assert index.load().update(processes=0) == 1
+        assert index.phash_for('3') == index.phash_for('2')
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from dentonpolice import mugpack
+
+
+@pytest.fixture
+def pack(tmpdir):
+    return mugpack.MugPack(directory=str(tmpdir.join('pack')))
+
+
+class TestMugPack(object):
+
+    def test_round_trip(self, pack):
+        name, added = pack.add('1', b'first image')
+        assert (name, added) == ('1.jpg', True)
+        assert bytes(pack.read(name)) == b'first image'
+        assert pack.latest('1') == '1.jpg'
+
+    def test_later_mug_shots_get_new_names(self, pack):
+        pack.add('1', b'first image')
+        name, added = pack.add('1', b'second image')
+        assert added
+        assert name.startswith('1_')
+        assert pack.latest('1') == name
+        assert bytes(pack.read('1.jpg')) == b'first image'
+
+    def test_same_image_not_saved_again(self, pack, tmpdir):
+        pack.add('1', b'image')
+        assert pack.add('1', b'image') == ('1.jpg', False)
+        # Even for another inmate, the bytes are only stored once
+        pack.add('2', b'image')
+        assert len(pack.blobs) == 1
+        assert tmpdir.join('pack', 'segment-000000.pack').size() == 5
+
+    def test_reloads_from_disk(self, pack, tmpdir):
+        pack.add('1', b'first image')
+        pack.add('1', b'second image')
+        reloaded = mugpack.MugPack(directory=str(tmpdir.join('pack')))
+        assert reloaded.by_inmate == pack.by_inmate
+        assert bytes(reloaded.read(reloaded.latest('1'))) == b'second image'
+
+    def test_reads_after_growing(self, pack):
+        pack.add('1', b'first image')
+        first = pack.read('1.jpg')
+        # Given the segment grows after it was mapped
+        pack.add('2', b'second image')
+        # Then both can be read
+        assert bytes(pack.read('2.jpg')) == b'second image'
+        assert bytes(first) == b'first image'
+
+    def test_starts_new_segments(self, tmpdir):
+        pack = mugpack.MugPack(
+            directory=str(tmpdir.join('pack')),
+            segment_bytes=10,
+        )
+        pack.add('1', b'123456')
+        pack.add('2', b'789012')
+        assert tmpdir.join('pack', 'segment-000001.pack').read() == '789012'
+        assert bytes(pack.read('1.jpg')) == b'123456'
+
+    def test_ignores_unfinished_writes(self, pack, tmpdir):
+        # Given a crash after writing data but before the index finished
+        pack.add('1', b'image')
+        tmpdir.join('pack', 'index.json').write('{"name": "2.j', mode='a')
+        tmpdir.join('pack', 'segment-000000.pack').write('junk', mode='a')
+        # When the pack is loaded and added to
+        reloaded = mugpack.MugPack(directory=str(tmpdir.join('pack')))
+        reloaded.add('3', b'other')
+        # Then only the complete mug shots are known
+        assert sorted(reloaded.names) == ['1.jpg', '3.jpg']
+        assert bytes(reloaded.read('3.jpg')) == b'other'
+        # Even after loading it again
+        reloaded = mugpack.MugPack(directory=str(tmpdir.join('pack')))
+        assert sorted(reloaded.names) == ['1.jpg', '3.jpg']
+        assert bytes(reloaded.read('3.jpg')) == b'other'
+
+    def test_shared_between_processes(self, pack, tmpdir):
+        # Given two processes using the same pack
+        other = mugpack.MugPack(directory=str(tmpdir.join('pack')))
+        # When each adds a mug shot of the same inmate
+        pack.add('1', b'first image')
+        name, added = other.add('1', b'second image')
+        # Then neither replaces the other's
+        assert added
+        assert name != '1.jpg'
+        assert pack.latest('1') == name
+        assert bytes(pack.read(name)) == b'second image'
+        reloaded = mugpack.MugPack(directory=str(tmpdir.join('pack')))
+        assert bytes(reloaded.read('1.jpg')) == b'first image'
+        assert bytes(reloaded.read(name)) == b'second image'
+
+    def test_migrate(self, pack, tmpdir):
+        # Given a directory of mug shots
+        mugs = tmpdir.mkdir('mugs')
+        mugs.join('1.jpg').write_binary(b'old')
+        mugs.join('1_150419224140.jpg').write_binary(b'new')
+        mugs.join('2.jpg').write_binary(b'other')
+        # When it is migrated twice
+        assert pack.migrate(str(mugs), remove=False) == 3
+        assert pack.migrate(str(mugs), remove=True) == 0
+        # Then each mug shot is in the pack under its filename
+        assert pack.latest('1') == '1_150419224140.jpg'
+        assert bytes(pack.read('1.jpg')) == b'old'
+        assert mugs.listdir() == []
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+import os
+
+import mock
+import pytest
+import staticconf.testing
+
+from dentonpolice import inmate
+from dentonpolice import outbox
+from dentonpolice import storage
+
+
+@pytest.fixture
+def app_config(request, tmpdir):
+    mock_configuration = staticconf.testing.MockConfiguration({
+        'path.inmate_log': str(tmpdir.join('log.json')),
+        'path.outbox_dir': str(tmpdir.join('outbox')),
+        'path.upload_cache_dir': str(tmpdir.join('upload_cache')),
+        'twitter.max_post_attempts': 2,
+    })
+    mock_configuration.setup()
+    request.addfinalizer(mock_configuration.teardown)
+    return mock_configuration
+
+
+@pytest.fixture
+def twitter_client():
+    client = mock.Mock(spec_set=['update_status', 'update_status_with_media'])
+    client.update_status_with_media.side_effect = lambda **kwargs: {
+        'id_str': kwargs['status'],
+    }
+    return client
+
+
+def make_inmate(inmate_id):
+    return inmate.Inmate(
+        id=inmate_id,
+        name='SMITH, JOHN',
+        DOB='01/01/1901',
+        arrest='04/19/2015 22:41:40',
+        seen='2015-04-19 22:42:13.123456',
+        charges=[],
+    )
+
+
+class TestOutbox(object):
+
+    def test_posts_in_order_and_logs(self, app_config, twitter_client):
+        # Given mug shots enqueued in order
+        for inmate_id in ['3', '1', '2']:
+            outbox.enqueue_mug_shot(
+                inmate=make_inmate(inmate_id),
+                caption='caption-' + inmate_id,
+                mug=b'mug-' + inmate_id.encode('ascii'),
+            )
+        assert outbox.pending_count() == 3
+        # When the outbox is drained
+        posted = outbox.post_pending(twitter_client)
+        # Then the posts should be made in the same order
+        assert posted == 3
+        assert [
+            call[1]['status']
+            for call in twitter_client.update_status_with_media.call_args_list
+        ] == ['caption-3', 'caption-1', 'caption-2']
+        # And the inmates should be logged with their tweet and mug hash
+        records = storage.read_log()
+        assert [record['tweet']['id_str'] for record in records] == [
+            'caption-3', 'caption-1', 'caption-2',
+        ]
+        assert all(record['sha1'] for record in records)
+        assert outbox.pending_count() == 0
+
+    def test_enqueue_is_idempotent(self, app_config):
+        assert outbox.enqueue_status(key='most-count-5', status='Record')
+        assert not outbox.enqueue_status(key='most-count-5', status='Record')
+        assert outbox.pending_count() == 1
+
+    def test_failure_is_retried_later(self, app_config, twitter_client):
+        # Given two pending posts where the first fails
+        outbox.enqueue_status(key='first', status='first')
+        outbox.enqueue_status(key='second', status='second')
+        twitter_client.update_status.side_effect = [ValueError, None]
+        # When the outbox is drained
+        posted = outbox.post_pending(twitter_client)
+        # Then the failure doesn't hold up the other post
+        assert posted == 1
+        assert twitter_client.update_status.call_count == 2
+        # And the failed post should not be retried right away
+        assert outbox.post_pending(twitter_client) == 0
+        assert outbox.pending_count() == 1
+
+    def test_posts_about_an_inmate_stay_in_order(
+            self, app_config, twitter_client):
+        # Given two posts about one inmate, and one about another
+        for inmate_id, mug in [('1', b'old'), ('1', b'new'), ('2', b'mug')]:
+            outbox.enqueue_mug_shot(
+                inmate=make_inmate(inmate_id),
+                caption='caption-{}-{}'.format(inmate_id, mug.decode()),
+                mug=mug,
+            )
+        twitter_client.update_status_with_media.side_effect = [
+            ValueError,
+            {'id_str': 'caption-2-mug'},
+        ]
+        # When the first post fails
+        posted = outbox.post_pending(twitter_client)
+        # Then only the post about the other inmate is made
+        assert posted == 1
+        assert [
+            call[1]['status']
+            for call in twitter_client.update_status_with_media.call_args_list
+        ] == ['caption-1-old', 'caption-2-mug']
+        assert outbox.pending_count() == 2
+
+    def test_rejected_post_set_aside(self, app_config, twitter_client, tmpdir):
+        # Given a post that Twitter rejects as a duplicate
+        outbox.enqueue_status(key='first', status='first')
+        error = Exception('Status is a duplicate.')
+        error.error_code = 403
+        twitter_client.update_status.side_effect = error
+        # When the outbox is drained
+        outbox.post_pending(twitter_client)
+        # Then it is set aside at once
+        assert outbox.pending_count() == 0
+        assert os.listdir(str(tmpdir.join('outbox', 'failed'))) != []
+
+    def test_gives_up_after_max_attempts(
+            self, app_config, twitter_client, tmpdir):
+        # Given a post that always fails
+        outbox.enqueue_mug_shot(
+            inmate=make_inmate('1'),
+            caption='caption',
+            mug=b'mug',
+        )
+        twitter_client.update_status_with_media.side_effect = ValueError
+        # When it has been attempted the maximum number of times
+        with mock.patch.object(outbox.time, 'time', return_value=0):
+            outbox.post_pending(twitter_client)
+        outbox.post_pending(twitter_client)
+        # Then it should be set aside
+        assert outbox.pending_count() == 0
+        assert len(os.listdir(str(tmpdir.join('outbox', 'failed')))) == 2
+        # And the inmate should still be logged, without a tweet
+        assert [record['tweet'] for record in storage.read_log()] == [None]
+
+    def test_post_claimed_by_another_node(self, app_config, twitter_client):
+        # Given a post that another node has already claimed
+        outbox.enqueue_status(key='most-count-5', status='Record')
+        coordinator = mock.Mock(spec_set=[
+            'claim_post',
+            'finish_post',
+            'release_post',
+        ])
+        coordinator.claim_post.return_value = False
+        # When the outbox is drained
+        posted = outbox.post_pending(twitter_client, coordinator=coordinator)
+        # Then the post should be dropped instead of made
+        assert posted == 0
+        assert not twitter_client.update_status.called
+        assert outbox.pending_count() == 0
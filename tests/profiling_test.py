@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import time
+import tracemalloc
+
+import staticconf.testing
+
+from dentonpolice import profiling
+
+
+def busy_cycle():
+    deadline = time.monotonic() + 0.05
+    inmates = []
+    while time.monotonic() < deadline:
+        inmates.append({'name': 'DOE, JANE', 'charges': []})
+    profiling.checkpoint('inmates')
+    return inmates
+
+
+class TestCycleProfiler(object):
+
+    def test_disabled_by_default(self):
+        with staticconf.testing.MockConfiguration({}):
+            assert profiling.CycleProfiler.from_config() is None
+
+    def test_cli_overrides_config(self):
+        with staticconf.testing.MockConfiguration({'profiling.cycles': 0}):
+            profiler = profiling.CycleProfiler.from_config(cycles=2)
+        assert profiler.remaining == 2
+
+    def test_profiles_only_the_requested_cycles(self, tmpdir):
+        # Given a profiler of one cycle, with every option enabled
+        profiler = profiling.CycleProfiler(
+            directory=str(tmpdir),
+            cycles=1,
+            sample_interval_s=0.005,
+            memory=True,
+        )
+        # When two cycles are run
+        with profiler.profile('dentonpolice'):
+            busy_cycle()
+        with profiler.profile('dentonpolice'):
+            busy_cycle()
+        # Then only the first is profiled
+        assert sorted(path.basename for path in tmpdir.listdir()) == [
+            '0001-dentonpolice-end-memory.txt',
+            '0001-dentonpolice-end.snapshot',
+            '0001-dentonpolice-inmates-memory.txt',
+            '0001-dentonpolice-inmates.snapshot',
+            '0001-dentonpolice.folded',
+            '0001-dentonpolice.prof',
+            '0001-dentonpolice.txt',
+        ]
+        assert 'busy_cycle' in tmpdir.join('0001-dentonpolice.txt').read()
+        assert 'busy_cycle' in tmpdir.join('0001-dentonpolice.folded').read()
+        assert 'profiling_test.py' in tmpdir.join(
+            '0001-dentonpolice-inmates-memory.txt',
+        ).read()
+
+    def test_peak_left_out_without_reset(self, request, tmpdir):
+        # Given memory already traced, by a Python that can't reset the
+        #   peak (before 3.9)
+        reset_peak = getattr(tracemalloc, 'reset_peak', None)
+        if reset_peak is not None:
+            del tracemalloc.reset_peak
+            request.addfinalizer(
+                lambda: setattr(tracemalloc, 'reset_peak', reset_peak),
+            )
+        tracemalloc.start()
+        request.addfinalizer(tracemalloc.stop)
+        profiler = profiling.CycleProfiler(
+            directory=str(tmpdir),
+            cycles=1,
+            memory=True,
+        )
+        # When a cycle is profiled
+        with profiler.profile('dentonpolice'):
+            busy_cycle()
+        # Then the peak, which may be from before the cycle, isn't given
+        summary = tmpdir.join('0001-dentonpolice-end-memory.txt').read()
+        assert summary.startswith('Traced ')
+        assert 'at most' not in summary
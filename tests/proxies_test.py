@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import mock
+import pytest
+import staticconf.testing
+
+from dentonpolice import proxies
+
+
+@pytest.fixture
+def pool():
+    return proxies.ProxyPool(
+        addresses=['127.0.0.1:8123', '127.0.0.1:8124'],
+        slow_s=10,
+        degraded_s=60,
+        seed=0,
+    )
+
+
+def pool_acquire(pool, proxy):
+    """Mark a particular proxy as in use, as if `acquire` chose it."""
+    proxy.in_flight += 1
+    return proxy
+
+
+class TestProxyPool(object):
+
+    def test_requires_a_proxy(self):
+        with pytest.raises(ValueError):
+            proxies.ProxyPool(addresses=[])
+
+    def test_prefers_lower_latency(self, pool):
+        # Given one proxy is measured faster than the other
+        fast, slow = pool.proxies
+        pool.release(pool_acquire(pool, fast), elapsed_s=1, ok=True)
+        pool.release(pool_acquire(pool, slow), elapsed_s=5, ok=True)
+        # Then requests should go to the faster one
+        assert pool.acquire() is fast
+
+    def test_spreads_concurrent_requests(self, pool):
+        # Given both proxies are equally fast
+        for proxy in pool.proxies:
+            pool.release(pool_acquire(pool, proxy), elapsed_s=1, ok=True)
+        # When two requests are in flight at once
+        first = pool.acquire()
+        second = pool.acquire()
+        # Then they should use different proxies
+        assert first is not second
+
+    def test_failure_degrades(self, pool):
+        # Given a request through one proxy failed
+        bad, good = pool.proxies
+        pool.release(pool_acquire(pool, bad), elapsed_s=1, ok=False)
+        # Then it should be avoided, even if it would otherwise be best
+        good.latency_s = 100
+        for _ in range(5):
+            proxy = pool.acquire()
+            assert proxy is good
+            pool.release(proxy, elapsed_s=1, ok=True)
+
+    def test_slow_request_degrades(self, pool):
+        slow, _ = pool.proxies
+        pool.release(pool_acquire(pool, slow), elapsed_s=11, ok=True)
+        assert slow.is_degraded(now=slow.degraded_until - 1)
+
+    def test_uses_degraded_if_nothing_else(self, pool):
+        first, second = pool.proxies
+        with mock.patch('time.monotonic', return_value=1000):
+            pool.release(pool_acquire(pool, first), elapsed_s=1, ok=False)
+        pool.release(pool_acquire(pool, second), elapsed_s=1, ok=False)
+        # The one that recovers soonest is used.
+        assert pool.acquire() is first
+
+
+class TestGetPool(object):
+
+    def test_no_proxy(self):
+        with staticconf.testing.MockConfiguration({'proxy.host': None}):
+            assert proxies.get_pool() is None
+
+    def test_single_proxy(self):
+        with staticconf.testing.MockConfiguration({
+            'proxy.host': '127.0.0.1',
+            'proxy.port': 8123,
+        }):
+            pool = proxies.get_pool()
+            assert [proxy.address for proxy in pool.proxies] == [
+                '127.0.0.1:8123',
+            ]
+            # The same pool is kept, along with its measurements.
+            assert proxies.get_pool() is pool
+
+    def test_pool(self):
+        with staticconf.testing.MockConfiguration({
+            'proxy.host': '127.0.0.1',
+            'proxy.port': 8123,
+            'proxy.pool': ['127.0.0.1:9001', '127.0.0.1:9002'],
+        }, flatten=False):
+            pool = proxies.get_pool()
+        assert len(pool) == 2
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+import datetime
+import time
+import urllib.error
+
+import pytest
+import staticconf.testing
+
+from dentonpolice import archive
+from dentonpolice import config
+from dentonpolice import fakejail
+from dentonpolice import jail
+from dentonpolice import mugpack
+from dentonpolice import replay
+
+
+@pytest.fixture
+def app_config(request, tmpdir):
+    mock_configuration = staticconf.testing.MockConfiguration({
+        'minimum_report_age_s': 0,
+        'jail.mug_shot_downloads': 1,
+        'path.cycle_journal': 'cycle.json',
+        'path.inmate_log': 'log.json',
+        'path.most_inmate_count': 'most.txt',
+        'path.mug_pack_dir': 'pack',
+        'path.outbox_dir': str(tmpdir.join('outbox')),
+        'path.recent_inmate_log': 'recent.json',
+        'path.recent_report_html': 'recent.html',
+        'path.upload_cache_dir': str(tmpdir.join('upload_cache')),
+        'proxy.host': None,
+        'timeout.open_jail_report': 5,
+        'timeout.open_one_mug_shot': 5,
+    })
+    mock_configuration.setup()
+    request.addfinalizer(mock_configuration.teardown)
+    return mock_configuration
+
+
+@pytest.fixture
+def source(tmpdir):
+    """Three reports, the later two with three more inmates."""
+    source = archive.LocalArchive(str(tmpdir.join('archive')))
+    start = datetime.datetime(2015, 4, 21, 8, 0, 0)
+    for index, count in enumerate([5, 8, 8]):
+        source.put(
+            jail.make_jail_report_key_name(
+                timestamp=start + datetime.timedelta(minutes=5 * index),
+            ),
+            fakejail.make_synthetic_report(count=count).encode('utf-8'),
+        )
+    return source
+
+
+def make_site(tmpdir, name, mugs=None):
+    return replay.ReplaySite(
+        name='dentonpolice',
+        storage_dir=str(tmpdir.join(name)),
+        mugs=mugs,
+    )
+
+
+class TestListReports(object):
+
+    def test_oldest_first(self, source):
+        keys = replay.list_reports(source, 'dentonpolice')
+        assert [key[-11:-5] for key in keys] == [
+            '080000', '080500', '081000',
+        ]
+
+    def test_since_and_limit(self, source):
+        keys = replay.list_reports(
+            source,
+            'dentonpolice',
+            since='201504210805',
+            limit=1,
+        )
+        assert [key[-11:-5] for key in keys] == ['080500']
+
+
+class TestReplaySite(object):
+
+    def test_mug_shot_saved_by_then(self, tmpdir):
+        pack = mugpack.MugPack(str(tmpdir.join('pack')))
+        pack.add('1', b'first')
+        pack.add('1', b'second', name='1_150421080433.jpg')
+        site = make_site(tmpdir, 'replay', mugs=pack)
+        url = jail.make_mug_shot_url(base_url=site.url, inmate_id='1')
+        saved = time.mktime((2015, 4, 21, 8, 4, 33, 0, 0, -1))
+        site.time = saved - 1
+        assert site.fetch(url, seconds=1) == b'first'
+        site.time = saved
+        assert site.fetch(url, seconds=1) == b'second'
+
+    def test_missing_mug_shot(self, tmpdir):
+        pack = mugpack.MugPack(str(tmpdir.join('pack')))
+        site = make_site(tmpdir, 'replay', mugs=pack)
+        site.time = 0
+        with pytest.raises(urllib.error.HTTPError):
+            site.fetch(
+                jail.make_mug_shot_url(base_url=site.url, inmate_id='1'),
+                seconds=1,
+            )
+
+
+class TestRun(object):
+
+    def test_replays_each_report(self, app_config, source, tmpdir):
+        keys = replay.list_reports(source, 'dentonpolice')
+        result = replay.run(source, keys, make_site(tmpdir, 'first'))
+        # The first report only primes the replay
+        assert result.cycles == 2
+        assert result.cycles_per_s > 0
+        assert set(result.stage_totals_s) >= {'report', 'mug_shots', 'post'}
+        # Each inmate is tweeted about once, since there are no records
+        #   of earlier tweets, and the third report adds no one
+        assert result.posted
+        assert set(result.posted.values()) == {1}
+        assert result.recorded is None
+        assert result.differences() == {}
+
+    def test_compares_with_recorded_tweets(self, app_config, source, tmpdir):
+        # Given the inmate log of an earlier replay
+        keys = replay.list_reports(source, 'dentonpolice')
+        first = make_site(tmpdir, 'first')
+        replay.run(source, keys, first)
+        recorded = replay._read_records(
+            str(tmpdir.join('first', 'log.json')),
+        )
+        # When the same reports are replayed
+        result = replay.run(
+            source,
+            keys,
+            make_site(tmpdir, 'second'),
+            recorded=recorded,
+        )
+        # Then the same inmates are tweeted about
+        assert result.recorded == result.posted
+        assert result.differences() == {}
+        # But any difference is found
+        recorded.append(dict(recorded[-1], id='1'))
+        result = replay.run(
+            source,
+            keys,
+            make_site(tmpdir, 'third'),
+            recorded=recorded,
+        )
+        assert result.differences() == {'1': (0, 1)}
+        assert '1: replayed 0, recorded 1' in result.summary()
+
+
+class TestConfigure(object):
+
+    def test_every_path_in_scratch_directory(self, app_config, tmpdir):
+        # Given absolute paths to the crawler's files
+        app_config.namespace.update_values({
+            'path.inmate_log': str(tmpdir.join('live', 'log.json')),
+            'path.report_archive_dir': str(tmpdir.join('live', 'reports')),
+        })
+        scratch = str(tmpdir.join('scratch'))
+        # When the replay is configured
+        replay._configure(scratch)
+        # Then none of them are used
+        with config.site_root(scratch):
+            for name in ['inmate_log', 'mug_pack_dir', 'outbox_dir']:
+                assert config.get_path(name).startswith(scratch)
+            assert config.get_path('report_archive_dir') is None
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import urllib.error
+
+import mock
+import pytest
+
+from dentonpolice import retry
+
+
+def _http_error(code):
+    return urllib.error.HTTPError(
+        url='http://example.com/', code=code, msg='', hdrs=None, fp=None,
+    )
+
+
+class TestIsRetryable(object):
+
+    @pytest.mark.parametrize(
+        argnames='error,expected',
+        argvalues=[
+            (_http_error(503), True),
+            (_http_error(429), True),
+            (_http_error(404), False),
+            (urllib.error.URLError('refused'), True),
+            (TimeoutError(), True),
+            (ValueError(), False),
+        ],
+    )
+    def test_classification(self, error, expected):
+        assert retry.is_retryable(error) == expected
+
+
+class TestBackoff(object):
+
+    def test_jittered_and_capped(self):
+        backoff = retry.Backoff(base_s=1, max_s=5, seed=0)
+        for attempt in range(1, 10):
+            delay = backoff.delay(attempt)
+            assert 0 <= delay <= min(5, 2 ** (attempt - 1))
+
+
+class TestCircuitBreaker(object):
+
+    def test_opens_after_threshold(self):
+        breaker = retry.CircuitBreaker(failure_threshold=2, reset_s=60)
+        breaker.record_failure()
+        assert breaker.allow()
+        breaker.record_failure()
+        assert not breaker.allow()
+
+    def test_success_resets_count(self):
+        breaker = retry.CircuitBreaker(failure_threshold=2, reset_s=60)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        assert breaker.allow()
+
+    def test_half_open_allows_one_trial(self):
+        # Given a circuit that opened long enough ago
+        breaker = retry.CircuitBreaker(failure_threshold=1, reset_s=0)
+        breaker.record_failure()
+        # Then only one trial request should be let through
+        assert breaker.allow()
+        assert not breaker.allow()
+        # And if it fails the circuit should stay open
+        breaker.record_failure()
+        assert breaker.is_open
+        # But if the next trial works it should close
+        assert breaker.allow()
+        breaker.record_success()
+        assert not breaker.is_open
+
+
+class TestCall(object):
+
+    def test_retries_until_success(self):
+        func = mock.Mock(side_effect=[TimeoutError(), TimeoutError(), 'ok'])
+        sleep = mock.Mock()
+        result = retry.call(
+            func, attempts=3, backoff=retry.Backoff(seed=0), sleep=sleep,
+        )
+        assert result == 'ok'
+        assert func.call_count == 3
+        assert sleep.call_count == 2
+
+    def test_raises_last_error(self):
+        func = mock.Mock(side_effect=TimeoutError())
+        with pytest.raises(TimeoutError):
+            retry.call(func, attempts=2, sleep=mock.Mock())
+        assert func.call_count == 2
+
+    def test_does_not_retry_client_error(self):
+        func = mock.Mock(side_effect=_http_error(404))
+        with pytest.raises(urllib.error.HTTPError):
+            retry.call(func, attempts=3, sleep=mock.Mock())
+        assert func.call_count == 1
+
+    def test_open_circuit_makes_no_request(self):
+        breaker = retry.CircuitBreaker(failure_threshold=1, reset_s=60)
+        func = mock.Mock(side_effect=TimeoutError())
+        with pytest.raises(retry.CircuitOpenError):
+            retry.call(func, breaker=breaker, attempts=5, sleep=mock.Mock())
+        assert func.call_count == 1
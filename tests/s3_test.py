@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+import mock
+import staticconf.testing
+
+from dentonpolice import s3
+
+
+class TestGetBucket(object):
+
+    def test_not_configured(self):
+        with staticconf.testing.MockConfiguration({}):
+            assert s3.get_bucket() is None
+
+    def test_connects_on_first_use(self):
+        # Given a configured bucket
+        with staticconf.testing.MockConfiguration({
+            'aws.s3.region': 'us-west-2',
+            'aws.s3.bucket': 'reports',
+        }):
+            with mock.patch(
+                'boto.s3.connect_to_region',
+                autospec=True,
+            ) as mock_connect:
+                bucket = s3.get_bucket()
+                # Then it shouldn't connect until the bucket is used
+                assert not mock_connect.called
+                name = bucket.name
+                bucket.new_key('example')
+        # And then only once
+        mock_connect.assert_called_once_with(region_name='us-west-2')
+        real_bucket = mock_connect.return_value.get_bucket.return_value
+        mock_connect.return_value.get_bucket.assert_called_once_with(
+            bucket_name='reports',
+        )
+        assert name is real_bucket.name
+        real_bucket.new_key.assert_called_once_with('example')
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+import mock
+import pytest
+import staticconf.testing
+
+from dentonpolice import crawler
+from dentonpolice import fakejail
+from dentonpolice import scheduler
+from dentonpolice import sites
+
+
+@pytest.fixture
+def servers(request):
+    servers = []
+    for seed in (1, 2):
+        server = fakejail.FakeJailServer(
+            address=('127.0.0.1', 0),
+            reports=fakejail.ReportSource(inmate_count=3 * seed, seed=seed),
+        )
+        server.start_in_thread()
+        request.addfinalizer(server.server_close)
+        request.addfinalizer(server.shutdown)
+        servers.append(server)
+    return servers
+
+
+@pytest.fixture
+def app_config(request, tmpdir):
+    mock_configuration = staticconf.testing.MockConfiguration({
+        'minimum_report_age_s': 0,
+        'path.inmate_log': 'log.json',
+        'path.most_inmate_count': 'most.txt',
+        'path.mug_shot_dir': 'mugs',
+        'path.recent_inmate_log': 'recent.json',
+        'path.recent_report_html': 'recent.html',
+        'proxy.host': None,
+        'timeout.open_jail_report': 5,
+        'timeout.open_one_mug_shot': 5,
+    })
+    mock_configuration.setup()
+    request.addfinalizer(mock_configuration.teardown)
+    return mock_configuration
+
+
+class TestScheduler(object):
+
+    def test_sites_are_crawled_into_their_own_storage(
+            self, servers, app_config, tmpdir):
+        # Given two sites with their own storage directories
+        site_list = [
+            sites.DentonSite(
+                name='site-{}'.format(index),
+                url=server.url,
+                storage_dir=str(tmpdir.join('site-{}'.format(index))),
+            )
+            for index, server in enumerate(servers)
+        ]
+        # When they are checked
+        scheduler.Scheduler(sites=site_list, bucket=None).run_once()
+        # Then each site's mug shots are stored separately
+        for index, server in enumerate(servers):
+            site_dir = tmpdir.join('site-{}'.format(index))
+            inmate_count = server.stats['requests'] - 1
+            assert len(site_dir.join('mugs').listdir()) == inmate_count
+            assert site_dir.join('recent.html').check()
+
+    def test_due_sites_only(self):
+        # Given one site that was just checked and one that is due
+        site_list = [
+            sites.Site(name='recent', url='', min_seconds_between_checks=60),
+            sites.Site(name='due', url=''),
+        ]
+        instance = scheduler.Scheduler(sites=site_list, bucket=None)
+        with mock.patch.object(crawler, 'main', autospec=True) as mock_main:
+            instance.run_once()
+            mock_main.reset_mock()
+            instance._next_check['due'] = 0
+            # When we start the checks that are pending
+            futures = instance.run_pending()
+            for future in futures:
+                future.result()
+        # Then only the due site should be checked
+        mock_main.assert_called_once_with(
+            bucket=None,
+            site=site_list[1],
+            renew_lease=None,
+        )
+
+    def test_error_is_isolated(self):
+        site_list = [
+            sites.Site(name='broken', url=''),
+            sites.Site(name='working', url=''),
+        ]
+        checked = []
+
+        def fake_main(bucket, site, renew_lease):
+            if site.name == 'broken':
+                raise ValueError
+            checked.append(site.name)
+        with mock.patch.object(crawler, 'main', side_effect=fake_main):
+            scheduler.Scheduler(sites=site_list, bucket=None).run_once()
+        assert checked == ['working']
+
+    def test_lease_acquired_without_lock(self):
+        # Given a coordinator that checks the scheduler isn't locked
+        site_list = [sites.Site(name='site', url='')]
+        instance = scheduler.Scheduler(
+            sites=site_list,
+            bucket=None,
+            coordinator=mock.Mock(),
+        )
+        locked = []
+        instance.coordinator.acquire_site.side_effect = (
+            lambda name: locked.append(instance._lock.locked()) or True
+        )
+        with mock.patch.object(crawler, 'main', autospec=True):
+            instance.run_once()
+        assert locked == [False]
+
+    def test_failed_release_is_rescheduled(self):
+        # Given a coordinator that can't release the lease
+        site_list = [sites.Site(name='site', url='')]
+        instance = scheduler.Scheduler(
+            sites=site_list,
+            bucket=None,
+            coordinator=mock.Mock(),
+        )
+        instance.coordinator.acquire_site.return_value = True
+        instance.coordinator.release_site.side_effect = OSError
+        with mock.patch.object(crawler, 'main', autospec=True) as mock_main:
+            # When it is checked twice
+            instance.run_once()
+            instance.run_once()
+        # Then it is still checked the second time
+        assert mock_main.call_count == 2
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import importlib
+import sys
+
+import mock
+import pytest
+
+from dentonpolice import serialization
+
+
+@pytest.fixture
+def without_orjson(request):
+    """Reload the module as if orjson weren't installed."""
+    with mock.patch.dict(sys.modules, {'orjson': None}):
+        importlib.reload(serialization)
+    request.addfinalizer(lambda: importlib.reload(serialization))
+    return serialization
+
+
+class TestStandardLibraryFallback(object):
+
+    def test_uses_json(self, without_orjson):
+        assert without_orjson.BACKEND == 'json'
+
+    def test_loads_byte_strings(self, without_orjson):
+        assert without_orjson.loads(b'{"name": "DOE, JANE"}') == {
+            'name': 'DOE, JANE',
+        }
+        assert without_orjson.loads(memoryview(b'[1]')) == [1]
+        assert without_orjson.loads('[1]') == [1]
+
+    def test_round_trip(self, without_orjson):
+        record = {'id': '1', 'charges': [{'charge': 'PUBLIC INTOX'}]}
+        assert without_orjson.loads(without_orjson.dumps(record)) == record
+
+    def test_reads_log_lines(self, without_orjson):
+        read = without_orjson.make_reader(fields=['name'])
+        assert read(b'{"id": "1", "name": "DOE, JANE"}\n') == {
+            'name': 'DOE, JANE',
+        }
+
+
+class TestMakeReader(object):
+
+    def test_all_fields_by_default(self):
+        read = serialization.make_reader()
+        assert read(b'{"id": "1", "name": "DOE, JANE"}\n') == {
+            'id': '1',
+            'name': 'DOE, JANE',
+        }
+
+    def test_only_requested_fields(self):
+        # Given a reader for only some of the fields
+        read = serialization.make_reader(fields=['name', 'sha1'])
+        # When we read a record
+        result = read(b'{"id": "1", "name": "DOE, JANE", "charges": []}')
+        # Then only the requested fields that exist should be kept
+        assert result == {'name': 'DOE, JANE'}
+
+    def test_only_requested_tweet_fields(self):
+        read = serialization.make_reader(tweet_fields=['id_str'])
+        result = read(b'{"id": "1", "tweet": {"id_str": "9", "user": {}}}')
+        assert result == {'id': '1', 'tweet': {'id_str': '9'}}
+
+    def test_shares_repeated_values(self):
+        # Given a reader that shares values between records
+        read = serialization.make_reader(interner=serialization.Interner())
+        line = (
+            b'{"name": "DOE, JANE", "charges": [{"charge": "DPD / THEFT"}],'
+            b' "tweet": {"user": {"screen_name": "dentonpolice"}}}'
+        )
+        # When we read the same values twice
+        first, second = read(line), read(line)
+        # Then they should be equal and the same objects
+        assert first == second
+        assert first['name'] is second['name']
+        assert first['charges'][0] is second['charges'][0]
+        assert (
+            first['tweet']['user']['screen_name'] is
+            second['tweet']['user']['screen_name']
+        )
+
+
+class TestDumps(object):
+
+    def test_round_trip(self):
+        data = {'name': 'DOE, JANE', 'charges': [{'amount': '$1.00'}]}
+        assert serialization.loads(serialization.dumps(data)) == data
+
+    def test_returns_text(self):
+        assert isinstance(serialization.dumps({'a': 1}), str)
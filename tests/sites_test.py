@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import pytest
+import staticconf.testing
+
+from dentonpolice import sites
+
+
+@pytest.fixture
+def app_config(request):
+    mock_configuration = staticconf.testing.MockConfiguration({
+        'jail.url': 'http://example.com/jail/',
+    })
+    mock_configuration.setup()
+    request.addfinalizer(mock_configuration.teardown)
+    return mock_configuration
+
+
+class TestLoadSites(object):
+
+    def test_default_site(self, app_config):
+        (site,) = sites.load_sites()
+        assert site.name == 'dentonpolice'
+        assert site.storage_dir == ''
+        assert site.get_mug_shot_url('12') == (
+            'http://example.com/jail/ImageHandler.ashx?type=image&imageID=12'
+        )
+
+    def test_configured_sites(self, app_config):
+        app_config.namespace.update_values({'sites': [
+            {'name': 'first', 'adapter': 'denton', 'url': 'http://a/'},
+            {
+                'name': 'second',
+                'adapter': 'denton',
+                'url': 'http://b/',
+                'storage_dir': 'second',
+                'tweet_params': {'lat': 1.5},
+            },
+        ]})
+        first, second = sites.load_sites()
+        assert (first.name, first.url) == ('first', 'http://a/')
+        assert second.storage_dir == 'second'
+        assert second.tweet_params == {'lat': 1.5}
+
+    def test_unknown_adapter(self, app_config):
+        app_config.namespace.update_values({'sites': [
+            {'name': 'first', 'adapter': 'nowhere', 'url': 'http://a/'},
+        ]})
+        with pytest.raises(ValueError):
+            sites.load_sites()
+
+    def test_duplicate_names(self, app_config):
+        app_config.namespace.update_values({'sites': [
+            {'name': 'same', 'adapter': 'denton', 'url': 'http://a/'},
+            {'name': 'same', 'adapter': 'denton', 'url': 'http://b/'},
+        ]})
+        with pytest.raises(ValueError):
+            sites.load_sites()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import pytest
+import staticconf.testing
+
+from dentonpolice import outbox
+from dentonpolice import status
+
+
+@pytest.fixture
+def app_config(request, tmpdir):
+    mock_configuration = staticconf.testing.MockConfiguration({
+        'path.outbox_dir': str(tmpdir.join('outbox')),
+        'proxy.pool': ['127.0.0.1:8123'],
+        'status.max_cycle_age_s': 60,
+    })
+    mock_configuration.setup()
+    request.addfinalizer(mock_configuration.teardown)
+    status.reset()
+    request.addfinalizer(status.reset)
+    return mock_configuration
+
+
+class TestCycle(object):
+
+    def test_records_stages(self, app_config):
+        # When a cycle finishes its stages
+        with status.cycle('denton') as timer:
+            timer.lap('report')
+            timer.lap('mug_shots')
+        status.set_inmate_count('denton', 42)
+        # Then each is timed, and the cycle counts as successful
+        site, = status.snapshot()['sites']
+        assert site['cycles'] == 1
+        assert site['failures'] == 0
+        assert site['last_success'] is not None
+        assert site['inmate_count'] == 42
+        assert list(site['stage_durations_s']) == ['report', 'mug_shots']
+
+    def test_records_failures(self, app_config):
+        with pytest.raises(ValueError):
+            with status.cycle('denton'):
+                raise ValueError('bad report')
+        with status.cycle('denton') as timer:
+            timer.fail('No report.')
+        site, = status.snapshot()['sites']
+        assert site['failures'] == 2
+        assert site['last_success'] is None
+        assert site['last_error'] == 'No report.'
+
+
+class TestHealth(object):
+
+    def test_stale_site_is_unhealthy(self, app_config):
+        with status.cycle('denton'):
+            pass
+        now = status.snapshot()['time']
+        assert status.unhealthy_sites(now=now + 30) == []
+        assert status.unhealthy_sites(now=now + 90) == ['denton']
+        assert not status.snapshot(now=now + 90)['healthy']
+
+
+class TestSnapshot(object):
+
+    def test_outbox_and_proxies(self, app_config):
+        outbox.enqueue(key='a', entry={'kind': 'status'}, mug=b'mug')
+        outbox.enqueue(key='b', entry={'kind': 'status'})
+        state = status.snapshot()
+        assert state['outbox'] == {'posts': 2, 'uploads': 1}
+        proxy, = state['proxies']
+        assert proxy['address'] == '127.0.0.1:8123'
+        assert not proxy['degraded']
+
+    def test_cache_hit_rates(self, app_config):
+        from dentonpolice import timestamps
+        timestamps.parse_date.cache_clear()
+        timestamps.parse_date('11/26/1988')
+        timestamps.parse_date('11/26/1988')
+        caches = status.snapshot()['caches']
+        assert caches['parse_date'] == {
+            'hits': 1,
+            'misses': 1,
+            'hit_rate': 0.5,
+        }
+
+
+class TestMetrics(object):
+
+    def test_text_format(self, app_config):
+        with status.cycle('denton') as timer:
+            timer.lap('report')
+        status.set_inmate_count('denton', 42)
+        lines = status.metrics().splitlines()
+        assert '# TYPE dentonpolice_cycles_total counter' in lines
+        assert 'dentonpolice_cycles_total{site="denton"} 1.0' in lines
+        assert 'dentonpolice_inmates{site="denton"} 42.0' in lines
+        assert any(
+            line.startswith(
+                'dentonpolice_stage_duration_seconds'
+                '{site="denton",stage="report"} ',
+            )
+            for line in lines
+        )
+        assert 'dentonpolice_up 1.0' in lines
+
+    def test_escapes_labels(self):
+        assert status._format_metric('m', {'site': 'a"b\\'}, 1) == (
+            'm{site="a\\"b\\\\"} 1.0'
+        )
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+import os
+
+import mock
+import pytest
+import staticconf.testing
+
+from dentonpolice import inmate
+from dentonpolice import storage
+
+
+@pytest.fixture
+def app_config(request, tmpdir):
+    mock_configuration = staticconf.testing.MockConfiguration({
+        'path.inmate_log': str(tmpdir.join('log.json')),
+        'path.most_inmate_count': str(tmpdir.join('most.txt')),
+        'path.recent_inmate_log': str(tmpdir.join('recent.json')),
+    })
+    mock_configuration.setup()
+    request.addfinalizer(mock_configuration.teardown)
+    return mock_configuration
+
+
+def make_inmate(inmate_id):
+    return inmate.Inmate(
+        id=inmate_id,
+        name='SMITH, JOHN',
+        DOB='01/01/1901',
+        arrest='04/19/2015 22:41:40',
+        seen='2015-04-19 22:42:13.123456',
+        charges=[],
+    )
+
+
+class TestLogInmates(object):
+
+    def test_recent_log_is_replaced(self, app_config):
+        # Given a recent log from a previous check
+        storage.log_inmates([make_inmate('1'), make_inmate('2')], recent=True)
+        # When we log the inmates from the current check
+        storage.log_inmates([make_inmate('3')], recent=True)
+        # Then only the current inmates should be in the recent log
+        assert [data['id'] for data in storage.read_log(recent=True)] == ['3']
+
+    def test_main_log_is_appended(self, app_config):
+        storage.log_inmates([make_inmate('1')])
+        storage.log_inmates([make_inmate('2')])
+        assert [data['id'] for data in storage.read_log()] == ['1', '2']
+
+    def test_crash_keeps_previous_recent_log(self, app_config, tmpdir):
+        # Given a recent log from a previous check
+        storage.log_inmates([make_inmate('1')], recent=True)
+        # When the process fails while replacing the recent log
+        with mock.patch.object(os, 'replace', side_effect=OSError):
+            with pytest.raises(OSError):
+                storage.log_inmates([make_inmate('2')], recent=True)
+        # Then the previous recent log should be intact
+        assert [data['id'] for data in storage.read_log(recent=True)] == ['1']
+        # And no temporary files should be left behind
+        assert sorted(os.listdir(str(tmpdir))) == ['recent.json']
+
+
+class TestMostInmatesCount(object):
+
+    def test_round_trip(self, app_config):
+        storage.log_most_inmates_count(42)
+        most_count, on_date = storage.get_most_inmates_count()
+        assert most_count == 42
+        assert on_date
+
+
+class TestMugShotPack(object):
+
+    @pytest.fixture
+    def pack_config(self, app_config, tmpdir):
+        app_config.namespace.update_values({
+            'path.mug_pack_dir': str(tmpdir.join('pack')),
+        })
+
+    def test_most_recent_mug(self, pack_config):
+        # Given an inmate whose mug shot changed
+        subject = make_inmate('1')
+        assert storage.most_recent_mug(subject) == ''
+        subject.mug = b'old'
+        storage.save_mug_shots([subject])
+        subject.mug = b'new'
+        storage.save_mug_shots([subject, make_inmate('2')])
+        # Then the newest is read back from the pack
+        name = storage.most_recent_mug(subject)
+        assert name.startswith('1_')
+        assert bytes(storage.read_mug(name)) == b'new'
+
+    def test_mug_shot_directory_migrated(self, app_config, tmpdir):
+        # Given mug shots saved by a version without the pack
+        mugs = tmpdir.mkdir('mugs')
+        mugs.join('1.jpg').write_binary(b'old')
+        mugs.join('1_150419224140.jpg').write_binary(b'new')
+        # When the pack is first used
+        app_config.namespace.update_values({
+            'path.mug_pack_dir': str(tmpdir.join('pack')),
+            'path.mug_shot_dir': str(mugs),
+        })
+        name = storage.most_recent_mug(make_inmate('1'))
+        # Then they are found in it
+        assert name == '1_150419224140.jpg'
+        assert bytes(storage.read_mug(name)) == b'new'
+        assert tmpdir.join('pack', 'migrated').check()
+
+    def test_phash_computed_once(self, pack_config):
+        # Given a mug shot saved to the pack
+        with mock.patch.object(
+                storage.images,
+                'perceptual_hash',
+                return_value='ffff0000ffff0000',
+        ) as mock_phash:
+            first = make_inmate('1')
+            first.mug = b'image'
+            storage.save_mug_shots([first])
+            storage._phashes.clear()
+            # When the same mug shot is seen again, and logged
+            again = make_inmate('1')
+            again.mug = b'image'
+            storage.save_mug_shots([again])
+            storage.log_inmates([again], recent=True)
+        # Then the hash stored with it is used
+        assert mock_phash.call_count == 1
+        assert again.phash == 'ffff0000ffff0000'
+        assert storage.read_log(recent=True)[0]['phash'] == again.phash
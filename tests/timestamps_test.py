@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+import pytest
+
+from dentonpolice import timestamps
+
+
+class TestParse(object):
+
+    @pytest.mark.parametrize('parse,text,layout', [
+        (timestamps.parse_arrest, '09/07/2012 15:30:57',
+         timestamps.ARREST_FORMAT),
+        (timestamps.parse_date, '11/26/1988', timestamps.DATE_FORMAT),
+        (timestamps.parse_tweet_time, 'Sun Apr 19 22:50:00 +0000 2015',
+         timestamps.TWEET_FORMAT),
+    ])
+    def test_same_as_strptime(self, parse, text, layout):
+        assert parse(text) == datetime.datetime.strptime(text, layout)
+
+    def test_falls_back_to_strptime(self):
+        # Not zero padded, so not the fixed layout, but still valid.
+        assert timestamps.parse_arrest('9/7/2012 15:30:57') == (
+            datetime.datetime(2012, 9, 7, 15, 30, 57)
+        )
+
+    @pytest.mark.parametrize('text', [
+        '13/07/2012 15:30:57',
+        '+9/07/2012 15:30:57',
+        '09/07/2012',
+        '',
+    ])
+    def test_invalid(self, text):
+        with pytest.raises(ValueError):
+            timestamps.parse_arrest(text)
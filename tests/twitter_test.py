@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import mock
+import pytest
+import staticconf.testing
+
+from dentonpolice import inmate
+from dentonpolice import twitter
+
+
+@pytest.fixture
+def app_config(request):
+    mock_configuration = staticconf.testing.MockConfiguration({
+        'twitter.enabled': True,
+        'twitter.api_key': 'key',
+        'twitter.api_secret': 'secret',
+        'twitter.access_token': 'token',
+        'twitter.access_token_secret': 'token_secret',
+    })
+    mock_configuration.setup()
+    request.addfinalizer(mock_configuration.teardown)
+    return mock_configuration
+
+
+@pytest.fixture
+def mock_twython(request):
+    patcher = mock.patch('twython.Twython', autospec=True)
+    mock_instance = patcher.start()
+    request.addfinalizer(patcher.stop)
+    request.addfinalizer(twitter._twitter_clients.clear)
+    return mock_instance
+
+
+class TestGetTwitterClient(object):
+
+    def test_client_is_reused(self, app_config, mock_twython):
+        first = twitter.get_twitter_client()
+        second = twitter.get_twitter_client()
+        assert first is second
+        assert mock_twython.call_count == 1
+
+    def test_new_client_if_credentials_change(self, app_config, mock_twython):
+        twitter.get_twitter_client()
+        app_config.namespace.update_values({'twitter.api_key': 'new_key'})
+        twitter.get_twitter_client()
+        assert mock_twython.call_count == 2
+
+    def test_disabled(self, app_config, mock_twython):
+        app_config.namespace.update_values({'twitter.enabled': False})
+        assert twitter.get_twitter_client() is None
+
+
+class TestGetTwitterMessage(object):
+
+    def test_caption(self):
+        # Given an inmate with a few charges
+        subject = inmate.Inmate(
+            id='1',
+            name='DOE, JANE',
+            DOB='11/26/1988',
+            arrest='09/07/2012 15:30:57',
+            seen='2012-09-07 23:04:03.017000',
+            charges=[
+                {
+                    'amount': '$1500.00',
+                    'charge': 'DPD / FAIL TO MAINTAIN INSURANCE',
+                    'type': 'BOND',
+                },
+                {
+                    'amount': '$569.00',
+                    'charge': 'DENTON CO SO WARRANT / THEFT <$50',
+                    'type': 'BOND',
+                },
+            ],
+        )
+        # When we make the caption for the tweet
+        result = twitter.get_twitter_message(subject)
+        # Then the caption should be shortened and formatted
+        assert result.split('\n') == [
+            '09/07/2012 15:30:57',
+            'Jane, 23 yrs old ♐',
+            'Bond: $2,069',
+            'FAIL TO MAINTAIN INSURANCE',
+            'THEFT < $50',
+            # Room is left for the petition link.
+            't.co/rWrSAYThKV',
+        ]
+        # And the inmate's charges should be left as they were
+        assert subject.charges[1]['charge'] == (
+            'DENTON CO SO WARRANT / THEFT <$50'
+        )
+
+
+class TestShortenCharge(object):
+
+    @pytest.mark.parametrize(
+        argnames='charge,expected',
+        argvalues=[
+            ('DPD / PUBLIC INTOXICATION', 'PUBLIC INTOXICATION'),
+            ('LEWISVILLE PD WARRANTS / THEFT', 'THEFT'),
+            ('LOCAL MUNICIPAL WARRANT', 'LOCAL MUNICIPAL WARRANT'),
+        ],
+    )
+    def test_shorten(self, charge, expected):
+        assert twitter.shorten_charge(charge) == expected
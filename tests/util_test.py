@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+import time
+
+import pytest
+
+from dentonpolice import util
+
+
+class TestDeadline(object):
+
+    def test_sub_second_precision(self):
+        deadline = util.Deadline(seconds=0.05)
+        assert 0 < deadline.remaining() <= 0.05
+        assert not deadline.expired
+        time.sleep(0.06)
+        assert deadline.expired
+        assert deadline.remaining() == 0
+
+    def test_check_raises_after_expiry(self):
+        deadline = util.Deadline(seconds=0)
+        with pytest.raises(TimeoutError):
+            deadline.check()
+
+    def test_timeout_capped(self):
+        deadline = util.Deadline(seconds=10)
+        assert deadline.timeout(cap=0.5) == 0.5
+        assert 9 < deadline.timeout() <= 10
+
+    def test_timeout_raises_after_expiry(self):
+        deadline = util.Deadline(seconds=0)
+        with pytest.raises(TimeoutError):
+            deadline.timeout(cap=1)
+
+    def test_works_outside_main_thread(self):
+        # Given a deadline checked in a worker thread
+        errors = []
+
+        def worker():
+            deadline = util.Deadline(seconds=0.01)
+            time.sleep(0.02)
+            try:
+                deadline.check()
+            except TimeoutError as error:
+                errors.append(error)
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        # Then it should still expire
+        assert len(errors) == 1
+
+    def test_wait_for(self):
+        deadline = util.Deadline(seconds=0.05)
+
+        async def slow():
+            await asyncio.sleep(1)
+        with pytest.raises(TimeoutError):
+            asyncio.run(deadline.wait_for(slow()))
+
+    def test_wait_for_result(self):
+        deadline = util.Deadline(seconds=1)
+
+        async def fast():
+            return 'done'
+        assert asyncio.run(deadline.wait_for(fast())) == 'done'